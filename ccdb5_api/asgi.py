@@ -0,0 +1,19 @@
+"""
+ASGI config for ccdb5_api project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, serving the async views of complaint_search. Run it with an
+ASGI server, for example ``uvicorn ccdb5_api.asgi:application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ccdb5_api.asgi_settings")
+
+application = get_asgi_application()
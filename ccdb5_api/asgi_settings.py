@@ -0,0 +1,5 @@
+from .settings import *  # noqa
+
+
+# Route the complaint_search endpoints to their async views
+ROOT_URLCONF = 'ccdb5_api.asgi_urls'
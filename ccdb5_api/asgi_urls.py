@@ -0,0 +1,12 @@
+"""ccdb5_api URL Configuration of the ASGI application
+
+The same routes as ccdb5_api.urls, with the complaint_search async views.
+"""
+from django.contrib import admin
+from django.urls import include, re_path
+
+
+urlpatterns = [
+    re_path(r'^admin/', admin.site.urls),
+    re_path(r'^', include('complaint_search.async_urls')),
+]
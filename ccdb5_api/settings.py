@@ -54,6 +54,7 @@ MIDDLEWARE = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'complaint_search.middleware.TimingMiddleware',
 )
 
 if django.VERSION < (2, 0):  # pragma: no cover
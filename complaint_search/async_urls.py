@@ -0,0 +1,45 @@
+from django.urls import re_path
+from django.views.generic.base import RedirectView
+
+import complaint_search.async_views
+import complaint_search.views
+
+
+# The routes of complaint_search.urls, served by the async views
+app_name = "complaint_search"
+
+urlpatterns = [
+    re_path(
+        r'^_suggest_company',
+        complaint_search.async_views.suggest_company,
+        name="suggest_company"
+    ),
+    re_path(
+        r'^_suggest_zip',
+        complaint_search.async_views.suggest_zip,
+        name="suggest_zip"
+    ),
+    re_path(
+        r'^_suggest', complaint_search.async_views.suggest, name="suggest"
+    ),
+    re_path(
+        r'^_buckets',
+        complaint_search.async_views.facet_buckets,
+        name="facet_buckets"
+    ),
+    re_path(
+        r'^metrics$', complaint_search.views.metrics, name="metrics"
+    ),
+    re_path(
+        r'^(?P<id>[0-9]+)$',
+        complaint_search.async_views.document,
+        name="complaint"
+    ),
+    re_path(r'^$', complaint_search.async_views.search, name="search"),
+    re_path(r'^geo/states', complaint_search.async_views.states,
+            name="states"),
+    re_path(r'^geo',
+            RedirectView.as_view(url='/geo/states'), name="geo"),
+    re_path(r'^trends', complaint_search.async_views.trends,
+            name="trends"),
+]
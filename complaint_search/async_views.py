@@ -0,0 +1,213 @@
+import os
+
+from django.http import HttpResponse, HttpResponseRedirect
+
+from asgiref.sync import sync_to_async
+from complaint_search import es_async, timing, views
+from complaint_search.decorators import async_catch_es_error
+from complaint_search.defaults import (
+    AGG_EXCLUDE_FIELDS,
+    EXPORT_FORMATS,
+    FORMAT_CONTENT_TYPE_MAP,
+)
+from complaint_search.serializer import (
+    FacetBucketsInputSerializer,
+    SearchInputSerializer,
+    SuggestFilterInputSerializer,
+    SuggestInputSerializer,
+    TrendsInputSerializer,
+)
+from complaint_search.throttling import (
+    DocumentAnonRateThrottle,
+    SearchAnonRateThrottle,
+)
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+
+# -----------------------------------------------------------------------------
+# Asynchronous views
+#
+# The views of complaint_search.views as Django async views, served from
+# ccdb5_api/asgi.py. They parse and validate requests the same way, then
+# await es_async so a process can keep many Elasticsearch requests in
+# flight.
+#
+# Exports stream from blocking scrolls, and Django 3.2 iterates streaming
+# responses on the event loop, so an export would stall every other request
+# of the process. They are redirected to ASGI_EXPORT_URL, the search
+# endpoint of the WSGI application, or refused without one.
+# -----------------------------------------------------------------------------
+
+_EXPORT_URL = os.environ.get('ASGI_EXPORT_URL', '')
+
+_EXPORT_MEDIA_TYPES = set(FORMAT_CONTENT_TYPE_MAP.values()) - {
+    'application/json'
+}
+
+
+def _json_response(data, status=status.HTTP_200_OK, headers=None):
+    with timing.phase('serialize'):
+        content = JSONRenderer().render(data)
+    response = HttpResponse(
+        content,
+        status=status,
+        content_type='application/json'
+    )
+    for header, value in (headers or {}).items():
+        response[header] = value
+    return response
+
+
+def _export_response(request):
+    if _EXPORT_URL:
+        query = request.META.get('QUERY_STRING', '')
+        return HttpResponseRedirect(
+            '{}?{}'.format(_EXPORT_URL, query) if query else _EXPORT_URL
+        )
+    return _json_response(
+        {'detail': 'Exports are not available from this server'},
+        status=status.HTTP_406_NOT_ACCEPTABLE
+    )
+
+
+def _is_export(request):
+    if request.GET.get('format') in EXPORT_FORMATS:
+        return True
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return any(media_type in accept for media_type in _EXPORT_MEDIA_TYPES)
+
+
+async def _throttled(request, throttle_classes):
+    """Return the response of the first throttle refusing the request"""
+    drf_request = Request(request)
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        allowed = await sync_to_async(throttle.allow_request)(
+            drf_request, None
+        )
+        if not allowed:
+            exc = Throttled(throttle.wait())
+            return _json_response(
+                {'detail': exc.detail},
+                status=exc.status_code,
+                headers={'Retry-After': '%d' % exc.wait}
+            )
+    return None
+
+
+async def _validated_response(serializer, function, *args, **kwargs):
+    if not serializer.is_valid():
+        return _json_response(
+            serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = await function(*args, **serializer.validated_data, **kwargs)
+    return _json_response(results, headers=views._buildHeaders())
+
+
+# -----------------------------------------------------------------------------
+# Request Handlers: Complaints
+
+@async_catch_es_error
+async def search(request):
+    if _is_export(request):
+        return _export_response(request)
+
+    throttled = await _throttled(request, [SearchAnonRateThrottle])
+    if throttled:
+        return throttled
+
+    data = views._parse_query_params(request.GET)
+    data['format'] = 'default'
+    return await _validated_response(
+        SearchInputSerializer(data=data), es_async.search,
+        agg_exclude=AGG_EXCLUDE_FIELDS
+    )
+
+
+@async_catch_es_error
+async def suggest(request):
+    data = views._parse_query_params(request.GET, ['text', 'size'])
+    return await _validated_response(
+        SuggestInputSerializer(data=data), es_async.suggest
+    )
+
+
+@async_catch_es_error
+async def suggest_zip(request):
+    validVars = list(views.QPARAMS_VARS)
+    validVars.append('text')
+
+    data = views._parse_query_params(request.GET, validVars)
+    if data.get('text'):
+        data['text'] = data['text'].upper()
+    return await _validated_response(
+        SuggestFilterInputSerializer(data=data), es_async.filter_suggest,
+        'zip_code'
+    )
+
+
+@async_catch_es_error
+async def suggest_company(request):
+    validVars = list(views.QPARAMS_VARS)
+    validVars.append('text')
+
+    data = views._parse_query_params(request.GET, validVars)
+
+    # Company filters should not be applied to their own aggregation filter
+    data.pop('company', None)
+
+    if data.get('text'):
+        data['text'] = data['text'].upper()
+    return await _validated_response(
+        SuggestFilterInputSerializer(data=data), es_async.filter_suggest,
+        'company.suggest', 'company.raw'
+    )
+
+
+@async_catch_es_error
+async def facet_buckets(request):
+    validVars = list(views.QPARAMS_VARS)
+    validVars.append('facet')
+
+    data = views._parse_query_params(request.GET, validVars)
+    return await _validated_response(
+        FacetBucketsInputSerializer(data=data), es_async.facet_buckets
+    )
+
+
+@async_catch_es_error
+async def document(request, id):
+    throttled = await _throttled(request, [DocumentAnonRateThrottle])
+    if throttled:
+        return throttled
+
+    results = await es_async.document(id)
+    return _json_response(results, headers=views._buildHeaders())
+
+
+# -----------------------------------------------------------------------------
+# Request Handlers: Geo
+
+@async_catch_es_error
+async def states(request):
+    data = views._parse_query_params(request.GET)
+    return await _validated_response(
+        SearchInputSerializer(data=data), es_async.states_agg,
+        agg_exclude=AGG_EXCLUDE_FIELDS
+    )
+
+
+# -----------------------------------------------------------------------------
+# Request Handlers: Trends
+
+@async_catch_es_error
+async def trends(request):
+    data = views._parse_query_params(request.GET)
+    return await _validated_response(
+        TrendsInputSerializer(data=data), es_async.trends,
+        agg_exclude=AGG_EXCLUDE_FIELDS
+    )
@@ -0,0 +1,156 @@
+import bisect
+import logging
+import threading
+
+from complaint_search.metrics import REGISTRY
+
+
+# -----------------------------------------------------------------------------
+# Autocomplete
+#
+# Company and zip code suggestions without filters only depend on the
+# values of the field and how many complaints have each, so they are
+# answered from an in-process index of every value instead of a wildcard
+# or prefix search per keystroke. The index of a field is loaded from a
+# terms aggregation on first use, and reloaded in the background when the
+# index is refreshed.
+# -----------------------------------------------------------------------------
+
+# Params of suggestions that don't filter complaints
+UNFILTERED_PARAMS = frozenset((
+    'field',
+    'format',
+    'frm',
+    'no_aggs',
+    'no_highlight',
+    'size',
+    'sort',
+    'text',
+))
+
+log = logging.getLogger(__name__)
+
+SUGGESTIONS = REGISTRY.counter(
+    'ccdb_autocomplete_requests_total',
+    'Suggestions answered from the autocomplete index or by Elasticsearch',
+    ('field', 'source')
+)
+
+
+def answerable(params):
+    """Whether the suggestions of these params can come from an index"""
+    text = params.get('text')
+    # Wildcards and line breaks mean something else to the index
+    return bool(text) and set(params) <= UNFILTERED_PARAMS and \
+        not any(c in text for c in '*?\\\n')
+
+
+class SuggestIndex(object):
+    """The values of a field in the order of their complaint counts, searched
+    by prefix or anywhere in the value.
+
+    Values are kept upper-cased in a single string, one per line, so a search
+    is a few str.find calls whatever the number of values.
+    """
+
+    def __init__(self, values, prefix=False):
+        self.values = list(values)
+        self.prefix = prefix
+
+        starts = []
+        lines = []
+        position = 0
+        for value in self.values:
+            starts.append(position)
+            line = '\n' + value.upper()
+            lines.append(line)
+            position += len(line)
+        self._starts = starts
+        self._text = ''.join(lines)
+
+    def search(self, text, size=10):
+        needle = text.upper()
+        if self.prefix:
+            needle = '\n' + needle
+
+        matches = []
+        position = 0
+        while len(matches) < size:
+            position = self._text.find(needle, position)
+            if position == -1:
+                break
+            index = bisect.bisect_right(self._starts, position) - 1
+            matches.append(self.values[index])
+            # Each value is returned once
+            if index + 1 == len(self._starts):
+                break
+            position = self._starts[index + 1]
+        return matches
+
+
+class AutocompleteIndexes(object):
+    """The SuggestIndex of each field, for the current version of the
+    complaint index"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # Per key, the version of the complaint index and its SuggestIndex
+        self._indexes = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def _load(self, key, version, load, prefix):
+        try:
+            index = SuggestIndex(load(), prefix)
+            with self._lock:
+                self._indexes[key] = (version, index)
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+
+    def _load_in_background(self, key, version, load, prefix):
+        try:
+            self._load(key, version, load, prefix)
+        except Exception:
+            log.exception('Loading the autocomplete index of %s failed', key)
+
+    def get(self, key, version, load, prefix=False):
+        """The index of `key` for `version`, or None while it is loading.
+        `load` returns the values of the field in the order of their
+        complaint counts.
+
+        The first index of a key is loaded before returning it, or None when
+        loading it fails. Later versions are loaded in the background, so
+        requests are answered by Elasticsearch until they are ready rather
+        than from the previous index, whose suggestions could then be cached
+        for the new version.
+        """
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+            if key in self._loading:
+                return None
+            self._loading.add(key)
+
+        if entry is None:
+            try:
+                self._load(key, version, load, prefix)
+            except Exception:
+                # Elasticsearch answers until a later request loads it
+                log.exception(
+                    'Loading the autocomplete index of %s failed', key
+                )
+                return None
+            return self._indexes[key][1]
+
+        threading.Thread(
+            target=self._load_in_background,
+            args=(key, version, load, prefix),
+            daemon=True
+        ).start()
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
@@ -1,5 +1,8 @@
 import logging
 
+from django.http import JsonResponse
+
+from complaint_search.es_interface import MultiSearchError
 from elasticsearch import TransportError
 from rest_framework import status
 from rest_framework.response import Response
@@ -8,26 +11,55 @@ from rest_framework.response import Response
 log = logging.getLogger(__name__)
 
 
+def _error_response_data(error):
+    """Log an error raised by a view and return the response data and status
+    code reporting it."""
+    if isinstance(error, MultiSearchError):
+        for position, status_code, es_error in error.errors:
+            log.error('Search %s of msearch failed with %s: %s',
+                      position, status_code, es_error)
+
+        # Elasticsearch rejecting every failed search as a bad request
+        # means the query itself could not be run
+        if all(status_code == status.HTTP_400_BAD_REQUEST
+               for position, status_code, es_error in error.errors):
+            return {
+                "error": 'Elasticsearch could not run your search'
+            }, status.HTTP_400_BAD_REQUEST
+        return {
+            "error": 'There was an error calling Elasticsearch'
+        }, 424  # HTTP_424_FAILED_DEPENDENCY
+
+    log.error(error)
+    if isinstance(error, TransportError):
+        return {
+            "error": 'There was an error calling Elasticsearch'
+        }, 424  # HTTP_424_FAILED_DEPENDENCY
+    return {
+        "error": 'There was a problem retrieving your request'
+    }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
 def catch_es_error(function):
     def wrap(request, *args, **kwargs):
         try:
             return function(request, *args, **kwargs)
-        except TransportError as te:
-            log.error(te)
-
-            status_code = 424  # HTTP_424_FAILED_DEPENDENCY
-            res = {
-                "error": 'There was an error calling Elasticsearch'
-            }
-            return Response(res, status=status_code)
         except Exception as e:
-            log.error(e)
-
-            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-            res = {
-                "error": 'There was a problem retrieving your request'
-            }
+            res, status_code = _error_response_data(e)
             return Response(res, status=status_code)
     wrap.__doc__ = function.__doc__
     wrap.__name__ = function.__name__
     return wrap
+
+
+def async_catch_es_error(function):
+    """catch_es_error for async views, which return Django responses"""
+    async def wrap(request, *args, **kwargs):
+        try:
+            return await function(request, *args, **kwargs)
+        except Exception as e:
+            res, status_code = _error_response_data(e)
+            return JsonResponse(res, status=status_code)
+    wrap.__doc__ = function.__doc__
+    wrap.__name__ = function.__name__
+    return wrap
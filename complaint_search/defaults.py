@@ -41,6 +41,9 @@ EXCLUDE_PREFIX = 'not_'
 EXPORT_FORMATS = (
     'csv',
     'json',
+    'ndjson',
+    'csv.gz',
+    'ndjson.gz',
 )
 
 CSV_ORDERED_HEADERS = OrderedDict([
@@ -66,11 +69,33 @@ CSV_ORDERED_HEADERS = OrderedDict([
 
 AGG_EXCLUDE_FIELDS = ['company', 'zip_code']
 
-CHUNK_SIZE = 512
+# Buckets returned by the search aggregation of a field, fields not listed
+# return all of their buckets. Further buckets are loaded with the _buckets
+# API.
+AGG_BUCKET_SIZES = {
+    'company': 100,
+    'zip_code': 100,
+}
+
+# Characters buffered before an export chunk is streamed
+CHUNK_SIZE = 64 * 1024
+
+# Formats of the unfiltered export snapshots built by default
+EXPORT_SNAPSHOT_FORMATS = (
+    'csv',
+    'json',
+    'ndjson',
+)
+
+# zlib compression level of gzipped exports
+GZIP_LEVEL = 6
 
 FORMAT_CONTENT_TYPE_MAP = {
     "json": "application/json",
     "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "csv.gz": "application/gzip",
+    "ndjson.gz": "application/gzip",
 }
 
 DATA_SUB_LENS_MAP = {
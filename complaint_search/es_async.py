@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from complaint_search import es_interface
+
+
+# -----------------------------------------------------------------------------
+# Asynchronous Elasticsearch calls
+#
+# Awaitable versions of the es_interface functions for the ASGI views.
+# elasticsearch-py 2 has no asyncio client, so the calls run on a pool of
+# ASYNC_ES_THREADS threads while the event loop serves other requests. A
+# request waiting on Elasticsearch holds one of these threads instead of a
+# worker process. ES_POOL_SIZE should be raised to match.
+# -----------------------------------------------------------------------------
+
+_ASYNC_ES_THREADS = int(os.environ.get('ASYNC_ES_THREADS', '100'))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=_ASYNC_ES_THREADS)
+
+
+async def _run(function, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    # Runs in the context of the request, to record its timings
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _EXECUTOR, functools.partial(context.run, function, *args, **kwargs)
+    )
+
+
+async def search(agg_exclude=None, **kwargs):
+    return await _run(es_interface.search, agg_exclude, **kwargs)
+
+
+async def suggest(text=None, size=6):
+    return await _run(es_interface.suggest, text, size)
+
+
+async def filter_suggest(filterField, display_field=None, **kwargs):
+    return await _run(
+        es_interface.filter_suggest, filterField, display_field, **kwargs
+    )
+
+
+async def facet_buckets(facet, **kwargs):
+    return await _run(es_interface.facet_buckets, facet, **kwargs)
+
+
+async def document(complaint_id):
+    return await _run(es_interface.document, complaint_id)
+
+
+async def states_agg(agg_exclude=None, **kwargs):
+    return await _run(es_interface.states_agg, agg_exclude, **kwargs)
+
+
+async def trends(agg_exclude=None, **kwargs):
+    return await _run(es_interface.trends, agg_exclude, **kwargs)
@@ -1,9 +1,12 @@
 import abc
-import copy
+import functools
+import os
 import re
 from collections import OrderedDict, defaultdict
 
+from complaint_search import timing
 from complaint_search.defaults import (
+    AGG_BUCKET_SIZES,
     DATA_SUB_LENS_MAP,
     DELIMITER,
     EXCLUDE_PREFIX,
@@ -11,6 +14,94 @@ from complaint_search.defaults import (
     PARAMS,
     SOURCE_FIELDS,
 )
+from complaint_search.metrics import REGISTRY, stats_counter
+from complaint_search.result_cache import ResultCache
+
+
+# Bodies built for the last BODY_CACHE_SIZE sets of params (0 disables).
+# Bodies only depend on the params, so they never expire.
+_BODY_CACHE = ResultCache(
+    max_entries=int(os.environ.get('BODY_CACHE_SIZE', '512')),
+    ttl=float('inf')
+)
+
+
+@REGISTRY.collector
+def _body_cache_metrics():
+    return [stats_counter(
+        'ccdb_body_cache_total', 'Query bodies found in the body cache',
+        'builder', _BODY_CACHE.stats
+    )]
+
+
+# Params hold scalars and lists of scalars
+def _parse_sizes(value):
+    sizes = {}
+    for item in value.split(','):
+        if item.strip():
+            field_name, size = item.split(':')
+            sizes[field_name.strip()] = int(size)
+    return sizes
+
+
+# AGG_BUCKET_SIZES overrides the bucket sizes of the defaults, as in
+# "company:50,zip_code:20". Shards return AGG_SHARD_SIZE_FACTOR times as many
+# buckets, plus 10, so the counts of the top buckets stay accurate.
+_AGG_BUCKET_SIZES = dict(
+    AGG_BUCKET_SIZES, **_parse_sizes(os.environ.get('AGG_BUCKET_SIZES', ''))
+)
+_AGG_SHARD_SIZE_FACTOR = float(os.environ.get('AGG_SHARD_SIZE_FACTOR', '1.5'))
+
+
+def terms_agg(es_field_name, size):
+    terms = {
+        "field": es_field_name,
+        "size": size
+    }
+    # A size of 0 returns every bucket
+    if size:
+        terms["shard_size"] = int(size * _AGG_SHARD_SIZE_FACTOR) + 10
+    return terms
+
+
+# Params hold scalars and lists of scalars
+def _freeze_params(params):
+    return tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in params.items()
+    ))
+
+
+def cached_body(build):
+    """Reuse the body built by a builder for the same params.
+
+    Nested values of cached bodies are shared between requests, so callers
+    may only replace the top level keys of the body they are given.
+    """
+    def cached_build(self):
+        if not _BODY_CACHE.enabled:
+            return build(self)
+
+        name = type(self).__name__
+        # Lists are kept in order, so cached bodies are identical to built
+        # ones
+        key = (
+            name,
+            _freeze_params(self.params),
+            tuple(getattr(self, 'exclude', ()))
+        )
+        body = _BODY_CACHE.get(name, key)
+        if body is None:
+            body = build(self)
+            _BODY_CACHE.set(key, body)
+        return dict(body)
+
+    @functools.wraps(build)
+    def wrapper(self):
+        with timing.phase('build'):
+            return cached_build(self)
+
+    return wrapper
 
 
 def build_search_terms(search_term, field):
@@ -89,9 +180,15 @@ class BaseBuilder(object):
 
     def __init__(self):
         self.params = {}
+        self._clauses = None
+        self._date_filters = None
 
     def add(self, **kwargs):
         self.params.update(**kwargs)
+        # Clauses are built once per set of params and shared by all the
+        # filters of the body
+        self._clauses = None
+        self._date_filters = None
 
     @abc.abstractmethod
     def build(self):
@@ -150,24 +247,37 @@ class BaseBuilder(object):
 
             return f_list
 
+    # This creates the field level query that must match
+    def _build_field_clause(self, field, value_list):
+        clauses = self._build_bool_clauses(field, value_list)
+        if not self._has_child(field):
+            return clauses
+
+        # These get added as compound OR clauses
+        return {"bool": {"should": clauses}}
+
     # This creates two dictionaries where the keys are the field name
     # dictionary 1: the conditions for including a record in the query
     # dictionary 2: the conditions for excluding a record in the query
 
     def _build_clauses_dictionary(self):
+        if self._clauses is not None:
+            return self._clauses
+
         include_clauses = OrderedDict()
         exclude_clauses = OrderedDict()
         for item in self._OPTIONAL_FILTERS:
             values = self.params.get(item)
             if values:
-                include_clauses[item] = self._build_bool_clauses(item, values)
+                include_clauses[item] = self._build_field_clause(item, values)
 
             # handle the not item case
             values = self.params.get(EXCLUDE_PREFIX + item)
             if values:
-                exclude_clauses[item] = self._build_bool_clauses(item, values)
+                exclude_clauses[item] = self._build_field_clause(item, values)
 
-        return include_clauses, exclude_clauses
+        self._clauses = include_clauses, exclude_clauses
+        return self._clauses
 
     def _build_date_range_filter(self, date_min, date_max, es_field_name):
         # 2019-10-17 JMF - Tests fails when using "from builtins import str"
@@ -187,45 +297,39 @@ class BaseBuilder(object):
 
         return date_clause
 
+    def _build_date_filters(self):
+        if self._date_filters is None:
+            # date_received
+            date_received = self._build_date_range_filter(
+                self.params.get("date_received_min"),
+                self.params.get("date_received_max"),
+                "date_received")
+
+            company_filter = self._build_date_range_filter(
+                self.params.get("company_received_min"),
+                self.params.get("company_received_max"),
+                "date_sent_to_company")
+
+            self._date_filters = date_received, company_filter
+
+        return self._date_filters
+
     def _build_dsl_filter(self, include_clauses, exclude_clauses,
                           include_dates=True, single_not_clause=True):
         andClauses = []
 
-        # date_received
-        date_received = self._build_date_range_filter(
-            self.params.get("date_received_min"),
-            self.params.get("date_received_max"),
-            "date_received")
+        date_received, company_filter = self._build_date_filters()
 
         if date_received and include_dates:
             andClauses.append(date_received)
 
-        company_filter = self._build_date_range_filter(
-            self.params.get("company_received_min"),
-            self.params.get("company_received_max"), "date_sent_to_company")
-
         if company_filter:
             andClauses.append(company_filter)
 
-        # Create filter clauses for all other filters
-        for item, clauses in include_clauses.items():
-            if not self._has_child(item):
-                # Create the field level AND query that must match
-                andClauses.append(clauses)
-            else:
-                # These get added as compound OR clauses
-                orClause = {"bool": {"should": clauses}}
-                andClauses.append(orClause)
-
-        notClauses = []
-        for item, clauses in exclude_clauses.items():
-            if not self._has_child(item):
-                # Create the field level AND query that must match
-                notClauses.append(clauses)
-            else:
-                # These get added as compound OR clauses
-                orClause = {"bool": {"should": clauses}}
-                notClauses.append(orClause)
+        # Add filter clauses for all other filters
+        andClauses.extend(include_clauses.values())
+
+        notClauses = list(exclude_clauses.values())
 
         # if there are multiple not clauses, they need to be grouped
         # ~A AND ~B AND ~C is not the same as ~(A AND B AND C)
@@ -238,7 +342,8 @@ class BaseBuilder(object):
 
 class SearchBuilder(BaseBuilder):
     def __init__(self):
-        self.params = copy.deepcopy(PARAMS)
+        BaseBuilder.__init__(self)
+        self.params = dict(PARAMS)
 
     def _build_highlight(self):
         highlight = {
@@ -261,7 +366,11 @@ class SearchBuilder(BaseBuilder):
 
         sort_field, sort_order = self.params.get("sort").rsplit("_", 1)
         sort_field = sort_field_mapping.get(sort_field, "_score")
-        return [{sort_field: {"order": sort_order}}]
+        # complaint_id breaks ties so search_after cursors are stable
+        return [
+            {sort_field: {"order": sort_order}},
+            {"complaint_id": {"order": sort_order}}
+        ]
 
     def _build_source(self):
         source = list(SOURCE_FIELDS)
@@ -274,6 +383,7 @@ class SearchBuilder(BaseBuilder):
             source.append('date_sent_to_company_formatted')
         return source
 
+    @cached_body
     def build(self):
         search = {
             "from": self.params.get("frm"),
@@ -299,6 +409,12 @@ class SearchBuilder(BaseBuilder):
         if not self.params.get("size") == 0:
             search["sort"] = self._build_sort()
 
+        # search_after cursor replaces from-based paging
+        search_after = self.params.get("search_after")
+        if search_after and not self.params.get("size") == 0:
+            search["from"] = 0
+            search["search_after"] = search_after
+
         # query
         search_term = self.params.get("search_term")
         if search_term:
@@ -310,6 +426,7 @@ class SearchBuilder(BaseBuilder):
 
 class PostFilterBuilder(BaseBuilder):
 
+    @cached_body
     def build(self):
         include_clauses, exclude_clauses = self._build_clauses_dictionary()
         return self._build_dsl_filter(include_clauses, exclude_clauses)
@@ -334,90 +451,154 @@ class AggregationBuilder(BaseBuilder):
 
     def __init__(self):
         BaseBuilder.__init__(self)
-        self.include_clauses = None
-        self.exclude_clauses = None
         self.exclude = []
 
     def add_exclude(self, field_name_list):
         self.exclude += field_name_list
 
     def build_parent_child_field_agg(
-        self, agg_heading_name, es_parent_name, es_child_name
+        self, agg_heading_name, es_parent_name, es_child_name,
+        parent_size=0, child_size=0
     ):
         return {
             agg_heading_name: {
-                "terms": {
-                    "field": es_parent_name,
-                    "size": 0
-                },
+                "terms": terms_agg(es_parent_name, parent_size),
                 "aggs": {
                     es_child_name: {
-                        "terms": {
-                            "field": es_child_name,
-                            "size": 0
-                        }
+                        "terms": terms_agg(es_child_name, child_size)
                     }
                 }
             }
         }
 
-    def build_one(self, field_name):
-        # Lazy initialization
-        if not self.include_clauses:
-            self.include_clauses, self.exclude_clauses = \
-                self._build_clauses_dictionary()
-
-        field_aggs = {}
-
+    # size defaults to the configured bucket size of the field
+    def build_terms(self, field_name, size=None):
+        if size is None:
+            size = _AGG_BUCKET_SIZES.get(field_name, 0)
         es_field_name = self._OPTIONAL_FILTERS_PARAM_TO_ES_MAP.get(
             field_name, field_name
         )
-        es_child_name = None
 
         if field_name in self._OPTIONAL_FILTERS_CHILD_MAP:
-            es_child_name = self._OPTIONAL_FILTERS_PARAM_TO_ES_MAP.get(
-                self._OPTIONAL_FILTERS_CHILD_MAP.get(field_name))
-            field_aggs["aggs"] = self.build_parent_child_field_agg(
+            child_name = self._OPTIONAL_FILTERS_CHILD_MAP.get(field_name)
+            return self.build_parent_child_field_agg(
                 field_name,
                 es_field_name,
-                es_child_name
+                self._OPTIONAL_FILTERS_PARAM_TO_ES_MAP.get(child_name),
+                size,
+                _AGG_BUCKET_SIZES.get(child_name, 0)
             )
-        else:
-            field_aggs["aggs"] = {
-                field_name: {
-                    "terms": {
-                        "field": es_field_name,
-                        "size": 0
-                    }
-                }
+
+        return {
+            field_name: {
+                "terms": terms_agg(es_field_name, size)
             }
+        }
+
+    def build_one(self, field_name, size=None):
+        include_clauses, exclude_clauses = self._build_clauses_dictionary()
+
+        field_aggs = {}
+        field_aggs["aggs"] = self.build_terms(field_name, size)
 
         # Create a subset of the filters
         incl_subset = {
             k: v
-            for k, v in self.include_clauses.items()
+            for k, v in include_clauses.items()
             if k != field_name
         }
 
         # Add the aggregation filters
         field_aggs['filter'] = self._build_dsl_filter(incl_subset,
-                                                      self.exclude_clauses)
+                                                      exclude_clauses)
         return field_aggs
 
+    def _agg_fields(self):
+        if not self.exclude:
+            return self._AGG_FIELDS
+        return [
+            field_name for field_name in self._AGG_FIELDS
+            if field_name not in self.exclude or field_name in self.params
+        ]
+
+    @cached_body
     def build(self):
         aggs = {}
 
-        agg_fields = self._AGG_FIELDS
-        if self.exclude:
-            agg_fields = [
-                field_name for field_name in self._AGG_FIELDS
-                if field_name not in self.exclude or field_name in self.params
-            ]
-        for field_name in agg_fields:
+        for field_name in self._agg_fields():
             aggs[field_name] = self.build_one(field_name)
 
         return aggs
 
+    # Restore the shape of the aggregations of the response, one filter
+    # bucket per field holding its terms
+    def flatten(self, aggregations):
+        return aggregations
+
+
+class SharedFilterAggregationBuilder(AggregationBuilder):
+    """Builds the aggregations of AggregationBuilder under a single filter
+    holding the clauses shared by every field. Only fields with their own
+    filter get a nested filter; the other fields are grouped under one.
+    """
+    _SHARED_AGG = 'shared_filter'
+    _OTHER_FIELDS_AGG = 'other_fields'
+
+    @cached_body
+    def build(self):
+        include_clauses, exclude_clauses = self._build_clauses_dictionary()
+        agg_fields = self._agg_fields()
+
+        # Clauses of fields without aggregations apply to every field
+        shared_includes = OrderedDict(
+            (k, v) for k, v in include_clauses.items() if k not in agg_fields
+        )
+        field_includes = OrderedDict(
+            (k, v) for k, v in include_clauses.items() if k in agg_fields
+        )
+
+        aggs = {}
+        other_fields = {}
+        for field_name in agg_fields:
+            if field_name not in field_includes:
+                other_fields.update(self.build_terms(field_name))
+                continue
+
+            aggs[field_name] = {
+                "filter": {"bool": {"must": [
+                    v for k, v in field_includes.items() if k != field_name
+                ]}},
+                "aggs": self.build_terms(field_name)
+            }
+
+        if other_fields:
+            aggs[self._OTHER_FIELDS_AGG] = {
+                "filter": {"bool": {"must": list(field_includes.values())}},
+                "aggs": other_fields
+            }
+
+        return {
+            self._SHARED_AGG: {
+                "filter": self._build_dsl_filter(shared_includes,
+                                                 exclude_clauses),
+                "aggs": aggs
+            }
+        }
+
+    def flatten(self, aggregations):
+        flat = {}
+        for name, agg in aggregations[self._SHARED_AGG].items():
+            if name == self._OTHER_FIELDS_AGG:
+                for field_name, terms in agg.items():
+                    if field_name != 'doc_count':
+                        flat[field_name] = {
+                            'doc_count': agg['doc_count'],
+                            field_name: terms
+                        }
+            elif name != 'doc_count':
+                flat[name] = agg
+        return flat
+
 
 class StateAggregationBuilder(BaseBuilder):
     _AGG_FIELDS = (
@@ -442,18 +623,13 @@ class StateAggregationBuilder(BaseBuilder):
 
     def __init__(self):
         BaseBuilder.__init__(self)
-        self.include_clauses = None
-        self.exclude_clauses = None
         self.exclude = []
 
     def add_exclude(self, field_name_list):
         self.exclude += field_name_list
 
     def build_one(self, field_name):
-        # Lazy initialization
-        if not self.include_clauses:
-            self.include_clauses, self.exclude_clauses = \
-                self._build_clauses_dictionary()
+        include_clauses, exclude_clauses = self._build_clauses_dictionary()
 
         field_aggs = {
             "filter": {
@@ -502,18 +678,19 @@ class StateAggregationBuilder(BaseBuilder):
                 }
             }
 
-            filtered_includes = copy.deepcopy(self.include_clauses)
-            if 'state' in filtered_includes:
-                del filtered_includes['state']
+            filtered_includes = OrderedDict(
+                (k, v) for k, v in include_clauses.items() if k != 'state'
+            )
 
             field_aggs['filter'] = self._build_dsl_filter(filtered_includes,
-                                                          self.exclude_clauses)
+                                                          exclude_clauses)
         else:
-            field_aggs['filter'] = self._build_dsl_filter(self.include_clauses,
-                                                          self.exclude_clauses)
+            field_aggs['filter'] = self._build_dsl_filter(include_clauses,
+                                                          exclude_clauses)
 
         return field_aggs
 
+    @cached_body
     def build(self):
         aggs = {}
 
@@ -538,16 +715,15 @@ class LensAggregationBuilder(BaseBuilder):
 
     def __init__(self):
         super(LensAggregationBuilder, self).__init__()
-        self._include_clauses = None
-        self.exclude_clauses = None
         self.exclude = []
 
     @property
     def include_clauses(self):
-        if not self._include_clauses:
-            self._include_clauses, self.exclude_clauses = \
-                self._build_clauses_dictionary()
-        return self._include_clauses
+        return self._build_clauses_dictionary()[0]
+
+    @property
+    def exclude_clauses(self):
+        return self._build_clauses_dictionary()[1]
 
     def add_exclude(self, field_name_list):
         self.exclude += field_name_list
@@ -682,6 +858,7 @@ class TrendsAggregationBuilder(LensAggregationBuilder):
 
         return field_aggs
 
+    @cached_body
     def build(self):
         # AZ - Only include a company aggregation if at least one company
         # filter is selected
@@ -746,23 +923,29 @@ class TrendsAggregationBuilder(LensAggregationBuilder):
 
 
 class DateRangeBucketsBuilder(BaseBuilder):
+    # A global aggregation ignores the query of the trends search, so the
+    # date range buckets count every complaint received in the date range
+    @cached_body
     def build(self):
-        agg = {
-            'dateRangeBuckets': {
-                'aggs': {
-                    'dateRangeBuckets': {
-                        "date_histogram": {
-                            "field": "date_received",
-                            "interval": self.params.get('trend_interval', 5)
-                        }
+        date_histogram = {
+            'filter': self._build_dsl_filter(
+                {}, {}, include_dates=True, single_not_clause=False
+            ),
+            'aggs': {
+                'dateRangeBuckets': {
+                    "date_histogram": {
+                        "field": "date_received",
+                        "interval": self.params.get('trend_interval', 5)
                     }
                 }
             }
         }
 
-        # Add date filter clause
-        agg['dateRangeBuckets']['filter'] = self._build_dsl_filter(
-            {}, {}, include_dates=True, single_not_clause=False
-        )
-
-        return agg
+        return {
+            'dateRangeBuckets': {
+                'global': {},
+                'aggs': {
+                    'dateRangeBuckets': date_histogram
+                }
+            }
+        }
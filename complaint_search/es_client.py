@@ -0,0 +1,81 @@
+import os
+
+import urllib3
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+
+
+# -----------------------------------------------------------------------------
+# Elasticsearch clients
+#
+# Each kind of request has its own client, with its own connection pool and
+# timeout, so a long export can't hold the connections that suggestions and
+# searches need.
+# -----------------------------------------------------------------------------
+
+OPERATIONS = ('suggest', 'search', 'trends', 'export')
+
+
+def _parse_hosts(value):
+    return [host.strip() for host in value.split(',') if host.strip()]
+
+
+# ES_HOSTS lists "host:port" pairs, as in "es1:9200,es2:9200", and takes
+# precedence over ES_HOST and ES_PORT
+_ES_HOSTS = _parse_hosts(os.environ.get('ES_HOSTS', '')) or [
+    '{}:{}'.format(os.environ.get('ES_HOST', 'localhost'),
+                   os.environ.get('ES_PORT', '9200'))
+]
+_ES_USER = os.environ.get('ES_USER', '')
+_ES_PASSWORD = os.environ.get('ES_PASSWORD', '')
+
+# Seconds before a request of each operation times out, by default the 100
+# seconds of a single client and the 3000 seconds of exports
+_TIMEOUTS = {
+    'suggest': float(os.environ.get('ES_SUGGEST_TIMEOUT', '100')),
+    'search': float(os.environ.get('ES_SEARCH_TIMEOUT', '100')),
+    'trends': float(os.environ.get('ES_TRENDS_TIMEOUT', '100')),
+    'export': float(os.environ.get('ES_EXPORT_TIMEOUT', '3000')),
+}
+
+# Kept-alive connections per host and operation. Connections opened beyond
+# it are closed after their request, so it should match the number of
+# threads of a worker.
+_POOL_SIZE = int(os.environ.get('ES_POOL_SIZE', '10'))
+
+_HTTP_COMPRESS = os.environ.get('ES_HTTP_COMPRESS', '').lower() == 'true'
+
+# With ES_SNIFF, the nodes of the cluster are discovered from ES_HOSTS on
+# start, after a connection fails and every ES_SNIFFER_TIMEOUT seconds
+_SNIFF = os.environ.get('ES_SNIFF', '').lower() == 'true'
+_SNIFFER_TIMEOUT = float(os.environ.get('ES_SNIFFER_TIMEOUT', '60'))
+
+
+class CompressedConnection(Urllib3HttpConnection):
+    """A connection asking for gzip encoded responses, which urllib3
+    decodes."""
+
+    def __init__(self, *args, **kwargs):
+        super(CompressedConnection, self).__init__(*args, **kwargs)
+        self.headers.update(urllib3.make_headers(accept_encoding=True))
+
+
+def create_client(operation):
+    """Create the Elasticsearch client of an operation of OPERATIONS"""
+    kwargs = {}
+    if _SNIFF:
+        kwargs.update(
+            sniff_on_start=True,
+            sniff_on_connection_fail=True,
+            sniffer_timeout=_SNIFFER_TIMEOUT
+        )
+
+    return Elasticsearch(
+        _ES_HOSTS,
+        connection_class=(
+            CompressedConnection if _HTTP_COMPRESS else Urllib3HttpConnection
+        ),
+        http_auth=(_ES_USER, _ES_PASSWORD),
+        timeout=_TIMEOUTS[operation],
+        maxsize=_POOL_SIZE,
+        **kwargs
+    )
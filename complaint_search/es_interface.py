@@ -1,8 +1,20 @@
-import copy
+import functools
 import logging
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from complaint_search import (
+    autocomplete,
+    rollup,
+    single_flight,
+    slow_log,
+    timing,
+)
 from complaint_search.defaults import (
     CSV_ORDERED_HEADERS,
     EXPORT_FORMATS,
@@ -13,24 +25,103 @@ from complaint_search.es_builders import (
     DateRangeBucketsBuilder,
     PostFilterBuilder,
     SearchBuilder,
+    SharedFilterAggregationBuilder,
     StateAggregationBuilder,
     TrendsAggregationBuilder,
 )
+from complaint_search.es_client import create_client
 from complaint_search.export import ElasticSearchExporter
-from elasticsearch import Elasticsearch, helpers
+from complaint_search.metrics import REGISTRY, stats_counter
+from complaint_search.result_cache import ResultCache, canonical_key
+from complaint_search.sliced_scan import sliced_scan
+from elasticsearch import TransportError
 from flags.state import flag_enabled
 
 
 _ES_URL = "{}://{}:{}".format("http", os.environ.get('ES_HOST', 'localhost'),
                               os.environ.get('ES_PORT', '9200'))
-_ES_USER = os.environ.get('ES_USER', '')
-_ES_PASSWORD = os.environ.get('ES_PASSWORD', '')
 
-_ES_INSTANCE = None
+# One client per operation of es_client.OPERATIONS
+_ES_CLIENTS = {}
 
 _COMPLAINT_ES_INDEX = os.environ.get('COMPLAINT_ES_INDEX', 'complaint-index')
 _COMPLAINT_DOC_TYPE = os.environ.get('COMPLAINT_DOC_TYPE', 'complaint-doctype')
 
+# Metadata only changes when the index is rebuilt, so it is cached for
+# META_CACHE_TTL seconds (0 disables). META_CACHE_ALIAS names an optional
+# Django cache shared between processes.
+_META_CACHE_TTL = int(os.environ.get('META_CACHE_TTL', '300'))
+_META_CACHE_ALIAS = os.environ.get('META_CACHE_ALIAS', '')
+_META_CACHE_KEY = 'complaint_search:meta'
+
+_META_CACHE = {}
+_META_LOCK = threading.Lock()
+
+# search_after cursors require Elasticsearch 5+, so searches only accept and
+# return them when SEARCH_AFTER is true
+_SEARCH_AFTER = os.environ.get('SEARCH_AFTER', '').lower() == 'true'
+
+# Unfiltered company and zip code suggestions are answered from in-process
+# indexes of their values unless AUTOCOMPLETE_INDEX is false
+_AUTOCOMPLETE = autocomplete.AutocompleteIndexes(
+    enabled=os.environ.get('AUTOCOMPLETE_INDEX', 'true').lower() == 'true'
+)
+
+# Identical searches in flight share one Elasticsearch query unless
+# COALESCE_REQUESTS is false
+_IN_FLIGHT = single_flight.SingleFlight(
+    enabled=os.environ.get('COALESCE_REQUESTS', 'true').lower() == 'true'
+)
+
+# Aggregation-only responses are cached per index version in an LRU of
+# RESULT_CACHE_SIZE entries (0 disables), optionally shared through the
+# RESULT_CACHE_ALIAS Django cache. The version is that of the cached
+# metadata, or checked on every request when META_CACHE_TTL is 0.
+_RESULT_CACHE = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', '256')),
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', '3600')),
+    alias=os.environ.get('RESULT_CACHE_ALIAS', '')
+)
+
+
+@REGISTRY.collector
+def _result_cache_metrics():
+    return [stats_counter(
+        'ccdb_result_cache_total', 'Responses found in the result cache',
+        'endpoint', _RESULT_CACHE.stats
+    )]
+
+
+# Search aggregations are built with one filter per field ('filter'), or
+# under a single shared filter ('shared')
+_AGGREGATION_BUILDERS = {
+    'filter': AggregationBuilder,
+    'shared': SharedFilterAggregationBuilder,
+}
+
+
+def _get_agg_strategy(strategy):
+    if strategy not in _AGGREGATION_BUILDERS:
+        raise ImproperlyConfigured(
+            'AGG_STRATEGY must be one of {}, not {!r}'.format(
+                ', '.join(sorted(_AGGREGATION_BUILDERS)), strategy
+            )
+        )
+    return strategy
+
+
+# Checked on startup rather than on every search
+_AGG_STRATEGY = _get_agg_strategy(os.environ.get('AGG_STRATEGY', 'filter'))
+
+# Exports scroll EXPORT_SLICES slices in parallel (requires Elasticsearch
+# 5+ when above 1), yielding complaints slice by slice when
+# EXPORT_SLICES_ORDERED is true. Each slice buffers up to EXPORT_QUEUE_SIZE
+# batches of complaints.
+_EXPORT_SLICES = int(os.environ.get('EXPORT_SLICES', '1'))
+_EXPORT_SLICES_ORDERED = \
+    os.environ.get('EXPORT_SLICES_ORDERED', '').lower() == 'true'
+_EXPORT_QUEUE_SIZE = int(os.environ.get('EXPORT_QUEUE_SIZE', '4'))
+
 
 # -----------------------------------------------------------------------------
 # Trends Operations
@@ -69,7 +160,8 @@ def get_sug_agg_key_if_exists(agg):
 
 
 # Filter out all but the most recent buckets in sub agg for the Percent
-# Change on chart
+# Change on chart. date_histogram buckets come back in ascending order of
+# their key, so the most recent come first once reversed.
 def process_trend_aggregations(aggregations):
     trend_charts = (
         'product',
@@ -84,38 +176,76 @@ def process_trend_aggregations(aggregations):
             agg_buckets = \
                 aggregations[agg_name][agg_name]['buckets']
             for sub_agg in agg_buckets:
-                sub_agg['trend_period']['buckets'] = sorted(
-                    sub_agg['trend_period']['buckets'],
-                    key=lambda k: k['key_as_string'], reverse=True)
+                sub_agg['trend_period']['buckets'].reverse()
                 sub_agg_name = get_sug_agg_key_if_exists(sub_agg)
                 if sub_agg_name:
                     for sub_sub_agg in sub_agg[sub_agg_name]['buckets']:
-                        sub_sub_agg['trend_period']['buckets'] = sorted(
-                            sub_sub_agg['trend_period']['buckets'],
-                            key=lambda k: k['key_as_string'],
-                            reverse=True)[1:2]
+                        # Only the period before the latest is kept
+                        sub_sub_agg['trend_period']['buckets'] = \
+                            sub_sub_agg['trend_period']['buckets'][-2:-1]
     return aggregations
 
 
-# Process the response from a trends query
+# Process the response from a trends query, lifting the date range buckets
+# out of their global aggregation
 def process_trends_response(response):
-    response['aggregations'] = \
-        process_trend_aggregations(response['aggregations'])
+    aggregations = process_trend_aggregations(response['aggregations'])
+    if 'dateRangeBuckets' in aggregations:
+        aggregations['dateRangeBuckets'] = \
+            aggregations['dateRangeBuckets']['dateRangeBuckets']
+    response['aggregations'] = aggregations
 
     response['_meta'] = build_trend_meta(response)
 
     return response
 
 
-def _get_es():
-    global _ES_INSTANCE
-    if _ES_INSTANCE is None:
-        _ES_INSTANCE = Elasticsearch(
-            [_ES_URL],
-            http_auth=(_ES_USER, _ES_PASSWORD),
-            timeout=100
+def _get_es(operation='search'):
+    client = _ES_CLIENTS.get(operation)
+    if client is None:
+        client = _ES_CLIENTS.setdefault(
+            operation, timing.TimedClient(create_client(operation))
         )
-    return _ES_INSTANCE
+    return client
+
+
+class MultiSearchError(TransportError):
+    """One or more of the searches in an msearch request failed.
+
+    `errors` lists (position, status_code, error) for each failed search.
+    """
+
+    def __init__(self, errors):
+        position, status_code, error = errors[0]
+        super(MultiSearchError, self).__init__(status_code, error, errors)
+
+    @property
+    def errors(self):
+        return self.info
+
+
+# Run independent searches in a single round trip. Elasticsearch executes
+# them concurrently, so the latency is that of the slowest one.
+def _msearch(bodies, operation='search'):
+    request = []
+    for body in bodies:
+        request.append({})
+        request.append(body)
+
+    res = _get_es(operation).msearch(index=_COMPLAINT_ES_INDEX,
+                                     doc_type=_COMPLAINT_DOC_TYPE,
+                                     body=request)
+
+    responses = res['responses']
+    errors = [
+        (position, response.get('status', 'N/A'), response['error'])
+        for position, response in enumerate(responses)
+        if 'error' in response
+    ]
+    if errors:
+        raise MultiSearchError(errors)
+
+    return responses
 
 
 def _get_now():
@@ -148,59 +278,272 @@ def from_timestamp(seconds):
     return fromtimestamp.strftime('%Y-%m-%d')
 
 
-def _get_meta():
-    # Hard code noon Eastern Time zone since that is where it is built
-    body = {
-        # size: 0 here to prevent taking too long since we only needed max_date
-        "size": 0,
-        "aggs": {
-            "max_date": {
-                "max": {
-                    "field": "date_received",
-                    "format": "yyyy-MM-dd'T'12:00:00-05:00"
-                }
-            },
-            "max_indexed_date": {
-                "max": {
-                    "field": "date_indexed",
-                    "format": "yyyy-MM-dd'T'12:00:00-05:00"
-                }
-            },
-            "max_narratives": {
-                "filter": {"term": {"has_narrative": "true"}},
-                "aggs": {
-                    "max_date": {
-                        "max": {
-                            "field": ":updated_at",
-                        }
+_META_BODY = {
+    # size: 0 here to prevent taking too long since we only needed max_date
+    "size": 0,
+    "aggs": {
+        # Hard code noon Eastern Time zone since that is where it is built
+        "max_date": {
+            "max": {
+                "field": "date_received",
+                "format": "yyyy-MM-dd'T'12:00:00-05:00"
+            }
+        },
+        "max_indexed_date": {
+            "max": {
+                "field": "date_indexed",
+                "format": "yyyy-MM-dd'T'12:00:00-05:00"
+            }
+        },
+        "max_narratives": {
+            "filter": {"term": {"has_narrative": "true"}},
+            "aggs": {
+                "max_date": {
+                    "max": {
+                        "field": ":updated_at",
                     }
                 }
             }
         }
     }
-    max_date_res = _get_es().search(index=_COMPLAINT_ES_INDEX, body=body)
-    count_res = _get_es().count(
-        index=_COMPLAINT_ES_INDEX,
-        doc_type=_COMPLAINT_DOC_TYPE
-    )
+}
+
+
+def _parse_meta(max_date_res):
+    aggs = max_date_res["aggregations"]
+    return {
+        "last_updated": aggs["max_date"]["value_as_string"],
+        "last_indexed": aggs["max_indexed_date"]["value_as_string"],
+        "narratives_updated": aggs["max_narratives"]["max_date"]["value"],
+    }
+
+
+def _fetch_meta(previous=None):
+    max_date_res = _get_es().search(index=_COMPLAINT_ES_INDEX, body=_META_BODY)
+    values = _parse_meta(max_date_res)
+
+    # The record count can only change when the index is rebuilt
+    if previous and previous["last_indexed"] == values["last_indexed"]:
+        values["total_record_count"] = previous["total_record_count"]
+    else:
+        count_res = _get_es().count(
+            index=_COMPLAINT_ES_INDEX,
+            doc_type=_COMPLAINT_DOC_TYPE
+        )
+        values["total_record_count"] = count_res["count"]
+
+    return values
+
+
+def _get_meta_shared_cache():
+    if not _META_CACHE_ALIAS:
+        return None
+    return caches[_META_CACHE_ALIAS]
+
+
+def _cache_meta(values, shared=True):
+    if _META_CACHE_TTL <= 0:
+        return
+
+    shared_cache = _get_meta_shared_cache()
+    if shared and shared_cache is not None:
+        shared_cache.set(_META_CACHE_KEY, values, _META_CACHE_TTL)
+
+    _META_CACHE["meta"] = {
+        "values": values,
+        "expires": time.time() + _META_CACHE_TTL,
+    }
+
 
-    result = {
+def _load_shared_meta():
+    shared_cache = _get_meta_shared_cache()
+    if shared_cache is None:
+        return None
+
+    values = shared_cache.get(_META_CACHE_KEY)
+    if values is not None:
+        _cache_meta(values, shared=False)
+    return values
+
+
+def _refresh_meta(previous=None):
+    values = _load_shared_meta()
+    if values is None:
+        values = _fetch_meta(previous)
+        _cache_meta(values)
+    return values
+
+
+def _refresh_meta_in_background(previous):
+    # Only one refresh at a time, other callers keep the stale copy
+    if not _META_LOCK.acquire(False):
+        return
+
+    def refresh():
+        try:
+            _refresh_meta(previous)
+        except Exception as e:
+            log = logging.getLogger(__name__)
+            log.error(e)
+        finally:
+            _META_LOCK.release()
+
+    try:
+        threading.Thread(target=refresh, daemon=True).start()
+    except Exception:
+        _META_LOCK.release()
+        raise
+
+
+def _clear_meta_cache():
+    _META_CACHE.clear()
+    shared_cache = _get_meta_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(_META_CACHE_KEY)
+
+
+# When fetch is False, None is returned instead of querying Elasticsearch
+# if nothing is cached yet
+def _get_meta_values(fetch=True):
+    if _META_CACHE_TTL <= 0:
+        return _fetch_meta() if fetch else None
+
+    entry = _META_CACHE.get("meta")
+    if entry is None:
+        if not fetch:
+            return _load_shared_meta()
+
+        # Nothing to serve yet, so wait for whoever is already fetching
+        with _META_LOCK:
+            entry = _META_CACHE.get("meta")
+            if entry is None:
+                return _refresh_meta()
+    elif entry["expires"] <= time.time():
+        _refresh_meta_in_background(entry["values"])
+
+    return entry["values"]
+
+
+def _build_meta(values):
+    return {
         "license": "CC0",
-        "last_updated":
-            max_date_res["aggregations"]["max_date"]["value_as_string"],
-        "last_indexed":
-            max_date_res["aggregations"]["max_indexed_date"]
-            ["value_as_string"],
-        "total_record_count": count_res["count"],
-        "is_data_stale": _is_data_stale(
-            max_date_res["aggregations"]["max_date"]["value_as_string"]),
-        "is_narrative_stale": _is_data_stale(from_timestamp(
-            max_date_res["aggregations"]["max_narratives"]["max_date"]["value"]
-        )),
+        "last_updated": values["last_updated"],
+        "last_indexed": values["last_indexed"],
+        "total_record_count": values["total_record_count"],
+        "is_data_stale": _is_data_stale(values["last_updated"]),
+        "is_narrative_stale": _is_data_stale(
+            from_timestamp(values["narratives_updated"])
+        ),
         "has_data_issue": bool(flag_enabled('CCDB_TECHNICAL_ISSUES'))
     }
 
-    return result
+
+def _get_meta(fetch=True):
+    values = _get_meta_values(fetch)
+    if values is None:
+        return None
+    return _build_meta(values)
+
+
+# Run the search and the metadata query in a single round trip
+def _search_with_meta(body):
+    bodies = [body, _META_BODY]
+    res, meta_res = _IN_FLIGHT.do(
+        'search', single_flight.body_key('msearch', bodies),
+        lambda: _msearch(bodies)
+    )
+
+    values = _parse_meta(meta_res)
+    # The metadata query has no filters, so its total is the record count
+    values["total_record_count"] = meta_res["hits"]["total"]
+    _cache_meta(values)
+
+    return res, _build_meta(values)
+
+
+# Build the cursor for the next page from the sort values of the last hit
+def _get_search_after(hits):
+    if not hits or not hits[-1].get('sort'):
+        return None
+    return '_'.join(str(value) for value in hits[-1]['sort'])
+
+
+def _get_last_indexed():
+    # Only use metadata that is already cached, so caching never costs an
+    # extra round trip
+    values = _get_meta_values(fetch=False)
+    return values["last_indexed"] if values else None
+
+
+_INDEX_VERSION_BODY = {
+    "size": 0,
+    "aggs": {"max_indexed_date": _META_BODY["aggs"]["max_indexed_date"]},
+}
+
+
+# The version the result cache is keyed on. Without cached metadata, when
+# META_CACHE_TTL is 0, it is checked with a small query of its own.
+def _get_index_version():
+    if _META_CACHE_TTL > 0:
+        return _get_last_indexed()
+
+    res = _get_es().search(index=_COMPLAINT_ES_INDEX,
+                           body=_INDEX_VERSION_BODY)
+    return res["aggregations"]["max_indexed_date"]["value_as_string"]
+
+
+# Plan an aggregation-only body: answer it from the rollup of the index when
+# one is built and the body only filters and aggregates on its fields, else
+# search the index
+def _search_aggregations(function, body, operation='search', **kwargs):
+    if rollup.enabled():
+        meta = _get_meta()
+        res = rollup.answer(function, body, meta and meta['last_indexed'])
+        if res is not None:
+            return res
+
+    return _search_index(function, body, operation, **kwargs)
+
+
+# Search the index, sharing the response with identical searches in flight
+def _search_index(function, body, operation='search', **kwargs):
+    def call():
+        return _get_es(operation).search(index=_COMPLAINT_ES_INDEX,
+                                         doc_type=_COMPLAINT_DOC_TYPE,
+                                         body=body,
+                                         **kwargs)
+
+    key = single_flight.body_key('search', operation, body, kwargs)
+    return _IN_FLIGHT.do(function, key, call)
+
+
+def _strip_defaults(params):
+    return {k: v for k, v in params.items()
+            if k not in PARAMS or PARAMS[k] != v}
+
+
+# Cache the response of an aggregation-only query until the index is rebuilt
+def _cache_result(function):
+    endpoint = function.__name__
+
+    @functools.wraps(function)
+    def wrap(*args, **kwargs):
+        if not _RESULT_CACHE.enabled:
+            return function(*args, **kwargs)
+
+        last_indexed = _get_index_version()
+        if last_indexed is None:
+            return function(*args, **kwargs)
+
+        key = canonical_key(
+            endpoint, last_indexed, *args, **_strip_defaults(kwargs)
+        )
+        res = _RESULT_CACHE.get(endpoint, key)
+        if res is None:
+            res = function(*args, **kwargs)
+            _RESULT_CACHE.set(key, res)
+        return res
+    return wrap
 
 # List of possible arguments:
 # - format: format to be returned: "json", "csv"
@@ -208,6 +551,9 @@ def _get_meta():
 #   "company_public_response", "_all"
 # - size: number of complaints to return
 # - frm: from which index to start returning
+# - search_after: the sort values of the last hit of the previous page, as
+#   returned in _meta.search_after; takes precedence over frm. Ignored unless
+#   SEARCH_AFTER is true.
 # - sort: sort by: "relevance_desc", "relevance_asc", "created_date_desc",
 #   "created_date_asc"
 # - search_term: the term to be searched
@@ -239,9 +585,12 @@ def _get_meta():
 # - tags - filters a list of tags
 
 
+@slow_log.captured
 def search(agg_exclude=None, **kwargs):
-    params = copy.deepcopy(PARAMS)
+    params = dict(PARAMS)
     params.update(**kwargs)
+    if not _SEARCH_AFTER:
+        params.pop("search_after", None)
     search_builder = SearchBuilder()
     search_builder.add(**params)
     body = search_builder.build()
@@ -262,74 +611,150 @@ def search(agg_exclude=None, **kwargs):
         if body["size"] > 1000:
             body["size"] = 1000
 
+        aggregation_builder = None
         if not params.get("no_aggs"):
-            aggregation_builder = AggregationBuilder()
+            aggregation_builder = _AGGREGATION_BUILDERS[_AGG_STRATEGY]()
             aggregation_builder.add(**params)
             if agg_exclude:
                 aggregation_builder.add_exclude(agg_exclude)
             body["aggs"] = aggregation_builder.build()
 
-        res = _get_es().search(index=_COMPLAINT_ES_INDEX,
-                               doc_type=_COMPLAINT_DOC_TYPE,
-                               body=body,
-                               scroll="10m")
-
-        if res['hits']['hits']:
-            num_of_scroll = params.get("frm") / body["size"]
-            scroll_id = res['_scroll_id']
-            if num_of_scroll > 0:
-                while num_of_scroll > 0:
-                    res['hits']['hits'] = _get_es().scroll(
-                        scroll_id=scroll_id,
-                        scroll="10m"
-                    )['hits']['hits']
-                    num_of_scroll -= 1
-        res["_meta"] = _get_meta()
+        meta = _get_meta(fetch=False)
+        if params.get("search_after") or not params.get("frm"):
+            # Cursor pagination reaches any page in a single request and
+            # does not keep a scroll context open. Uncached metadata is
+            # fetched in the same round trip.
+            if meta is None:
+                res, meta = _search_with_meta(body)
+            else:
+                res = _search_index('search', body)
+        else:
+            res = _get_es().search(index=_COMPLAINT_ES_INDEX,
+                                   doc_type=_COMPLAINT_DOC_TYPE,
+                                   body=body,
+                                   scroll="10m")
+
+            if res['hits']['hits']:
+                num_of_scroll = params.get("frm") / body["size"]
+                scroll_id = res['_scroll_id']
+                if num_of_scroll > 0:
+                    while num_of_scroll > 0:
+                        res['hits']['hits'] = _get_es().scroll(
+                            scroll_id=scroll_id,
+                            scroll="10m"
+                        )['hits']['hits']
+                        num_of_scroll -= 1
+            if meta is None:
+                meta = _get_meta()
+        if aggregation_builder and 'aggregations' in res:
+            with timing.phase('process'):
+                res['aggregations'] = aggregation_builder.flatten(
+                    res['aggregations']
+                )
+        res["_meta"] = meta
+        search_after = _SEARCH_AFTER and \
+            _get_search_after(res['hits']['hits'])
+        if search_after:
+            res["_meta"]["search_after"] = search_after
 
     elif format in EXPORT_FORMATS:
-        scanResponse = helpers.scan(
-            client=_get_es(),
+        scanResponse = sliced_scan(
+            client=_get_es('export'),
             query=body,
+            slices=_EXPORT_SLICES,
+            ordered=_EXPORT_SLICES_ORDERED,
+            max_batches=_EXPORT_QUEUE_SIZE,
             scroll="10m",
             index=_COMPLAINT_ES_INDEX,
             size=7000,
-            doc_type=_COMPLAINT_DOC_TYPE,
-            request_timeout=3000
+            doc_type=_COMPLAINT_DOC_TYPE
         )
 
         exporter = ElasticSearchExporter()
 
-        if params.get("format") == 'csv':
+        export_format = format
+        if export_format.endswith('.gz'):
+            export_format = export_format[:-len('.gz')]
+
+        if export_format == 'csv':
             res = exporter.export_csv(
                 scanResponse,
                 CSV_ORDERED_HEADERS
             )
-        elif params.get("format") == 'json':
-            if 'highlight' in body:
-                del body['highlight']
-            body['size'] = 0
+        elif export_format == 'json':
+            res = exporter.export_json(scanResponse)
+        elif export_format == 'ndjson':
+            res = exporter.export_ndjson(scanResponse)
 
-            res = _get_es().search(index=_COMPLAINT_ES_INDEX,
-                                   doc_type=_COMPLAINT_DOC_TYPE,
-                                   body=body,
-                                   scroll="10m")
-            res = exporter.export_json(scanResponse, res['hits']['total'])
+        if export_format != format:
+            res = exporter.export_gzip(res)
 
     return res
 
 
+@slow_log.captured
 def suggest(text=None, size=6):
     if text is None:
         return []
     body = {"sgg": {"text": text, "completion": {
         "field": "suggest", "size": size}}}
 
-    res = _get_es().suggest(index=_COMPLAINT_ES_INDEX, body=body)
+    res = _get_es('suggest').suggest(index=_COMPLAINT_ES_INDEX, body=body)
     candidates = [e['text'] for e in res['sgg'][0]['options']]
     return candidates
 
 
+# Every value of a suggestion field, most frequent first, like the terms
+# aggregation of an unfiltered suggestion
+def _load_suggest_values(display_field, field):
+    search_builder = SearchBuilder()
+    search_builder.add(size=0, no_highlight=True, field=field)
+    body = search_builder.build()
+    body['aggs'] = {
+        display_field: {'terms': {'field': display_field, 'size': 0}}
+    }
+
+    res = _get_es('suggest').search(
+        index=_COMPLAINT_ES_INDEX,
+        doc_type=_COMPLAINT_DOC_TYPE,
+        body=body
+    )
+    return [x['key'] for x in res['aggregations'][display_field]['buckets']]
+
+
+# Answer suggestions without filters from the autocomplete index of the
+# field, or None when the index can't be used yet
+def _suggest_from_index(filterField, display_field, params):
+    if not _AUTOCOMPLETE.enabled or not autocomplete.answerable(params):
+        return None
+
+    last_indexed = _get_last_indexed()
+    if last_indexed is None:
+        return None
+
+    # company.suggest holds the upper-cased company names, matched
+    # anywhere, while zip codes are matched by prefix
+    field = params.get('field', PARAMS['field'])
+    index = _AUTOCOMPLETE.get(
+        (filterField, display_field, field), last_indexed,
+        functools.partial(_load_suggest_values, display_field, field),
+        prefix=filterField == 'zip_code'
+    )
+    if index is None:
+        return None
+    return index.search(params['text'])
+
+
+@slow_log.captured
+@_cache_result
 def filter_suggest(filterField, display_field=None, **kwargs):
+    display_field = filterField if display_field is None else display_field
+    candidates = _suggest_from_index(filterField, display_field, kwargs)
+    if candidates is not None:
+        autocomplete.SUGGESTIONS.inc(filterField, 'index')
+        return candidates
+    autocomplete.SUGGESTIONS.inc(filterField, 'elasticsearch')
+
     params = dict(**kwargs)
     params.update({
         'size': 0,
@@ -360,13 +785,12 @@ def filter_suggest(filterField, display_field=None, **kwargs):
         )
 
     # choose which field to actually display
-    aggs[filterField]['aggs'][filterField]['terms'][
-        'field'] = filterField if display_field is None else display_field
+    aggs[filterField]['aggs'][filterField]['terms']['field'] = display_field
     # add to the body
     body['aggs'] = aggs
 
     # format
-    res = _get_es().search(
+    res = _get_es('suggest').search(
         index=_COMPLAINT_ES_INDEX,
         doc_type=_COMPLAINT_DOC_TYPE,
         body=body
@@ -380,6 +804,45 @@ def filter_suggest(filterField, display_field=None, **kwargs):
     return candidates
 
 
+# Page through the buckets of a search aggregation beyond its bucket size
+@slow_log.captured
+@_cache_result
+def facet_buckets(facet, **kwargs):
+    params = dict(PARAMS)
+    params.update(**kwargs)
+    frm = params['frm']
+    size = params['size']
+    params.update(frm=0, size=0, no_highlight=True)
+
+    search_builder = SearchBuilder()
+    search_builder.add(**params)
+    body = search_builder.build()
+
+    # Terms aggregations can't skip buckets, so the earlier pages are
+    # requested too
+    aggregation_builder = AggregationBuilder()
+    aggregation_builder.add(**params)
+    body['aggs'] = {
+        facet: aggregation_builder.build_one(facet, size=frm + size)
+    }
+
+    res = _get_es().search(
+        index=_COMPLAINT_ES_INDEX,
+        doc_type=_COMPLAINT_DOC_TYPE,
+        body=body
+    )
+    terms = res['aggregations'][facet][facet]
+
+    return {
+        'facet': facet,
+        'frm': frm,
+        'size': size,
+        'buckets': terms['buckets'][frm:frm + size],
+        'has_more': terms.get('sum_other_doc_count', 0) > 0,
+    }
+
+
+@slow_log.captured
 def document(complaint_id):
     doc_query = {"query": {"term": {"_id": complaint_id}}}
     res = _get_es().search(index=_COMPLAINT_ES_INDEX,
@@ -387,8 +850,10 @@ def document(complaint_id):
     return res
 
 
+@slow_log.captured
+@_cache_result
 def states_agg(agg_exclude=None, **kwargs):
-    params = copy.deepcopy(PARAMS)
+    params = dict(PARAMS)
     params.update(**kwargs)
     params.update({'size': 0})
     search_builder = SearchBuilder()
@@ -407,57 +872,32 @@ def states_agg(agg_exclude=None, **kwargs):
         aggregation_builder.add_exclude(agg_exclude)
     body["aggs"] = aggregation_builder.build()
 
-    res = _get_es().search(index=_COMPLAINT_ES_INDEX,
-                           doc_type=_COMPLAINT_DOC_TYPE,
-                           body=body,
-                           scroll="10m")
+    res = _search_aggregations('states_agg', body, scroll="10m")
 
     return res
 
 
+@slow_log.captured
+@_cache_result
 def trends(agg_exclude=None, **kwargs):
-    params = copy.deepcopy(PARAMS)
+    params = dict(PARAMS)
     params.update(**kwargs)
     params.update(size=0)
     search_builder = SearchBuilder()
     search_builder.add(**params)
     body = search_builder.build()
 
-    res_trends = None
-
     aggregation_builder = TrendsAggregationBuilder()
     aggregation_builder.add(**params)
     if agg_exclude:
         aggregation_builder.add_exclude(agg_exclude)
     body["aggs"] = aggregation_builder.build()
 
-    res_trends = _get_es().search(index=_COMPLAINT_ES_INDEX,
-                                  doc_type=_COMPLAINT_DOC_TYPE,
-                                  body=body)
-
-    res_date_buckets = None
-
-    date_bucket_body = copy.deepcopy(body)
-    date_bucket_body['query'] = {
-        "query_string": {
-            "query": "*",
-            "fields": [
-                "_all"
-            ],
-            "default_operator": "AND"
-        }
-    }
-
     date_range_buckets_builder = DateRangeBucketsBuilder()
     date_range_buckets_builder.add(**params)
-    date_bucket_body['aggs'] = date_range_buckets_builder.build()
-
-    res_date_buckets = _get_es().search(index=_COMPLAINT_ES_INDEX,
-                                        doc_type=_COMPLAINT_DOC_TYPE,
-                                        body=date_bucket_body)
+    body["aggs"].update(date_range_buckets_builder.build())
 
-    res_trends = process_trends_response(res_trends)
-    res_trends['aggregations']['dateRangeBuckets'] = \
-        res_date_buckets['aggregations']['dateRangeBuckets']
+    res = _search_aggregations('trends', body, 'trends')
 
-    return res_trends
+    with timing.phase('process'):
+        return process_trends_response(res)
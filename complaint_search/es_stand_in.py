@@ -0,0 +1,302 @@
+import copy
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+# -----------------------------------------------------------------------------
+# Elasticsearch stand-in
+#
+# A local replacement for the Elasticsearch client used by benchmarks. It
+# synthesizes responses shaped after the request body (aggregation names,
+# bucket nesting, hits) and waits `latency` seconds per round trip, so the
+# cost of the Python side and the number of round trips can be measured
+# without a cluster.
+# -----------------------------------------------------------------------------
+
+_DATE_MIN = datetime(2011, 12, 1)
+_DATE_MAX = datetime(2020, 6, 1)
+
+
+def _add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1)
+
+
+def _interval_starts(interval, date_min, date_max):
+    if interval == 'year':
+        current = date_min.replace(month=1, day=1)
+        step = lambda d: d.replace(year=d.year + 1)
+    elif interval == 'quarter':
+        current = date_min.replace(
+            month=(date_min.month - 1) // 3 * 3 + 1, day=1)
+        step = lambda d: _add_months(d, 3)
+    elif interval == 'month':
+        current = date_min.replace(day=1)
+        step = lambda d: _add_months(d, 1)
+    elif interval == 'week':
+        current = date_min - timedelta(days=date_min.weekday())
+        step = lambda d: d + timedelta(days=7)
+    else:
+        current = date_min
+        step = lambda d: d + timedelta(days=1)
+
+    while current <= date_max:
+        yield current
+        current = step(current)
+
+
+def _epoch_millis(date):
+    return int((date - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+class StandInElasticsearch(object):
+
+    def __init__(self, latency=0.0, terms_size=10, date_min=_DATE_MIN,
+                 date_max=_DATE_MAX, seed=0):
+        self.latency = latency
+        self.terms_size = terms_size
+        self.date_min = date_min
+        self.date_max = date_max
+        self.seed = seed
+        self.requests = []
+        # Time spent building responses, to be left out of measurements
+        self.synthesis_time = 0.0
+        # Round trips waiting at the same time, and the most seen
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # Client API
+    # -------------------------------------------------------------------------
+
+    def search(self, index=None, doc_type=None, body=None, **kwargs):
+        self.requests.append(('search', body))
+        self._wait()
+        return self._respond(body or {})
+
+    def msearch(self, body, index=None, doc_type=None, **kwargs):
+        # Every second line is a search body, the others are headers
+        bodies = body[1::2]
+        self.requests.append(('msearch', bodies))
+        # Sub-searches run concurrently on the cluster
+        self._wait()
+        return {'responses': [self._respond(b) for b in bodies]}
+
+    def count(self, index=None, doc_type=None, body=None, **kwargs):
+        self.requests.append(('count', body))
+        self._wait()
+        return {'count': 1000000}
+
+    def scroll(self, scroll_id=None, **kwargs):
+        self.requests.append(('scroll', scroll_id))
+        self._wait()
+        return self._respond({})
+
+    def suggest(self, body=None, index=None, **kwargs):
+        self.requests.append(('suggest', body))
+        self._wait()
+        return {
+            name: [{
+                'text': suggestion['text'],
+                'options': [
+                    {'text': '{} {}'.format(suggestion['text'], i)}
+                    for i in range(suggestion['completion'].get('size', 5))
+                ]
+            }]
+            for name, suggestion in body.items()
+        }
+
+    # -------------------------------------------------------------------------
+    # Response synthesis
+    # -------------------------------------------------------------------------
+
+    def _wait(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _respond(self, body):
+        start = time.time()
+        response = self._build_response(body)
+        self.synthesis_time += time.time() - start
+        return response
+
+    def _build_response(self, body):
+        rng = random.Random(self.seed)
+        size = body.get('size', 10)
+        response = {
+            'took': 1,
+            'timed_out': False,
+            '_shards': {'total': 5, 'successful': 5, 'failed': 0},
+            'hits': {
+                'total': 1000000,
+                'max_score': 1.0,
+                'hits': [
+                    self._hit(body, body.get('from', 0) + i, rng)
+                    for i in range(size)
+                ],
+            },
+        }
+        if body.get('aggs'):
+            response['aggregations'] = self._aggs(body['aggs'], 1000000, rng)
+        return response
+
+    def _hit(self, body, position, rng):
+        complaint_id = str(position + 1)
+        source = {
+            field: '{} {}'.format(field, rng.randint(1, self.terms_size))
+            for field in body.get('_source', [])
+        }
+        if 'complaint_id' in source:
+            source['complaint_id'] = complaint_id
+        hit = {
+            '_index': 'complaint-index',
+            '_type': 'complaint-doctype',
+            '_id': complaint_id,
+            '_score': 1.0,
+            '_source': source,
+        }
+        if body.get('sort'):
+            hit['sort'] = [1.0, complaint_id]
+        return hit
+
+    def _aggs(self, aggs, doc_count, rng):
+        return {
+            name: self._agg(agg, doc_count, rng)
+            for name, agg in aggs.items()
+        }
+
+    def _agg(self, agg, doc_count, rng):
+        sub_aggs = agg.get('aggs', {})
+
+        if 'terms' in agg:
+            size = agg['terms'].get('size') or self.terms_size
+            size = min(size, self.terms_size)
+            buckets = []
+            remaining = doc_count
+            for i in range(size):
+                count = remaining // 2
+                remaining -= count
+                bucket = {
+                    'key': '{} {}'.format(agg['terms']['field'], i),
+                    'doc_count': count,
+                }
+                bucket.update(self._aggs(sub_aggs, count, rng))
+                buckets.append(bucket)
+            return {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': remaining,
+                'buckets': buckets,
+            }
+
+        if 'date_histogram' in agg:
+            interval = agg['date_histogram'].get('interval')
+            buckets = []
+            previous = None
+            for start in _interval_starts(
+                interval, self.date_min, self.date_max
+            ):
+                count = rng.randint(0, max(doc_count, 1))
+                bucket = {
+                    'key_as_string': start.strftime(
+                        '%Y-%m-%dT%H:%M:%S.000Z'),
+                    'key': _epoch_millis(start),
+                    'doc_count': count,
+                }
+                for name, sub_agg in sub_aggs.items():
+                    if 'serial_diff' in sub_agg:
+                        if previous is not None:
+                            bucket[name] = {'value': count - previous}
+                    else:
+                        bucket[name] = self._agg(sub_agg, count, rng)
+                buckets.append(bucket)
+                previous = count
+            return {'buckets': buckets}
+
+        if 'max' in agg or 'min' in agg:
+            extreme = agg.get('max') or agg.get('min')
+            date = self.date_max if 'max' in agg else self.date_min
+            value = _epoch_millis(date)
+            # Socrata fields (:field_name) are indexed in seconds
+            if extreme.get('field', '').startswith(':'):
+                value = value // 1000
+            return {
+                'value': value,
+                'value_as_string': date.strftime(
+                    "%Y-%m-%dT12:00:00-05:00"),
+            }
+
+        # filter, global and other single bucket aggregations
+        result = {'doc_count': doc_count}
+        result.update(self._aggs(sub_aggs, doc_count, rng))
+        return result
+
+
+def _body_key(body):
+    return json.dumps(body, sort_keys=True, default=str)
+
+
+class RecordedElasticsearch(object):
+    """Answers with the responses recorded in a slow query log entry.
+
+    A request is answered with the response recorded for the same body, or
+    when the body changed, with the next response recorded for the same
+    method. Requests without recorded responses are answered by `fallback`.
+    """
+
+    def __init__(self, queries, fallback=None):
+        self.fallback = fallback or StandInElasticsearch()
+        self._recorded = {}
+        for query in queries:
+            if 'response' in query:
+                self._recorded.setdefault(query['method'], []).append((
+                    _body_key(query['kwargs'].get('body')),
+                    query['response']
+                ))
+        self._next = dict.fromkeys(self._recorded, 0)
+        self.replayed = 0
+        self.synthesized = 0
+
+    def _respond(self, method, kwargs):
+        recorded = self._recorded.get(method)
+        if not recorded:
+            self.synthesized += 1
+            return getattr(self.fallback, method)(**kwargs)
+
+        key = _body_key(kwargs.get('body'))
+        response = next(
+            (response for body, response in recorded if body == key), None
+        )
+        if response is None:
+            position = self._next[method] % len(recorded)
+            self._next[method] += 1
+            response = recorded[position][1]
+
+        self.replayed += 1
+        # Responses are processed in place
+        return copy.deepcopy(response)
+
+    def search(self, **kwargs):
+        return self._respond('search', kwargs)
+
+    def msearch(self, **kwargs):
+        return self._respond('msearch', kwargs)
+
+    def count(self, **kwargs):
+        return self._respond('count', kwargs)
+
+    def scroll(self, **kwargs):
+        return self._respond('scroll', kwargs)
+
+    def suggest(self, **kwargs):
+        return self._respond('suggest', kwargs)
@@ -1,10 +1,54 @@
 import csv
 import json
-from csv import DictWriter
+import zlib
 from io import StringIO
+from itertools import islice
+from operator import itemgetter
 
 from django.http import StreamingHttpResponse
 
+from complaint_search.defaults import CHUNK_SIZE, GZIP_LEVEL
+
+
+# Use a faster JSON encoder when one is installed
+try:
+    from orjson import dumps as _orjson_dumps
+
+    def _dumps(obj):
+        return _orjson_dumps(obj).decode('utf-8')
+except ImportError:
+    _dumps = json.dumps
+
+_ROWS_PER_BATCH = 16
+
+
+# Precompute the lookup of all columns of a row in a single call
+def _column_getter(fields):
+    getter = itemgetter(*fields)
+    if len(fields) == 1:
+        return lambda source: (getter(source),)
+    return getter
+
+
+# gzip_stream - Compress streamed chunks as they are read, so memory stays
+# flat regardless of the size of the export
+#
+# Parameters:
+# - chunks (iterable)
+#   The str or bytes chunks to compress
+# - level (int)
+#   The zlib compression level
+def gzip_stream(chunks, level=GZIP_LEVEL):
+    # 16 + MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 
 class ElasticSearchExporter(object):
 
@@ -16,35 +60,46 @@ class ElasticSearchExporter(object):
     # - header_dict (OrderedDict)
     #   The ordered dictionary where the key is the Elasticsearch field name
     #   and the value is the CSV column header for that field
-    def export_csv(self, scanResponse, header_dict):
-        def read_and_flush(writer, buffer_, row):
-            writer.writerow(row)
-            buffer_.seek(0)
-            data = buffer_.read()
-            buffer_.seek(0)
-            buffer_.truncate()
-            return data
+    # - chunk_size (int)
+    #   The number of characters buffered before a chunk is streamed
+    def export_csv(self, scanResponse, header_dict, chunk_size=CHUNK_SIZE):
+        fields = list(header_dict.keys())
+        get_columns = _column_getter(fields)
+
+        def to_row(source):
+            try:
+                values = get_columns(source)
+            except KeyError:
+                # Fields missing from a complaint are left empty
+                values = tuple(source.get(field, '') for field in fields)
+            # csv leaves None empty, but exports have always said 'None'
+            if None in values:
+                values = tuple('None' if v is None else v for v in values)
+            return values
 
         def stream():
             buffer_ = StringIO()
-            writer = DictWriter(buffer_, header_dict.keys(),
-                                delimiter=",", quoting=csv.QUOTE_MINIMAL)
+            writer = csv.writer(buffer_, delimiter=",",
+                                quoting=csv.QUOTE_MINIMAL)
 
             # Write Header Row
-            data = read_and_flush(writer, buffer_, header_dict)
-            yield data
+            writer.writerow(header_dict.values())
 
-            count = 0
-            # Write CSV
-            for row in scanResponse:
-                count += 1
-                rows_data = {
-                    key: str(value)
-                    for key, value in row['_source'].items()
-                    if key in header_dict.keys()
-                }
-
-                data = read_and_flush(writer, buffer_, rows_data)
+            # Write CSV in batches of rows, streaming a chunk once
+            # chunk_size is reached
+            rows = map(to_row, (row['_source'] for row in scanResponse))
+            while True:
+                batch = list(islice(rows, _ROWS_PER_BATCH))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                if buffer_.tell() >= chunk_size:
+                    yield buffer_.getvalue()
+                    buffer_.seek(0)
+                    buffer_.truncate()
+
+            data = buffer_.getvalue()
+            if data:
                 yield data
 
         response = StreamingHttpResponse(
@@ -58,24 +113,78 @@ class ElasticSearchExporter(object):
     # Parameters:
     # - scanResponse (generator)
     #   The response from an Elasticsearch scan query
-    # - total_count (int)
-    #   The total number of records to be output
-    def export_json(self, scanResponse, total_count):
+    # - chunk_size (int)
+    #   The number of characters buffered before a chunk is streamed
+    def export_json(self, scanResponse, chunk_size=CHUNK_SIZE):
         def stream():
-            count = 0
-            # Write JSON
-            yield '['
+            # Every complaint but the first is prefixed with a comma, so the
+            # total count isn't needed to end the array
+            chunk = ['[']
+            size = 1
+            prefix = ''
             for row in scanResponse:
-                count += 1
-                if count < total_count:
-                    yield '{},'.format(json.dumps(row))
-                else:
-                    yield json.dumps(row)
+                data = _dumps(row)
+                chunk.append(prefix)
+                chunk.append(data)
+                size += len(data) + 1
+                prefix = ','
+                if size >= chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
 
-            yield ']'
+            chunk.append(']')
+            yield ''.join(chunk)
 
         response = StreamingHttpResponse(
             stream(), content_type='text/json'
         )
         response['Content-Disposition'] = "attachment; filename=file.json"
         return response
+
+    # export_ndjson - Stream an Elsticsearch response as newline delimited
+    # JSON, one complaint per line, for consumers that parse as they read
+    #
+    # Parameters:
+    # - scanResponse (generator)
+    #   The response from an Elasticsearch scan query
+    # - chunk_size (int)
+    #   The number of characters buffered before a chunk is streamed
+    def export_ndjson(self, scanResponse, chunk_size=CHUNK_SIZE):
+        def stream():
+            chunk = []
+            size = 0
+            for row in scanResponse:
+                data = _dumps(row)
+                chunk.append(data)
+                chunk.append('\n')
+                size += len(data) + 1
+                if size >= chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+
+            if chunk:
+                yield ''.join(chunk)
+
+        response = StreamingHttpResponse(
+            stream(), content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = \
+            "attachment; filename=file.ndjson"
+        return response
+
+    # export_gzip - Compress an export response as a gzip file
+    #
+    # Parameters:
+    # - response (StreamingHttpResponse)
+    #   The response from one of the export methods
+    def export_gzip(self, response):
+        filename = response['Content-Disposition'].rsplit('=', 1)[1]
+        gzipped = StreamingHttpResponse(
+            gzip_stream(response.streaming_content),
+            content_type='application/gzip'
+        )
+        gzipped['Content-Disposition'] = \
+            "attachment; filename={}.gz".format(filename)
+        return gzipped
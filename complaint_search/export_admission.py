@@ -0,0 +1,219 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from complaint_search.metrics import REGISTRY
+from complaint_search.rate_limit import FileStore, LocalStore
+from complaint_search.throttling import _RATE_LIMITS
+
+
+# -----------------------------------------------------------------------------
+# Export admission
+#
+# Exports stream for minutes, each holding a worker and a scroll context, so
+# only EXPORTS_PER_NODE of them run at once on a node and EXPORTS_TOTAL
+# across nodes (0 for no limit). Exports beyond that wait up to
+# EXPORT_WAIT_SECONDS for a slot, at most EXPORT_MAX_WAITING of them per
+# process, and are refused with a 429 otherwise. Slots are leases in the
+# rate limit store when THROTTLE_REDIS_URL is set. Without it, the slots of a
+# node are kept in files of EXPORT_SLOT_DIR, shared by the workers of the
+# host, and there is no store shared across nodes for EXPORTS_TOTAL.
+# -----------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+_EXPORTS_PER_NODE = int(os.environ.get('EXPORTS_PER_NODE', '4'))
+_EXPORTS_TOTAL = int(os.environ.get('EXPORTS_TOTAL', '0'))
+_EXPORT_WAIT_SECONDS = float(os.environ.get('EXPORT_WAIT_SECONDS', '10'))
+_EXPORT_MAX_WAITING = int(os.environ.get('EXPORT_MAX_WAITING', '8'))
+# Seconds a slot is held without the export making progress
+_EXPORT_LEASE_SECONDS = float(os.environ.get('EXPORT_LEASE_SECONDS', '600'))
+# Suggested to refused clients, as how long exports take is unknown
+_EXPORT_RETRY_AFTER = int(os.environ.get('EXPORT_RETRY_AFTER', '60'))
+_EXPORT_SLOT_DIR = os.environ.get(
+    'EXPORT_SLOT_DIR',
+    os.path.join(tempfile.gettempdir(), 'ccdb5-export-slots')
+)
+
+# Seconds between attempts to take a slot while waiting
+_POLL_SECONDS = 0.25
+
+ADMISSIONS = REGISTRY.counter(
+    'ccdb_export_admissions_total',
+    'Exports started right away, after waiting, or refused',
+    ('result',)
+)
+WAITING = REGISTRY.gauge(
+    'ccdb_export_queue_depth', 'Exports waiting for a slot'
+)
+RUNNING = REGISTRY.gauge(
+    'ccdb_exports_in_progress', 'Exports holding a slot'
+)
+
+
+class Lease(object):
+    """The slots of a running export, refreshed as its content streams and
+    released when it ends"""
+
+    def __init__(self, admission, token):
+        self.admission = admission
+        self.token = token
+        self.refreshed = admission.timer()
+        self.released = False
+
+    def refresh(self):
+        now = self.admission.timer()
+        # Refreshing on every chunk would cost a round trip each
+        if now - self.refreshed < self.admission.lease_seconds / 3:
+            return
+        self.refreshed = now
+        for store, key, limit in self.admission.slots():
+            store.refresh_slot(
+                key, self.token, self.admission.lease_seconds, now
+            )
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        for store, key, limit in self.admission.slots():
+            store.release_slot(key, self.token)
+        RUNNING.dec()
+
+    def stream(self, content):
+        return LeasedContent(self, content)
+
+
+class LeasedContent(object):
+    """Streamed content releasing its lease once consumed or closed"""
+
+    def __init__(self, lease, content):
+        self.lease = lease
+        self.content = content
+        self._chunks = iter(content)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+        self.lease.refresh()
+        return chunk
+
+    def close(self):
+        try:
+            close = getattr(self.content, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.lease.release()
+
+
+class ExportAdmission(object):
+
+    def __init__(self, store, node_store=None, per_node=_EXPORTS_PER_NODE,
+                 total=_EXPORTS_TOTAL, wait_seconds=_EXPORT_WAIT_SECONDS,
+                 max_waiting=_EXPORT_MAX_WAITING,
+                 lease_seconds=_EXPORT_LEASE_SECONDS,
+                 retry_after=_EXPORT_RETRY_AFTER,
+                 node=None, timer=time.time, sleep=time.sleep):
+        self.store = store
+        # The store of the node slots, when not the store shared by nodes
+        self.node_store = node_store or store
+        self.per_node = per_node
+        self.total = total
+        self.wait_seconds = wait_seconds
+        self.max_waiting = max_waiting
+        self.lease_seconds = lease_seconds
+        self.retry_after = retry_after
+        self.node = node or socket.gethostname()
+        self.timer = timer
+        self.sleep = sleep
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def slots(self):
+        """The store, key and number of each kind of slot an export
+        takes"""
+        slots = []
+        if self.per_node > 0:
+            slots.append(
+                (self.node_store, 'exports:node:' + self.node, self.per_node)
+            )
+        if self.total > 0:
+            slots.append((self.store, 'exports', self.total))
+        return slots
+
+    def _acquire(self, token):
+        taken = []
+        now = self.timer()
+        for store, key, limit in self.slots():
+            if not store.acquire_slot(
+                key, token, limit, self.lease_seconds, now
+            ):
+                for store, key in taken:
+                    store.release_slot(key, token)
+                return False
+            taken.append((store, key))
+        return True
+
+    def admit(self):
+        """A Lease for an export, or None when it has to be refused"""
+        token = uuid.uuid4().hex
+        if self._acquire(token):
+            return self._admitted(token, 'admitted')
+
+        with self._lock:
+            refused = self.wait_seconds <= 0 or \
+                self.waiting >= self.max_waiting
+            if not refused:
+                self.waiting += 1
+        if refused:
+            ADMISSIONS.inc('refused')
+            return None
+
+        WAITING.inc()
+        try:
+            deadline = self.timer() + self.wait_seconds
+            while self.timer() < deadline:
+                self.sleep(min(_POLL_SECONDS, deadline - self.timer()))
+                if self._acquire(token):
+                    return self._admitted(token, 'waited')
+        finally:
+            self._stop_waiting()
+            WAITING.dec()
+
+        ADMISSIONS.inc('refused')
+        return None
+
+    def _stop_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def _admitted(self, token, result):
+        ADMISSIONS.inc(result)
+        RUNNING.inc()
+        return Lease(self, token)
+
+
+def _get_admission():
+    if not isinstance(_RATE_LIMITS, LocalStore):
+        return ExportAdmission(_RATE_LIMITS)
+
+    if _EXPORTS_TOTAL > 0:
+        log.warning(
+            'EXPORTS_TOTAL is set without THROTTLE_REDIS_URL, so it only '
+            'limits the exports of each process'
+        )
+    return ExportAdmission(_RATE_LIMITS, FileStore(_EXPORT_SLOT_DIR))
+
+
+EXPORTS = _get_admission()
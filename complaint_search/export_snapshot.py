@@ -0,0 +1,83 @@
+import glob
+import os
+import re
+import tempfile
+
+from complaint_search import es_interface
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS, PARAMS
+
+
+# -----------------------------------------------------------------------------
+# Export snapshots
+#
+# Unfiltered exports of the whole database, written to EXPORT_SNAPSHOT_DIR
+# once per index refresh by the build_export_snapshots command. Snapshot
+# names include the last_indexed date, so a snapshot is only served while
+# it matches the index.
+# -----------------------------------------------------------------------------
+
+_SNAPSHOT_DIR = os.environ.get('EXPORT_SNAPSHOT_DIR', '')
+
+# Snapshots hold the complaints matching the default field, in the default
+# sort, so only exports with these values can be served from them
+SNAPSHOT_PARAMS = {
+    'field': PARAMS['field'],
+    'sort': PARAMS['sort'],
+}
+
+
+def _snapshot_name(format, last_indexed):
+    version = re.sub(r'[^0-9A-Za-z]', '', last_indexed)
+    return 'complaints-{}.{}'.format(version, format)
+
+
+def find_snapshot(format, directory=None):
+    """Return the path of the snapshot of the current index in `format`,
+    or None when it hasn't been built."""
+    directory = directory or _SNAPSHOT_DIR
+    if not directory:
+        return None
+
+    meta = es_interface._get_meta()
+    name = _snapshot_name(format, meta['last_indexed'])
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def build_snapshot(format, directory=None, force=False):
+    """Write the snapshot of the current index in `format` unless it exists,
+    and remove the snapshots of previous indexes.
+
+    Returns the path of the snapshot and whether it was written.
+    """
+    directory = directory or _SNAPSHOT_DIR
+    meta = es_interface._get_meta()
+    name = _snapshot_name(format, meta['last_indexed'])
+    path = os.path.join(directory, name)
+    if os.path.isfile(path) and not force:
+        return path, False
+
+    response = es_interface.search(agg_exclude=AGG_EXCLUDE_FIELDS,
+                                   format=format, **SNAPSHOT_PARAMS)
+
+    # Written next to the snapshot and renamed, so a partial file is never
+    # served
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as snapshot:
+            for chunk in response.streaming_content:
+                snapshot.write(chunk)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    for previous in glob.glob(os.path.join(
+        directory, 'complaints-*.{}'.format(format)
+    )):
+        if previous != path:
+            os.remove(previous)
+
+    return path, True
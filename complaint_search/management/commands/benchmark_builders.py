@@ -0,0 +1,110 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from complaint_search import es_builders
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS, PARAMS
+from complaint_search.es_builders import (
+    AggregationBuilder,
+    DateRangeBucketsBuilder,
+    PostFilterBuilder,
+    SearchBuilder,
+    StateAggregationBuilder,
+    TrendsAggregationBuilder,
+)
+
+
+FILTERS = {
+    'company': ['EQUIFAX, INC.', 'Experian Information Solutions Inc.'],
+    'product': [
+        u'Mortgage•Conventional home mortgage', 'Debt collection'
+    ],
+    'issue': ['Incorrect information on your report'],
+    'state': ['VA', 'CA'],
+    'not_tags': ['Servicemember'],
+    'date_received_min': '2018-01-01',
+    'date_received_max': '2020-01-01',
+}
+
+
+def _build(builder_class, params, exclude=None):
+    builder = builder_class()
+    builder.add(**params)
+    if exclude:
+        builder.add_exclude(exclude)
+    return builder.build()
+
+
+# The bodies built by each endpoint of es_interface
+def search_body(params):
+    body = _build(SearchBuilder, params)
+    body['post_filter'] = _build(PostFilterBuilder, params)
+    body['aggs'] = _build(AggregationBuilder, params, AGG_EXCLUDE_FIELDS)
+    return body
+
+
+def states_body(params):
+    params = dict(params, size=0)
+    body = _build(SearchBuilder, params)
+    body['aggs'] = _build(StateAggregationBuilder, params, AGG_EXCLUDE_FIELDS)
+    return body
+
+
+def trends_body(params):
+    params = dict(params, size=0, lens='product', sub_lens='sub_product',
+                  trend_interval='month', trend_depth=5, sub_lens_depth=5)
+    body = _build(SearchBuilder, params)
+    body['aggs'] = _build(TrendsAggregationBuilder, params,
+                          AGG_EXCLUDE_FIELDS)
+    body['aggs'].update(_build(DateRangeBucketsBuilder, params))
+    return body
+
+
+SCENARIOS = (
+    ('search', search_body, {}),
+    ('search filtered', search_body, FILTERS),
+    ('states', states_body, {}),
+    ('states filtered', states_body, FILTERS),
+    ('trends', trends_body, {}),
+    ('trends filtered', trends_body, FILTERS),
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark building the Elasticsearch bodies of each endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=2000,
+            help='Number of bodies built per scenario'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        cache = es_builders._BODY_CACHE
+        max_entries = cache.max_entries
+
+        self.stdout.write('{:<20} {:>12} {:>12}'.format(
+            'endpoint', 'built us', 'cached us'))
+        try:
+            for name, build, filters in SCENARIOS:
+                params = dict(PARAMS, **filters)
+
+                cache.max_entries = 0
+                built = self._time(build, params, iterations)
+
+                cache.max_entries = max_entries or 1
+                build(params)
+                cached = self._time(build, params, iterations)
+
+                self.stdout.write('{:<20} {:>12.1f} {:>12.1f}'.format(
+                    name, built, cached))
+        finally:
+            cache.max_entries = max_entries
+            cache.clear()
+
+    def _time(self, build, params, iterations):
+        start = time.time()
+        for _ in range(iterations):
+            build(params)
+        return (time.time() - start) * 1000000 / iterations
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from complaint_search import es_interface
+from complaint_search.es_client import OPERATIONS
+from complaint_search.es_stand_in import StandInElasticsearch
+
+
+try:
+    from django.test import AsyncClient
+except ImportError:  # Django < 3.1
+    AsyncClient = None
+
+
+# Not throttled, and answered with a single search
+STATES_URL = '/geo/states'
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Load test the WSGI and ASGI views against the stand-in'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Number of concurrent states requests'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=200.0,
+            help='Simulated Elasticsearch round trip in milliseconds'
+        )
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Threads of the WSGI worker'
+        )
+
+    def handle(self, *args, **options):
+        if AsyncClient is None or not hasattr(asyncio, 'run'):
+            raise CommandError(
+                'The async views need Python 3.7 and Django 3.1'
+            )
+
+        stand_in = StandInElasticsearch(
+            latency=options['latency'] / 1000.0, terms_size=5
+        )
+        requests = options['requests']
+
+        original_clients = dict(es_interface._ES_CLIENTS)
+        es_interface._ES_CLIENTS.update(dict.fromkeys(OPERATIONS, stand_in))
+        # Every request has to reach Elasticsearch, rather than share the
+        # cached or in flight response of identical ones
+        max_entries = es_interface._RESULT_CACHE.max_entries
+        es_interface._RESULT_CACHE.max_entries = 0
+        coalesce = es_interface._IN_FLIGHT.enabled
+        es_interface._IN_FLIGHT.enabled = False
+        try:
+            self.stdout.write(
+                '{:<6} {:>12} {:>10} {:>10} {:>10} {:>10}'.format(
+                    'stack', 'concurrency', 'seconds', 'req/sec', 'p95 ms',
+                    'in flight'
+                )
+            )
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                stand_in.max_in_flight = 0
+                elapsed, latencies = self._run_wsgi(
+                    requests, options['threads']
+                )
+                self._report('wsgi', '{} threads'.format(options['threads']),
+                             elapsed, latencies, stand_in)
+
+                stand_in.max_in_flight = 0
+                with override_settings(ROOT_URLCONF='ccdb5_api.asgi_urls'):
+                    elapsed, latencies = asyncio.run(
+                        self._run_asgi(requests)
+                    )
+                self._report('asgi', 'event loop', elapsed, latencies,
+                             stand_in)
+        finally:
+            es_interface._RESULT_CACHE.max_entries = max_entries
+            es_interface._IN_FLIGHT.enabled = coalesce
+            es_interface._ES_CLIENTS.clear()
+            es_interface._ES_CLIENTS.update(original_clients)
+
+    def _report(self, stack, concurrency, elapsed, latencies, stand_in):
+        self.stdout.write(
+            '{:<6} {:>12} {:>10.2f} {:>10.0f} {:>10.0f} {:>10}'.format(
+                stack, concurrency, elapsed, len(latencies) / elapsed,
+                _percentile(latencies, 95) * 1000, stand_in.max_in_flight
+            )
+        )
+
+    def _get(self, client):
+        start = time.time()
+        response = client.get(STATES_URL)
+        if response.status_code != 200:
+            raise ValueError(response.content)
+        return time.time() - start
+
+    def _run_wsgi(self, requests, threads):
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(
+                lambda _: self._get(Client()), range(requests)
+            ))
+        return time.time() - start, latencies
+
+    async def _run_asgi(self, requests):
+        async def get():
+            start = time.time()
+            response = await AsyncClient().get(STATES_URL)
+            if response.status_code != 200:
+                raise ValueError(response.content)
+            return time.time() - start
+
+        start = time.time()
+        latencies = await asyncio.gather(*[get() for _ in range(requests)])
+        return time.time() - start, latencies
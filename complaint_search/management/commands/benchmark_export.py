@@ -0,0 +1,133 @@
+import csv
+import json
+import random
+import time
+from csv import DictWriter
+from io import StringIO
+
+from django.core.management.base import BaseCommand
+from django.http import StreamingHttpResponse
+
+from complaint_search.defaults import CSV_ORDERED_HEADERS
+from complaint_search.export import ElasticSearchExporter
+
+
+def generate_hits(count, seed=0):
+    rng = random.Random(seed)
+    words = ['account', 'bank', 'credit', 'report', 'loan', 'payment',
+             'mortgage', 'called', 'fee', 'debt', 'company', 'XXXX']
+    for i in range(count):
+        narrative = ''
+        # About a third of complaints have a narrative
+        if rng.random() < 0.3:
+            narrative = ' '.join(
+                rng.choice(words) for _ in range(rng.randint(50, 400))
+            )
+        yield {
+            '_source': {
+                'date_received_formatted': '2020-06-01',
+                'product': 'Credit reporting, credit repair services, or '
+                           'other personal consumer reports',
+                'sub_product': 'Credit reporting',
+                'issue': 'Incorrect information on your report',
+                'sub_issue': 'Information belongs to someone else',
+                'complaint_what_happened': narrative,
+                'company_public_response': 'Company has responded to the '
+                                           'consumer and the CFPB',
+                'company': 'EQUIFAX, INC.',
+                'state': 'VA',
+                'zip_code': '22030',
+                'tags': 'Servicemember',
+                'consumer_consent_provided': 'Consent provided',
+                'submitted_via': 'Web',
+                'date_sent_to_company_formatted': '2020-06-01',
+                'company_response': 'Closed with explanation',
+                'timely': 'Yes',
+                'consumer_disputed': 'N/A',
+                'complaint_id': str(3687283 + i),
+            }
+        }
+
+
+# The previous writer, one DictWriter row per streamed chunk
+def row_at_a_time_csv(scanResponse, header_dict):
+    def read_and_flush(writer, buffer_, row):
+        writer.writerow(row)
+        buffer_.seek(0)
+        data = buffer_.read()
+        buffer_.seek(0)
+        buffer_.truncate()
+        return data
+
+    def stream():
+        buffer_ = StringIO()
+        writer = DictWriter(buffer_, header_dict.keys(),
+                            delimiter=",", quoting=csv.QUOTE_MINIMAL)
+        yield read_and_flush(writer, buffer_, header_dict)
+        for row in scanResponse:
+            rows_data = {
+                key: str(value)
+                for key, value in row['_source'].items()
+                if key in header_dict.keys()
+            }
+            yield read_and_flush(writer, buffer_, rows_data)
+
+    return StreamingHttpResponse(stream(), content_type='text/csv')
+
+
+# The previous JSON writer, one formatted string per complaint and a
+# total count to know where the array ends
+def row_at_a_time_json(scanResponse, total_count):
+    def stream():
+        count = 0
+        yield '['
+        for row in scanResponse:
+            count += 1
+            if count == total_count:
+                yield '{}'.format(json.dumps(row))
+            else:
+                yield '{},'.format(json.dumps(row))
+        yield ']'
+
+    return StreamingHttpResponse(stream(), content_type='text/json')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the export writers on generated complaints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=100000,
+            help='Number of complaints to export'
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        # Generate up front so only the writers are measured
+        hits = list(generate_hits(rows))
+        exporter = ElasticSearchExporter()
+
+        writers = (
+            ('csv row at a time', lambda: row_at_a_time_csv(
+                iter(hits), CSV_ORDERED_HEADERS)),
+            ('csv batched', lambda: exporter.export_csv(
+                iter(hits), CSV_ORDERED_HEADERS)),
+            ('json row at a time', lambda: row_at_a_time_json(
+                iter(hits), rows)),
+            ('json chunked', lambda: exporter.export_json(iter(hits))),
+            ('ndjson chunked', lambda: exporter.export_ndjson(iter(hits))),
+        )
+
+        self.stdout.write('{:<20} {:>12} {:>10} {:>12}'.format(
+            'writer', 'rows/sec', 'chunks', 'avg chunk'))
+        for name, export in writers:
+            start = time.time()
+            chunks = 0
+            size = 0
+            for chunk in export().streaming_content:
+                chunks += 1
+                size += len(chunk)
+            elapsed = time.time() - start
+
+            self.stdout.write('{:<20} {:>12.0f} {:>10} {:>12.0f}'.format(
+                name, rows / elapsed, chunks, size / chunks))
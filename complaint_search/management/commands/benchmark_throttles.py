@@ -0,0 +1,129 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from complaint_search.rate_limit import LocalStore
+from complaint_search.throttling import (
+    _CCDB_UI_URL,
+    CCDBRateThrottle,
+    CCDBThrottle,
+    DocumentThrottle,
+    SearchThrottle,
+)
+from rest_framework.request import Request
+
+
+SCENARIOS = (
+    ('anon search', SearchThrottle, {}, {}),
+    ('anon export', SearchThrottle, {'format': 'csv'}, {}),
+    ('ui search', SearchThrottle, {}, {'HTTP_REFERER': _CCDB_UI_URL}),
+    ('ui export', SearchThrottle, {'format': 'csv'},
+     {'HTTP_REFERER': _CCDB_UI_URL}),
+    ('document', DocumentThrottle, {}, {}),
+)
+
+
+class CountingStore(object):
+    """A rate limit store counting its updates, each taking `latency`
+    seconds like a round trip to Redis"""
+
+    def __init__(self, latency=0.0):
+        self.store = LocalStore()
+        self.latency = latency
+        self.updates = 0
+
+    def _update(self):
+        self.updates += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def acquire(self, key, interval, period, now):
+        self._update()
+        return self.store.acquire(key, interval, period, now)
+
+    def acquire_many(self, limits, now):
+        self._update()
+        return self.store.acquire_many(limits, now)
+
+
+# Every throttle class of the view checking the request on its own, as DRF
+# does with throttle_classes
+def separate(throttle, request):
+    for throttle_class in throttle.throttle_classes:
+        throttle_class().allow_request(request, None)
+
+
+def combined(throttle, request):
+    throttle().allow_request(request, None)
+
+
+STRATEGIES = (
+    ('separate', separate),
+    ('combined', combined),
+)
+
+
+def build_requests(count, data, headers):
+    factory = RequestFactory()
+    requests = []
+    for client in range(count):
+        # Each request from a client of its own, so none is refused
+        request = Request(factory.get(
+            '/', data,
+            REMOTE_ADDR='10.{}.{}.{}'.format(
+                client >> 16 & 255, client >> 8 & 255, client & 255),
+            **headers
+        ))
+        # Authenticated before the throttles run
+        request.user
+        requests.append(request)
+    return requests
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the overhead of throttling a request'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=2000,
+            help='Number of requests throttled per scenario'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help='Milliseconds of each update of the rate limit store'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        latency = options['latency'] / 1000.0
+
+        self.stdout.write('{:<12} {:>12} {:>12} {:>14} {:>14}'.format(
+            'scenario', 'separate us', 'combined us', 'separate ops',
+            'combined ops'))
+
+        stores = (CCDBRateThrottle.store, CCDBThrottle.store)
+        try:
+            for name, throttle, data, headers in SCENARIOS:
+                requests = build_requests(iterations, data, headers)
+                times = {}
+                updates = {}
+                for label, check in STRATEGIES:
+                    store = CountingStore(latency)
+                    CCDBRateThrottle.store = CCDBThrottle.store = store
+
+                    start = time.time()
+                    for request in requests:
+                        check(throttle, request)
+                    times[label] = \
+                        (time.time() - start) * 1000000 / iterations
+                    updates[label] = float(store.updates) / iterations
+
+                self.stdout.write(
+                    '{:<12} {:>12.1f} {:>12.1f} {:>14.1f} {:>14.1f}'.format(
+                        name, times['separate'], times['combined'],
+                        updates['separate'], updates['combined']
+                    )
+                )
+        finally:
+            CCDBRateThrottle.store, CCDBThrottle.store = stores
@@ -0,0 +1,143 @@
+import gc
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from complaint_search.es_interface import (
+    get_sug_agg_key_if_exists,
+    process_trend_aggregations,
+)
+
+
+def _trend_period(days, start, with_diff=True):
+    buckets = []
+    previous = None
+    for day in range(days):
+        date = start + timedelta(days=day)
+        count = (day * 7919) % 97
+        bucket = {
+            'key_as_string': date.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'key': int((date - datetime(1970, 1, 1)).total_seconds() * 1000),
+            'doc_count': count,
+        }
+        if with_diff and previous is not None:
+            bucket['interval_diff'] = {'value': count - previous}
+        buckets.append(bucket)
+        previous = count
+    return {'buckets': buckets}
+
+
+def generate_aggregations(lens, terms, sub_terms, days):
+    """Trends aggregations of a day interval lens, with a sub lens when
+    sub_terms is not 0, in the ascending order date_histogram returns"""
+    start = datetime(2011, 12, 1)
+    buckets = []
+    for term in range(terms):
+        bucket = {
+            'key': '{} {}'.format(lens, term),
+            'doc_count': 1000,
+            'trend_period': _trend_period(days, start, with_diff=False),
+        }
+        if sub_terms:
+            bucket['sub_' + lens] = {'buckets': [{
+                'key': 'sub_{} {}'.format(lens, sub_term),
+                'doc_count': 100,
+                'trend_period': _trend_period(days, start),
+            } for sub_term in range(sub_terms)]}
+        buckets.append(bucket)
+    return {lens: {lens: {'buckets': buckets}}}
+
+
+# The previous processing, sorting every trend_period by key_as_string
+def sorted_trend_aggregations(aggregations):
+    trend_charts = (
+        'product',
+        'sub-product',
+        'issue',
+        'sub-issue',
+        'tags'
+    )
+
+    for agg_name in trend_charts:
+        if agg_name in aggregations:
+            agg_buckets = \
+                aggregations[agg_name][agg_name]['buckets']
+            for sub_agg in agg_buckets:
+                sub_agg['trend_period']['buckets'] = sorted(
+                    sub_agg['trend_period']['buckets'],
+                    key=lambda k: k['key_as_string'], reverse=True)
+                sub_agg_name = get_sug_agg_key_if_exists(sub_agg)
+                if sub_agg_name:
+                    for sub_sub_agg in sub_agg[sub_agg_name]['buckets']:
+                        sub_sub_agg['trend_period']['buckets'] = sorted(
+                            sub_sub_agg['trend_period']['buckets'],
+                            key=lambda k: k['key_as_string'],
+                            reverse=True)[1:2]
+    return aggregations
+
+
+PROCESSORS = (
+    ('sorted', sorted_trend_aggregations),
+    ('reversed', process_trend_aggregations),
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark processing trends aggregations of daily intervals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=5,
+            help='Number of times each response is processed'
+        )
+        parser.add_argument(
+            '--days', type=int, default=3000,
+            help='Number of daily buckets in each trend_period'
+        )
+        parser.add_argument(
+            '--terms', type=int, default=10,
+            help='Number of lens buckets'
+        )
+        parser.add_argument(
+            '--sub-terms', type=int, default=10,
+            help='Number of sub lens buckets per lens bucket'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = (
+            ('product', 0),
+            ('product/sub-product', options['sub_terms']),
+        )
+
+        self.stdout.write('{:<22} {:>10} {:>12} {:>12} {:>6}'.format(
+            'scenario', 'buckets', 'sorted ms', 'reversed ms', 'same'))
+        for name, sub_terms in scenarios:
+            args = ('product', options['terms'], sub_terms, options['days'])
+            buckets = options['terms'] * (1 + sub_terms) * options['days']
+
+            times = {}
+            results = {}
+            for label, process in PROCESSORS:
+                times[label] = 0.0
+                for _ in range(options['iterations']):
+                    # Processing reorders the buckets in place
+                    aggregations = generate_aggregations(*args)
+                    # Like timeit, without collecting the generated buckets
+                    gc.disable()
+                    try:
+                        start = time.time()
+                        results[label] = process(aggregations)
+                        times[label] += time.time() - start
+                    finally:
+                        gc.enable()
+
+            self.stdout.write(
+                '{:<22} {:>10} {:>12.1f} {:>12.1f} {:>6}'.format(
+                    name, buckets,
+                    times['sorted'] * 1000 / options['iterations'],
+                    times['reversed'] * 1000 / options['iterations'],
+                    'yes' if results['sorted'] == results['reversed']
+                    else 'no'
+                )
+            )
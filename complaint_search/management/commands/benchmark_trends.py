@@ -0,0 +1,115 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from complaint_search import es_interface
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS
+from complaint_search.es_client import OPERATIONS
+from complaint_search.es_stand_in import StandInElasticsearch
+from complaint_search.serializer import TrendsInputSerializer
+
+
+# Typical lens/focus/interval combinations requested by the trends UI
+SCENARIOS = (
+    ('overview year', {'lens': 'overview', 'trend_interval': 'year'}),
+    ('overview quarter', {'lens': 'overview', 'trend_interval': 'quarter'}),
+    ('overview month', {'lens': 'overview', 'trend_interval': 'month'}),
+    ('overview week', {'lens': 'overview', 'trend_interval': 'week'}),
+    ('overview day', {'lens': 'overview', 'trend_interval': 'day'}),
+    ('product/sub_product month', {
+        'lens': 'product', 'sub_lens': 'sub_product',
+        'trend_interval': 'month'}),
+    ('product/issue month', {
+        'lens': 'product', 'sub_lens': 'issue', 'trend_interval': 'month'}),
+    ('issue/sub_issue month', {
+        'lens': 'issue', 'sub_lens': 'sub_issue', 'trend_interval': 'month'}),
+    ('company/product month', {
+        'lens': 'company', 'sub_lens': 'product', 'trend_interval': 'month',
+        'company': ['EQUIFAX, INC.']}),
+    ('tags/product month', {
+        'lens': 'tags', 'sub_lens': 'product', 'trend_interval': 'month'}),
+    ('product focus month', {
+        'lens': 'product', 'focus': 'Mortgage', 'trend_interval': 'month'}),
+    ('issue focus week', {
+        'lens': 'issue', 'focus': 'Incorrect information on your report',
+        'trend_interval': 'week'}),
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark trends queries against a local Elasticsearch stand-in'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=10,
+            help='Number of times each scenario is run'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=50.0,
+            help='Simulated Elasticsearch round trip in milliseconds'
+        )
+        parser.add_argument(
+            '--terms-size', type=int, default=5,
+            help='Number of buckets the stand-in returns per terms agg'
+        )
+
+    def handle(self, *args, **options):
+        stand_in = StandInElasticsearch(
+            latency=options['latency'] / 1000.0,
+            terms_size=options['terms_size']
+        )
+        iterations = options['iterations']
+
+        original_clients = dict(es_interface._ES_CLIENTS)
+        es_interface._ES_CLIENTS.update(dict.fromkeys(OPERATIONS, stand_in))
+        try:
+            self.stdout.write('{:<28} {:>12} {:>14} {:>12}'.format(
+                'scenario', 'trends ms', 'serial ES ms', 'round trips'))
+            for name, data in SCENARIOS:
+                serializer = TrendsInputSerializer(data=data)
+                serializer.is_valid(raise_exception=True)
+                params = serializer.validated_data
+
+                trends_time = 0.0
+                sequential_time = 0.0
+                for _ in range(iterations):
+                    del stand_in.requests[:]
+                    trends_time += self._time(
+                        stand_in, es_interface.trends,
+                        AGG_EXCLUDE_FIELDS, **params
+                    )
+                    round_trips = len(stand_in.requests)
+
+                    # The same bodies issued one after another, without
+                    # any post-processing
+                    bodies = [
+                        body
+                        for method, request in list(stand_in.requests)
+                        for body in (
+                            request if method == 'msearch' else [request]
+                        )
+                    ]
+                    sequential_time += self._time(
+                        stand_in, self._search_each, stand_in, bodies
+                    )
+
+                self.stdout.write('{:<28} {:>12.1f} {:>14.1f} {:>12}'.format(
+                    name,
+                    trends_time * 1000 / iterations,
+                    sequential_time * 1000 / iterations,
+                    round_trips
+                ))
+        finally:
+            es_interface._ES_CLIENTS.clear()
+            es_interface._ES_CLIENTS.update(original_clients)
+
+    def _search_each(self, stand_in, bodies):
+        for body in bodies:
+            stand_in.search(body=body)
+
+    def _time(self, stand_in, function, *args, **kwargs):
+        synthesis_time = stand_in.synthesis_time
+        start = time.time()
+        function(*args, **kwargs)
+        elapsed = time.time() - start
+        return elapsed - (stand_in.synthesis_time - synthesis_time)
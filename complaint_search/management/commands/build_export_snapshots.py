@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from complaint_search import export_snapshot
+from complaint_search.defaults import EXPORT_FORMATS, EXPORT_SNAPSHOT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Build the unfiltered export snapshots of the current index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--formats', nargs='+', choices=EXPORT_FORMATS,
+            default=list(EXPORT_SNAPSHOT_FORMATS),
+            help='Export formats to build'
+        )
+        parser.add_argument(
+            '--directory', default=export_snapshot._SNAPSHOT_DIR,
+            help='Directory of the snapshots, EXPORT_SNAPSHOT_DIR by default'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild snapshots that already exist'
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not directory:
+            raise CommandError(
+                'Set EXPORT_SNAPSHOT_DIR or pass --directory'
+            )
+
+        for format in options['formats']:
+            path, built = export_snapshot.build_snapshot(
+                format, directory, force=options['force']
+            )
+            self.stdout.write('{} {}'.format(
+                'Built' if built else 'Up to date', path))
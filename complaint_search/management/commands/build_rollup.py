@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from complaint_search import es_interface, rollup
+from elasticsearch import helpers
+
+
+class Command(BaseCommand):
+    help = 'Build the rollup of the current index for trends and states'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default=rollup._ROLLUP_DIR,
+            help='Directory of the rollup, ROLLUP_DIR by default'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild the rollup if it already exists'
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not directory:
+            raise CommandError('Set ROLLUP_DIR or pass --directory')
+
+        meta = es_interface._get_meta()
+        hits = helpers.scan(
+            es_interface._get_es('export'),
+            query={'_source': list(rollup.SOURCE_FIELDS)},
+            scroll='10m',
+            index=es_interface._COMPLAINT_ES_INDEX,
+            doc_type=es_interface._COMPLAINT_DOC_TYPE,
+            size=7000
+        )
+        path, built = rollup.build_rollup(
+            (hit['_source'] for hit in hits), meta['last_indexed'],
+            directory, force=options['force']
+        )
+        self.stdout.write('{} {}'.format(
+            'Built' if built else 'Up to date', path))
@@ -0,0 +1,98 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from complaint_search import es_builders, es_interface, slow_log, timing
+from complaint_search.es_client import OPERATIONS
+from complaint_search.es_stand_in import RecordedElasticsearch
+from elasticsearch import Elasticsearch
+
+
+class Command(BaseCommand):
+    help = 'Replay the requests of a slow query log and time them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='Slow query log file')
+        parser.add_argument(
+            '--es-url',
+            help='Replay against this Elasticsearch instead of the '
+                 'recorded responses'
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=1,
+            help='Number of times each entry is replayed'
+        )
+
+    def handle(self, *args, **options):
+        with open(options['log']) as log:
+            entries = list(slow_log.read(log))
+
+        client = None
+        if options['es_url']:
+            client = Elasticsearch([options['es_url']], timeout=100)
+
+        original_clients = dict(es_interface._ES_CLIENTS)
+        # Every entry has to be built and run
+        max_entries = es_interface._RESULT_CACHE.max_entries
+        body_max_entries = es_builders._BODY_CACHE.max_entries
+        es_interface._RESULT_CACHE.max_entries = 0
+        es_builders._BODY_CACHE.max_entries = 0
+        try:
+            self.stdout.write(
+                '{:<16} {:>12} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+                    'endpoint', 'recorded ms', 'total ms', 'build ms',
+                    'es ms', 'process ms', 'replayed'
+                )
+            )
+            for entry in entries:
+                self._replay(entry, client, options['iterations'])
+        finally:
+            es_interface._RESULT_CACHE.max_entries = max_entries
+            es_builders._BODY_CACHE.max_entries = body_max_entries
+            es_interface._clear_meta_cache()
+            es_interface._ES_CLIENTS.clear()
+            es_interface._ES_CLIENTS.update(original_clients)
+
+    def _replay(self, entry, client, iterations):
+        call = entry['call']
+        function = getattr(es_interface, call['function'])
+
+        totals = dict.fromkeys(('total', 'build', 'es', 'process'), 0.0)
+        replayed = '-'
+        for _ in range(iterations):
+            # Nor is the index metadata found from a previous run
+            es_interface._clear_meta_cache()
+            if client is None:
+                recorded = RecordedElasticsearch(entry['queries'])
+                es_client = timing.TimedClient(recorded)
+            else:
+                es_client = timing.TimedClient(client)
+            es_interface._ES_CLIENTS.update(
+                dict.fromkeys(OPERATIONS, es_client)
+            )
+
+            timings, token = timing.start()
+            try:
+                function(*call['args'], **call['kwargs'])
+            finally:
+                timing.finish(token)
+            totals['total'] += time.time() - timings.start
+            for phase in ('build', 'es', 'process'):
+                totals[phase] += timings.phases.get(phase, 0.0)
+
+            if client is None:
+                replayed = '{}/{}'.format(
+                    recorded.replayed, recorded.replayed + recorded.synthesized
+                )
+
+        self.stdout.write(
+            '{:<16} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} '
+            '{:>9}'.format(
+                entry['endpoint'], entry['total'] * 1000,
+                totals['total'] * 1000 / iterations,
+                totals['build'] * 1000 / iterations,
+                totals['es'] * 1000 / iterations,
+                totals['process'] * 1000 / iterations,
+                replayed
+            )
+        )
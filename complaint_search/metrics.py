@@ -0,0 +1,186 @@
+import bisect
+import threading
+from collections import defaultdict
+
+
+# -----------------------------------------------------------------------------
+# Metrics
+#
+# In-process counters and histograms, written in the Prometheus text
+# exposition format by the metrics view. Each process keeps its own values,
+# so every worker has to be scraped.
+# -----------------------------------------------------------------------------
+
+# Upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    """A value going up and down, such as the length of a queue"""
+
+    type = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values, the count of each bucket, then the sum
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (label_values, list(counts))
+                for label_values, counts in self._values.items()
+            )
+        bounds = self.buckets + (float('inf'),)
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(
+                    self.labels, label_values,
+                    [('le', _format_value(bound))]
+                ), cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_sum', labels, counts[-1]
+            yield self.name + '_count', labels, cumulative
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+        # Functions returning metrics whose values live elsewhere
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """Register a function returning metrics to expose, built when the
+        metrics are read"""
+        self.collectors.append(collect)
+        return collect
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.register(
+            Histogram(name, documentation, labels, buckets)
+        )
+
+    def exposition(self):
+        """The metrics in the Prometheus text format"""
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(
+                metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(
+                    name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+def stats_counter(name, documentation, label, stats):
+    """A counter of the results of a ResultCache, per key of its stats"""
+    counter = Counter(name, documentation, (label, 'result'))
+    for key, counts in stats.items():
+        for result, count in counts.items():
+            counter.inc(key, result, amount=count)
+    return counter
+
+
+REGISTRY = Registry()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from complaint_search import slow_log, timing
+
+
+class TimingMiddleware(object):
+    """Time each request, add a Server-Timing header to its response and
+    record it in the metrics, and in the slow query log when slow"""
+
+    # Under ASGI, async views are awaited without a thread of their own
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Like django.utils.deprecation.MiddlewareMixin, so Django
+            # awaits the middleware
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        timings, token = timing.start(slow_log.record_responses())
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.finish(token)
+        return self._timed(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = timing.start(slow_log.record_responses())
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.finish(token)
+        return self._timed(request, response, timings)
+
+    def _timed(self, request, response, timings):
+        total = time.time() - timings.start
+
+        response['Server-Timing'] = timings.server_timing(total)
+        resolver_match = getattr(request, 'resolver_match', None)
+        endpoint = resolver_match.url_name if resolver_match else 'unmatched'
+        timings.observe(endpoint, response.status_code, total)
+        slow_log.record(endpoint, timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook
+        timings = timing.current()
+        start = time.time()
+
+        def rendered(response):
+            timings.add('serialize', time.time() - start)
+
+        if timings is not None:
+            response.add_post_render_callback(rendered)
+        return response
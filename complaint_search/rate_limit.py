@@ -0,0 +1,278 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+# -----------------------------------------------------------------------------
+# Rate limits
+#
+# The throttles count requests with the generic cell rate algorithm (GCRA): a
+# client sending `limit` requests per `period` is allowed a request as long
+# as its theoretical arrival time (TAT), pushed back by period / limit on
+# every allowed request, is no more than `period` ahead of now. Only the TAT
+# of each client is stored, and a request is a single atomic update of it,
+# in Redis when THROTTLE_REDIS_URL is set so that limits hold across
+# workers, or else in the memory of each process.
+#
+# Stores also hold slots, leased to long requests such as exports to limit
+# how many run at once. Leases expire unless refreshed, so the slots of a
+# worker that dies are eventually freed. Without Redis, the slots of a host
+# can still be shared by its workers through locked files.
+# -----------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+
+# KEYS are the keys of a client in each of its limits, ARGV the current time
+# then the emission interval and period of each limit, in seconds. Returns
+# the seconds to wait before the request is allowed by every limit, or 0
+# when it is allowed and counted in each.
+_GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tats = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i])
+    local period = tonumber(ARGV[2 * i + 1])
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then
+        tat = now
+    end
+    tats[i] = tat + interval
+    wait = math.max(wait, tats[i] - period - now)
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, tostring(tats[i]), 'PX',
+               math.ceil((tats[i] - now) * 1000))
+end
+return '0'
+"""
+
+
+# KEYS[1] is the set of leases of the slots, scored by expiry. ARGV is the
+# token of the lease, the number of slots, the seconds of the lease and the
+# current time. Returns 1 when the lease is taken.
+_ACQUIRE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])))
+return 1
+"""
+
+
+def _gcra(tat, interval, period, now):
+    """The new TAT of an allowed request and the seconds to wait, 0 when it
+    is allowed"""
+    new_tat = max(tat if tat is not None else now, now) + interval
+    wait = new_tat - period - now
+    if wait > 0:
+        return tat, wait
+    return new_tat, 0
+
+
+class LocalStore(object):
+    """The TAT of each client in the memory of the process"""
+
+    def __init__(self):
+        self._tats = {}
+        # Per key, the expiry of each lease
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def acquire(self, key, interval, period, now):
+        return self.acquire_many([(key, interval, period)], now)
+
+    def acquire_many(self, limits, now):
+        """Count a request in each (key, interval, period) limit if all of
+        them allow it, else return the seconds to wait"""
+        with self._lock:
+            tats = []
+            wait = 0
+            for key, interval, period in limits:
+                tat, key_wait = _gcra(
+                    self._tats.get(key), interval, period, now
+                )
+                tats.append((key, tat))
+                wait = max(wait, key_wait)
+            if wait:
+                return wait
+
+            self._tats.update(tats)
+            if len(self._tats) >= self._sweep_at:
+                self._sweep(now)
+            return 0
+
+    def _sweep(self, now):
+        # Clients whose TAT has passed are as good as new. Sweeping when the
+        # number of clients doubles keeps the cost per request constant.
+        self._tats = {
+            key: tat for key, tat in self._tats.items() if tat > now
+        }
+        self._sweep_at = max(1024, 2 * len(self._tats))
+
+    def acquire_slot(self, key, token, limit, seconds, now):
+        with self._lock:
+            leases = self._slots.setdefault(key, {})
+            for expired in [t for t, expiry in leases.items()
+                            if expiry <= now]:
+                del leases[expired]
+            if len(leases) >= limit:
+                return False
+            leases[token] = now + seconds
+            return True
+
+    def refresh_slot(self, key, token, seconds, now):
+        with self._lock:
+            leases = self._slots.get(key, {})
+            if token in leases:
+                leases[token] = now + seconds
+
+    def release_slot(self, key, token):
+        with self._lock:
+            self._slots.get(key, {}).pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+            self._slots.clear()
+
+
+class FileStore(object):
+    """The slots of each key in a file of directory, locked while they are
+    updated, shared by every worker of a host"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _update(self, key, update):
+        """Call update with the leases of key, saving them when it changes
+        them, and return its result"""
+        name = re.sub(r'[^\w.-]', '_', key) + '.json'
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(
+            os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o600
+        )
+        with os.fdopen(fd, 'r+') as slots:
+            fcntl.flock(slots, fcntl.LOCK_EX)
+            content = slots.read()
+            leases = json.loads(content) if content else {}
+            original = dict(leases)
+            result = update(leases)
+            if leases != original:
+                slots.seek(0)
+                slots.truncate()
+                json.dump(leases, slots)
+            return result
+
+    def acquire_slot(self, key, token, limit, seconds, now):
+        def acquire(leases):
+            for expired in [t for t, expiry in leases.items()
+                            if expiry <= now]:
+                del leases[expired]
+            if len(leases) >= limit:
+                return False
+            leases[token] = now + seconds
+            return True
+
+        try:
+            return self._update(key, acquire)
+        except (OSError, ValueError):
+            log.exception('Leasing a slot of %s failed', key)
+            return True
+
+    def refresh_slot(self, key, token, seconds, now):
+        def refresh(leases):
+            if token in leases:
+                leases[token] = now + seconds
+
+        try:
+            self._update(key, refresh)
+        except (OSError, ValueError):
+            log.exception('Refreshing a slot of %s failed', key)
+
+    def release_slot(self, key, token):
+        try:
+            self._update(key, lambda leases: leases.pop(token, None))
+        except (OSError, ValueError):
+            log.exception('Releasing a slot of %s failed', key)
+
+
+class RedisStore(object):
+    """The TAT of each client in Redis, or any server speaking its protocol
+    and running Lua scripts, shared by every worker"""
+
+    def __init__(self, client, prefix='ccdb:throttle:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_GCRA_SCRIPT)
+        self._acquire_slot_script = client.register_script(
+            _ACQUIRE_SLOT_SCRIPT
+        )
+
+    def acquire(self, key, interval, period, now):
+        return self.acquire_many([(key, interval, period)], now)
+
+    def acquire_many(self, limits, now):
+        keys = []
+        args = [now]
+        for key, interval, period in limits:
+            keys.append(self.prefix + key)
+            args.extend((interval, period))
+        try:
+            wait = self._script(keys=keys, args=args)
+        except Exception:
+            # Rather serve requests than refuse them all
+            log.exception('Rate limiting %s failed', ', '.join(keys))
+            return 0
+        return float(wait)
+
+    def acquire_slot(self, key, token, limit, seconds, now):
+        try:
+            return bool(self._acquire_slot_script(
+                keys=[self.prefix + key], args=[token, limit, seconds, now]
+            ))
+        except Exception:
+            log.exception('Leasing a slot of %s failed', key)
+            return True
+
+    def refresh_slot(self, key, token, seconds, now):
+        try:
+            self.client.zadd(
+                self.prefix + key, {token: now + seconds}, xx=True
+            )
+        except Exception:
+            log.exception('Refreshing a slot of %s failed', key)
+
+    def release_slot(self, key, token):
+        try:
+            self.client.zrem(self.prefix + key, token)
+        except Exception:
+            log.exception('Releasing a slot of %s failed', key)
+
+
+def get_store(url=''):
+    """The RedisStore of url, or a LocalStore without one"""
+    if not url:
+        return LocalStore()
+
+    try:
+        import redis
+    except ImportError:
+        raise ImproperlyConfigured(
+            'THROTTLE_REDIS_URL is set but redis is not installed'
+        )
+    return RedisStore(redis.Redis.from_url(url))
@@ -11,3 +11,18 @@ class CSVRenderer(BaseRenderer):
 
     def render(self, data, media_type=None, renderer_context=None):
         return data
+
+
+class NDJSONRenderer(CSVRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVGzipRenderer(CSVRenderer):
+    media_type = 'application/gzip'
+    format = 'csv.gz'
+
+
+class NDJSONGzipRenderer(CSVRenderer):
+    media_type = 'application/gzip'
+    format = 'ndjson.gz'
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date
+
+from django.core.cache import caches
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        # Filter lists are unordered, ["A", "B"] is the same as ["B", "A"]
+        return sorted(
+            (_canonical(v) for v in value),
+            key=lambda v: json.dumps(v, sort_keys=True)
+        )
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def canonical_key(*parts, **params):
+    """Hash the parts and params, ignoring the order of lists and dicts."""
+    canonical = json.dumps(
+        [_canonical(parts), _canonical(params)], sort_keys=True, default=str
+    )
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """An in-process LRU cache of responses, optionally backed by a shared
+    Django cache.
+
+    Cached values are returned as is, so callers must not mutate them.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, alias='',
+                 prefix='complaint_search:result:'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.alias = alias
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @property
+    def stats(self):
+        """Hits and misses per endpoint"""
+        with self._lock:
+            return {
+                endpoint: dict(counters)
+                for endpoint, counters in self._stats.items()
+            }
+
+    def _shared_cache(self):
+        if not self.alias:
+            return None
+        return caches[self.alias]
+
+    def get(self, endpoint, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.time():
+                    self._entries.move_to_end(key)
+                    self._stats[endpoint]['hits'] += 1
+                    return value
+                del self._entries[key]
+
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            value = shared_cache.get(self.prefix + key)
+            if value is not None:
+                self._set_local(key, value)
+                with self._lock:
+                    self._stats[endpoint]['shared_hits'] += 1
+                return value
+
+        with self._lock:
+            self._stats[endpoint]['misses'] += 1
+        return None
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        self._set_local(key, value)
+
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            shared_cache.set(self.prefix + key, value, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
@@ -0,0 +1,677 @@
+import calendar
+import functools
+import glob
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from urllib.request import pathname2url
+
+from complaint_search import timing
+from complaint_search.metrics import REGISTRY
+
+
+# -----------------------------------------------------------------------------
+# Rollup
+#
+# Complaint counts per day, product, sub-product, issue, sub-issue, company,
+# state, tags and narrative, written to a SQLite file in ROLLUP_DIR by the
+# build_rollup command once per index refresh. The trends and states
+# endpoints are answered from it when their bodies only filter and aggregate
+# on these fields, instead of aggregating complaints in Elasticsearch. Like
+# export snapshots, rollups are named after the last_indexed date, so a
+# rollup is only used while it matches the index.
+#
+# A body is planned into scopes, one for its query and one per filter or
+# global aggregation. Each scope is a single GROUP BY query on the smallest
+# table having the columns it filters and aggregates on, and the buckets
+# and metrics of the scope are computed from its rows.
+# -----------------------------------------------------------------------------
+
+_ROLLUP_DIR = os.environ.get('ROLLUP_DIR', '')
+
+# Complaint fields read when building the rollup
+SOURCE_FIELDS = (
+    'date_received',
+    'product',
+    'sub_product',
+    'issue',
+    'sub_issue',
+    'company',
+    'state',
+    'tags',
+    'has_narrative',
+)
+
+INTERVALS = ('day', 'week', 'month', 'quarter', 'year')
+
+DIMENSIONS = (
+    'product',
+    'sub_product',
+    'issue',
+    'sub_issue',
+    'company',
+    'state',
+    'tags',
+    'has_narrative',
+)
+
+# Tables from the smallest, without the columns that multiply their rows
+_TABLES = (
+    ('complaints_by_product',
+     tuple(d for d in DIMENSIONS if d not in ('company', 'state'))),
+    ('complaints_by_state',
+     tuple(d for d in DIMENSIONS if d != 'company')),
+    ('complaints', DIMENSIONS),
+)
+
+_INDEXED_COLUMNS = ('product', 'issue', 'company', 'state')
+
+# Elasticsearch fields and their columns
+_COLUMNS = {
+    'date_received': 'day',
+    'product.raw': 'product',
+    'sub_product.raw': 'sub_product',
+    'issue.raw': 'issue',
+    'sub_issue.raw': 'sub_issue',
+    'company.raw': 'company',
+    'state': 'state',
+    'tags': 'tags',
+    'has_narrative': 'has_narrative',
+}
+
+# The tags of a complaint are kept together in one column, and the
+# tag_sets table lists the tags of each combination
+_TAGS_SEPARATOR = '\t'
+
+# The only date format of the min and max aggregations of trends
+_DATE_EXTREME_FORMAT = "yyyy-MM-dd'T'12:00:00-05:00"
+
+_BODY_KEYS = ('from', 'size', '_source', 'query', 'aggs')
+
+log = logging.getLogger(__name__)
+
+ROLLUP_REQUESTS = REGISTRY.counter(
+    'ccdb_rollup_requests_total',
+    'Requests answered from the rollup, or from the index when the rollup '
+    'is missing, cannot express them or fails',
+    ('function', 'result')
+)
+
+
+class _Inexpressible(Exception):
+    """The body filters or aggregates on something the rollup doesn't
+    have"""
+
+
+def enabled(directory=None):
+    return bool(directory or _ROLLUP_DIR)
+
+
+def _rollup_name(last_indexed):
+    version = re.sub(r'[^0-9A-Za-z]', '', last_indexed)
+    return 'rollup-{}.sqlite3'.format(version)
+
+
+def find_rollup(last_indexed, directory=None):
+    """Return the path of the rollup of the index last refreshed at
+    `last_indexed`, or None when it hasn't been built."""
+    directory = directory or _ROLLUP_DIR
+    if not directory or not last_indexed:
+        return None
+
+    path = os.path.join(directory, _rollup_name(last_indexed))
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+# -----------------------------------------------------------------------------
+# Dates
+# -----------------------------------------------------------------------------
+
+def _parse_day(value):
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def _bucket_start(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    if interval == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if interval == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+@functools.lru_cache(maxsize=65536)
+def _next_bucket(start, interval):
+    day = _parse_day(start)
+    if interval == 'day':
+        day += timedelta(days=1)
+    elif interval == 'week':
+        day += timedelta(days=7)
+    elif interval == 'year':
+        day = day.replace(year=day.year + 1)
+    else:
+        months = day.month - 1 + (3 if interval == 'quarter' else 1)
+        day = day.replace(year=day.year + months // 12,
+                          month=months % 12 + 1)
+    return day.isoformat()
+
+
+@functools.lru_cache(maxsize=65536)
+def _epoch_millis(day):
+    return calendar.timegm(_parse_day(day).timetuple()) * 1000
+
+
+# -----------------------------------------------------------------------------
+# Building
+# -----------------------------------------------------------------------------
+
+def _day(value):
+    if not value or not re.match(r'^\d{4}-\d{2}-\d{2}', str(value)):
+        return None
+    return str(value)[:10]
+
+
+def _tags(value):
+    if not value:
+        return ''
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return _TAGS_SEPARATOR.join(sorted(set(value)))
+
+
+def _has_narrative(value):
+    return 1 if value in (True, 'true', 'True') else 0
+
+
+def _count(documents):
+    counts = Counter()
+    for source in documents:
+        day = _day(source.get('date_received'))
+        if day is None:
+            continue
+        counts[(day,) + tuple(
+            _tags(source.get(d)) if d == 'tags' else
+            _has_narrative(source.get(d)) if d == 'has_narrative' else
+            source.get(d) or ''
+            for d in DIMENSIONS
+        )] += 1
+    return counts
+
+
+def _write_tables(connection, counts):
+    for table, dimensions in _TABLES:
+        positions = [DIMENSIONS.index(d) + 1 for d in dimensions]
+        rows = Counter()
+        for key, count in counts.items():
+            rows[(key[0],) + tuple(key[p] for p in positions)] += count
+
+        columns = INTERVALS + dimensions + ('count',)
+        connection.execute('CREATE TABLE {} ({})'.format(table, ', '.join(
+            '{} {}'.format(
+                c, 'INTEGER' if c in ('has_narrative', 'count') else 'TEXT'
+            ) for c in columns
+        )))
+        connection.executemany(
+            'INSERT INTO {} VALUES ({})'.format(
+                table, ', '.join('?' * len(columns))
+            ),
+            (
+                tuple(
+                    _bucket_start(_parse_day(key[0]), i).isoformat()
+                    for i in INTERVALS
+                ) + key[1:] + (count,)
+                for key, count in rows.items()
+            )
+        )
+        for column in _INDEXED_COLUMNS:
+            if column in dimensions:
+                connection.execute('CREATE INDEX {0}_{1} ON {0} ({1})'.format(
+                    table, column))
+
+    tag_sets = set(key[DIMENSIONS.index('tags') + 1] for key in counts)
+    connection.execute('CREATE TABLE tag_sets (tags TEXT, tag TEXT)')
+    connection.executemany('INSERT INTO tag_sets VALUES (?, ?)', (
+        (tags, tag)
+        for tags in tag_sets if tags
+        for tag in tags.split(_TAGS_SEPARATOR)
+    ))
+    connection.execute('CREATE INDEX tag_sets_tag ON tag_sets (tag)')
+
+
+def build_rollup(documents, last_indexed, directory=None, force=False):
+    """Write the rollup of the `documents` of the index last refreshed at
+    `last_indexed` unless it exists, and remove the rollups of previous
+    indexes. `documents` are the _source of the complaints, with at least
+    their SOURCE_FIELDS.
+
+    Returns the path of the rollup and whether it was written.
+    """
+    directory = directory or _ROLLUP_DIR
+    name = _rollup_name(last_indexed)
+    path = os.path.join(directory, name)
+    if os.path.isfile(path) and not force:
+        return path, False
+
+    # Written next to the rollup and renamed, so a partial file is never
+    # read
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name, dir=directory)
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(temp_path)
+        try:
+            _write_tables(connection, _count(documents))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    for previous in glob.glob(os.path.join(directory, 'rollup-*.sqlite3')):
+        if previous != path:
+            os.remove(previous)
+
+    return path, True
+
+
+# -----------------------------------------------------------------------------
+# Planning
+# -----------------------------------------------------------------------------
+
+class _Scope(object):
+    """A GROUP BY query and the aggregations computed from its rows"""
+
+    def __init__(self, table, columns, where, args, aggs, scopes):
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.args = args
+        self.aggs = aggs
+        # The scopes of the filter and global aggregations, by name
+        self.scopes = scopes
+
+    def sql(self):
+        sql = 'SELECT {} FROM {} WHERE {}'.format(
+            ', '.join(self.columns + ['SUM(count)']), self.table, self.where
+        )
+        if self.columns:
+            sql += ' GROUP BY ' + ', '.join(self.columns)
+        return sql
+
+
+def _column(field):
+    try:
+        return _COLUMNS[field]
+    except KeyError:
+        raise _Inexpressible(field)
+
+
+def _single(clause):
+    if not isinstance(clause, dict) or len(clause) != 1:
+        raise _Inexpressible(clause)
+    return next(iter(clause.items()))
+
+
+def _as_list(clauses):
+    if clauses is None:
+        return []
+    if isinstance(clauses, dict):
+        return [clauses]
+    return list(clauses)
+
+
+def _values(column, values):
+    if column != 'has_narrative':
+        return [str(value) for value in values]
+
+    converted = []
+    for value in values:
+        value = str(value).lower()
+        if value not in ('true', 'false'):
+            raise _Inexpressible(value)
+        converted.append(1 if value == 'true' else 0)
+    return converted
+
+
+def _filter_sql(clause, columns):
+    """The SQL condition and arguments of a filter clause. Adds the columns
+    it reads to `columns`."""
+    if not clause:
+        return '1', []
+
+    kind, spec = _single(clause)
+    if kind == 'match_all':
+        return '1', []
+
+    if kind == 'bool':
+        if set(spec) - {'must', 'filter', 'must_not', 'should'}:
+            raise _Inexpressible(spec)
+        conditions = []
+        args = []
+        for sub_clause in _as_list(spec.get('must')) + \
+                _as_list(spec.get('filter')):
+            sql, sub_args = _filter_sql(sub_clause, columns)
+            conditions.append('({})'.format(sql))
+            args.extend(sub_args)
+        for sub_clause in _as_list(spec.get('must_not')):
+            sql, sub_args = _filter_sql(sub_clause, columns)
+            conditions.append('NOT ({})'.format(sql))
+            args.extend(sub_args)
+        should = []
+        for sub_clause in _as_list(spec.get('should')):
+            sql, sub_args = _filter_sql(sub_clause, columns)
+            should.append('({})'.format(sql))
+            args.extend(sub_args)
+        if should:
+            conditions.append('({})'.format(' OR '.join(should)))
+        return ' AND '.join(conditions) or '1', args
+
+    if kind in ('term', 'terms'):
+        field, values = _single(spec)
+        column = _column(field)
+        if column == 'day':
+            raise _Inexpressible(field)
+        columns.add(column)
+        values = _values(column, [values] if kind == 'term' else values)
+        if not values:
+            return '0', []
+        placeholders = ', '.join('?' * len(values))
+        if column == 'tags':
+            return 'tags IN (SELECT tags FROM tag_sets WHERE tag IN ({}))' \
+                .format(placeholders), values
+        return '{} IN ({})'.format(column, placeholders), values
+
+    if kind == 'range':
+        field, bounds = _single(spec)
+        if _column(field) != 'day' or set(bounds) - {'from', 'to'}:
+            raise _Inexpressible(spec)
+        columns.add('day')
+        conditions = []
+        args = []
+        for bound, operator in (('from', '>='), ('to', '<=')):
+            value = bounds.get(bound)
+            if value is None:
+                continue
+            if not re.match(r'^\d{4}-\d{2}-\d{2}$', str(value)):
+                raise _Inexpressible(value)
+            conditions.append('day {} ?'.format(operator))
+            args.append(str(value))
+        return ' AND '.join(conditions) or '1', args
+
+    raise _Inexpressible(kind)
+
+
+def _query_filter(query):
+    """The filter matching the complaints of a search query"""
+    if not query or 'match_all' in query:
+        return {}
+
+    kind, spec = _single(query)
+    if kind == 'query_string' and spec.get('query') == '*':
+        fields = spec.get('fields')
+        if fields == ['_all']:
+            return {}
+        # Complaints without a narrative have no complaint_what_happened
+        if fields == ['complaint_what_happened']:
+            return {'term': {'has_narrative': 'true'}}
+    raise _Inexpressible(query)
+
+
+def _agg_columns(aggs, in_bucket=False):
+    """The columns read by the bucket and metric aggregations, down to the
+    nested filter and global aggregations"""
+    columns = set()
+    for agg in aggs.values():
+        sub_aggs = agg.get('aggs', {})
+        if 'filter' in agg or 'global' in agg:
+            # Their own scopes can only be computed for the whole scope
+            if in_bucket:
+                raise _Inexpressible(agg)
+            continue
+
+        if 'terms' in agg:
+            if set(agg['terms']) - {'field', 'size', 'shard_size'}:
+                raise _Inexpressible(agg)
+            column = _column(agg['terms']['field'])
+            if column in ('day', 'has_narrative'):
+                raise _Inexpressible(agg)
+            columns.add(column)
+        elif 'date_histogram' in agg:
+            histogram = agg['date_histogram']
+            if set(histogram) - {'field', 'interval'} or \
+                    _column(histogram['field']) != 'day' or \
+                    histogram.get('interval') not in INTERVALS:
+                raise _Inexpressible(agg)
+            columns.add(histogram['interval'])
+            for sub_agg in sub_aggs.values():
+                if 'serial_diff' in sub_agg and \
+                        sub_agg['serial_diff'] != {'buckets_path': '_count'}:
+                    raise _Inexpressible(sub_agg)
+            sub_aggs = dict(
+                (name, sub_agg) for name, sub_agg in sub_aggs.items()
+                if 'serial_diff' not in sub_agg
+            )
+        elif 'min' in agg or 'max' in agg:
+            extreme = agg.get('min') or agg.get('max')
+            if _column(extreme.get('field')) != 'day' or \
+                    extreme.get('format', _DATE_EXTREME_FORMAT) != \
+                    _DATE_EXTREME_FORMAT:
+                raise _Inexpressible(agg)
+            columns.add('day')
+        else:
+            raise _Inexpressible(agg)
+
+        columns |= _agg_columns(sub_aggs, in_bucket=True)
+    return columns
+
+
+def _table(columns):
+    for table, dimensions in _TABLES:
+        if columns <= set(INTERVALS + dimensions):
+            return table
+    raise _Inexpressible(columns)
+
+
+def _plan_scope(where, args, where_columns, aggs):
+    columns = _agg_columns(aggs)
+    scopes = {}
+    for name, agg in aggs.items():
+        if 'global' in agg:
+            scopes[name] = _plan_scope('1', [], set(), agg.get('aggs', {}))
+        elif 'filter' in agg:
+            filter_columns = set(where_columns)
+            sql, filter_args = _filter_sql(agg['filter'], filter_columns)
+            scopes[name] = _plan_scope(
+                '({}) AND ({})'.format(where, sql), args + filter_args,
+                filter_columns, agg.get('aggs', {})
+            )
+
+    return _Scope(
+        _table(columns | where_columns), sorted(columns), where, args, aggs,
+        scopes
+    )
+
+
+def plan(body):
+    """Plan answering a search body from the rollup. Raises _Inexpressible
+    when it can't be."""
+    if set(body) - set(_BODY_KEYS) or body.get('size'):
+        raise _Inexpressible(body)
+
+    columns = set()
+    where, args = _filter_sql(_query_filter(body.get('query')), columns)
+    return _plan_scope(where, args, columns, body.get('aggs', {}))
+
+
+# -----------------------------------------------------------------------------
+# Executing
+# -----------------------------------------------------------------------------
+
+def _terms(agg, index, rows):
+    column = index[_column(agg['terms']['field'])]
+    split = agg['terms']['field'] == 'tags'
+
+    groups = defaultdict(list)
+    for row in rows:
+        keys = row[column].split(_TAGS_SEPARATOR) if split else [row[column]]
+        for key in keys:
+            # Complaints without a value are not counted, like missing
+            # fields in Elasticsearch
+            if key != '':
+                groups[key].append(row)
+
+    counts = sorted(
+        ((-sum(row[-1] for row in group), key)
+         for key, group in groups.items()),
+    )
+    size = agg['terms'].get('size', 10)
+    # A size of 0 returns every bucket in Elasticsearch 2
+    shown = counts[:size] if size else counts
+
+    buckets = []
+    for count, key in shown:
+        bucket = {'key': key, 'doc_count': -count}
+        bucket.update(_aggregate(agg.get('aggs', {}), {}, index, groups[key]))
+        buckets.append(bucket)
+
+    return {
+        'doc_count_error_upper_bound': 0,
+        'sum_other_doc_count': sum(count for count, key in shown) -
+        sum(count for count, key in counts),
+        'buckets': buckets,
+    }
+
+
+def _date_histogram(agg, index, rows):
+    interval = agg['date_histogram']['interval']
+    column = index[interval]
+
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[column]].append(row)
+    if not groups:
+        return {'buckets': []}
+
+    sub_aggs = agg.get('aggs', {})
+    diffs = [name for name, sub_agg in sub_aggs.items()
+             if 'serial_diff' in sub_agg]
+    sub_aggs = dict((name, sub_agg) for name, sub_agg in sub_aggs.items()
+                    if name not in diffs)
+
+    # Empty buckets between the first and the last are returned too
+    buckets = []
+    previous = None
+    start, last = min(groups), max(groups)
+    while start <= last:
+        group = groups.get(start, [])
+        count = sum(row[-1] for row in group)
+        bucket = {
+            'key_as_string': start + 'T00:00:00.000Z',
+            'key': _epoch_millis(start),
+            'doc_count': count,
+        }
+        if previous is not None:
+            for name in diffs:
+                bucket[name] = {'value': float(count - previous)}
+        bucket.update(_aggregate(sub_aggs, {}, index, group))
+        buckets.append(bucket)
+
+        previous = count
+        start = _next_bucket(start, interval)
+
+    return {'buckets': buckets}
+
+
+def _date_extreme(extreme, index, rows):
+    days = [row[index['day']] for row in rows]
+    if not days:
+        return {'value': None}
+    day = min(days) if extreme == 'min' else max(days)
+    return {
+        'value': _epoch_millis(day),
+        'value_as_string': day + 'T12:00:00-05:00',
+    }
+
+
+def _aggregate(aggs, scopes, index, rows, connection=None):
+    result = {}
+    for name, agg in aggs.items():
+        if name in scopes:
+            result[name] = _execute(connection, scopes[name])[1]
+        elif 'terms' in agg:
+            result[name] = _terms(agg, index, rows)
+        elif 'date_histogram' in agg:
+            result[name] = _date_histogram(agg, index, rows)
+        elif 'min' in agg or 'max' in agg:
+            result[name] = _date_extreme(
+                'min' if 'min' in agg else 'max', index, rows
+            )
+    return result
+
+
+def _execute(connection, scope):
+    """The doc count and aggregations of a scope"""
+    rows = [
+        row for row in connection.execute(scope.sql(), scope.args)
+        if row[-1]
+    ]
+    index = dict((column, i) for i, column in enumerate(scope.columns))
+    doc_count = sum(row[-1] for row in rows)
+
+    result = {'doc_count': doc_count}
+    result.update(
+        _aggregate(scope.aggs, scope.scopes, index, rows, connection)
+    )
+    return doc_count, result
+
+
+def answer(function, body, last_indexed, directory=None):
+    """The response of a search body computed from the rollup of the
+    index, or None when there is no rollup or it can't answer the body"""
+    path = find_rollup(last_indexed, directory)
+    if path is None:
+        ROLLUP_REQUESTS.inc(function, 'missing')
+        return None
+
+    try:
+        scope = plan(body)
+    except _Inexpressible:
+        ROLLUP_REQUESTS.inc(function, 'inexpressible')
+        return None
+
+    start = time.time()
+    try:
+        with timing.phase('rollup'):
+            # Read only, so a rollup removed meanwhile isn't recreated empty
+            connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(pathname2url(path)), uri=True
+            )
+            try:
+                doc_count, result = _execute(connection, scope)
+            finally:
+                connection.close()
+    except sqlite3.Error:
+        log.exception('Reading the rollup %s failed', path)
+        ROLLUP_REQUESTS.inc(function, 'error')
+        return None
+
+    ROLLUP_REQUESTS.inc(function, 'rollup')
+    del result['doc_count']
+    return {
+        'took': int((time.time() - start) * 1000),
+        'timed_out': False,
+        '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+        'hits': {'total': doc_count, 'max_score': 0.0, 'hits': []},
+        'aggregations': result,
+    }
@@ -1,4 +1,5 @@
 from complaint_search.defaults import DATA_SUB_LENS_MAP, PARAMS
+from complaint_search.es_builders import AggregationBuilder
 from localflavor.us.us_states import STATE_CHOICES
 from rest_framework import serializers
 
@@ -9,11 +10,17 @@ class SearchInputSerializer(serializers.Serializer):
     FORMAT_DEFAULT = 'default'
     FORMAT_JSON = 'json'
     FORMAT_CSV = 'csv'
+    FORMAT_NDJSON = 'ndjson'
+    FORMAT_CSV_GZ = 'csv.gz'
+    FORMAT_NDJSON_GZ = 'ndjson.gz'
 
     FORMAT_CHOICES = (
         (FORMAT_DEFAULT, 'DEFAULT'),
         (FORMAT_JSON, 'JSON'),
         (FORMAT_CSV, 'CSV'),
+        (FORMAT_NDJSON, 'NDJSON'),
+        (FORMAT_CSV_GZ, 'CSV.GZ'),
+        (FORMAT_NDJSON_GZ, 'NDJSON.GZ'),
     )
 
     # Field Choices
@@ -55,6 +62,7 @@ class SearchInputSerializer(serializers.Serializer):
         min_value=0, max_value=10000000, default=PARAMS['frm']
     )
     sort = serializers.ChoiceField(SORT_CHOICES, default=PARAMS['sort'])
+    search_after = serializers.CharField(max_length=200, required=False)
     search_term = serializers.CharField(max_length=200, required=False)
     date_received_min = serializers.DateField(required=False)
     date_received_max = serializers.DateField(required=False)
@@ -154,6 +162,31 @@ class SearchInputSerializer(serializers.Serializer):
 
         return value
 
+    def validate_search_after(self, value):
+        """
+        Valid search_after format is the sort value of the last hit and its
+        complaint_id, separated by an underscore, i.e. 1591628400000_3687283
+        """
+        parts = value.rsplit('_', 1)
+        if len(parts) != 2 or not all(parts):
+            raise serializers.ValidationError(
+                "search_after is malformed, it needs to be "
+                "\"sortvalue_complaintid\""
+            )
+
+        sort_value, complaint_id = parts
+        try:
+            sort_value = int(sort_value)
+        except ValueError:
+            try:
+                sort_value = float(sort_value)
+            except ValueError:
+                raise serializers.ValidationError(
+                    "search_after sort value needs to be a number"
+                )
+
+        return [sort_value, complaint_id]
+
     def validate(self, data):
         """
         Check that from is a multiple of size
@@ -175,6 +208,21 @@ class SuggestFilterInputSerializer(SearchInputSerializer):
     text = serializers.CharField(max_length=100, required=True)
 
 
+class FacetBucketsInputSerializer(SearchInputSerializer):
+    FACET_CHOICES = tuple(
+        (field_name, field_name)
+        for field_name in AggregationBuilder._AGG_FIELDS
+    )
+
+    facet = serializers.ChoiceField(FACET_CHOICES, required=True)
+    frm = serializers.IntegerField(
+        min_value=0, max_value=10000, default=PARAMS['frm']
+    )
+    size = serializers.IntegerField(
+        min_value=1, max_value=1000, default=PARAMS['size']
+    )
+
+
 class TrendsInputSerializer(SearchInputSerializer):
     # -----------------------------------------------------------------------------
     # Constants
@@ -0,0 +1,90 @@
+import copy
+import hashlib
+import json
+import threading
+
+from complaint_search import timing
+from complaint_search.metrics import REGISTRY
+
+
+# -----------------------------------------------------------------------------
+# Single flight
+#
+# Identical requests arriving together, such as the landing search loaded by
+# many users at once, send the same body to Elasticsearch. The first of them
+# runs the query and the others wait for its response instead of sending
+# their own ('coalesced' phase).
+# -----------------------------------------------------------------------------
+
+COALESCED = REGISTRY.counter(
+    'ccdb_coalesced_requests_total',
+    'Elasticsearch queries answered by an identical query in flight',
+    ('function',)
+)
+
+
+def body_key(*parts):
+    """Hash Elasticsearch request parts. Unlike canonical_key, the order of
+    lists is kept, as it matters to sorts and queries."""
+    canonical = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.response = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Share the response of a call between the identical calls made while
+    it is running.
+
+    Callers get their own copy of shared responses, so they can still
+    process them in place.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, function, key, call):
+        if not self.enabled:
+            return call()
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.followers += 1
+                leader = False
+
+        if not leader:
+            COALESCED.inc(function)
+            with timing.phase('coalesced'):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.response)
+
+        try:
+            flight.response = call()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            # No caller can follow once the flight is removed
+            with self._lock:
+                del self._flights[key]
+                followers = flight.followers
+            flight.done.set()
+
+        if followers:
+            return copy.deepcopy(flight.response)
+        return flight.response
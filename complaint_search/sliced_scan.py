@@ -0,0 +1,203 @@
+import copy
+import logging
+import re
+import threading
+import time
+from collections import deque
+from queue import Full, Queue
+
+from elasticsearch import helpers
+
+
+# -----------------------------------------------------------------------------
+# Sliced scroll
+#
+# Splits a scan into independent scrolls, one per slice, each walked by its
+# own thread so an export is fed by several shards at once. Workers hand
+# batches of hits to the consumer through bounded queues, so at most about
+# slices * max_batches * batch_size hits are held in memory.
+#
+# A worker blocked on a full queue, such as every slice after the first one
+# in ordered mode, would let its scroll context expire. Instead it fetches its
+# next page ahead every half keepalive, which renews the context at the cost
+# of holding that page until the consumer catches up.
+# -----------------------------------------------------------------------------
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+# How often a blocked worker checks whether the consumer went away
+_POLL_INTERVAL = 0.1
+
+_TIME_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _seconds(duration):
+    """The seconds of an Elasticsearch duration such as 10m"""
+    match = re.match(r'^(\d+)(ms|s|m|h|d)$', str(duration))
+    if not match:
+        raise ValueError('Invalid duration: {}'.format(duration))
+    return int(match.group(1)) * _TIME_UNITS[match.group(2)]
+
+
+class _SliceScroll(object):
+    """The scroll of a slice, fetching pages of hits on demand"""
+
+    def __init__(self, client, body, scroll='5m', size=1000,
+                 raise_on_error=True, request_timeout=None, **kwargs):
+        self.client = client
+        self.scroll = scroll
+        self.keepalive = _seconds(scroll)
+        self.raise_on_error = raise_on_error
+        self.request_timeout = request_timeout
+        self.hits = deque()
+        self.done = False
+
+        # Slices are consumed in no global order, so they scroll in the
+        # cheapest one rather than by score
+        body['sort'] = ['_doc']
+        response = client.search(
+            body=body, scroll=scroll, size=size,
+            request_timeout=request_timeout, **kwargs
+        )
+        self.scroll_id = response.get('_scroll_id')
+        self._add(response)
+        self.fetched_at = time.time()
+
+    def _add(self, response):
+        if response['_shards']['failed']:
+            log.warning(
+                'Scroll request has failed on %d shards out of %d.',
+                response['_shards']['failed'], response['_shards']['total']
+            )
+            if self.raise_on_error:
+                raise helpers.ScanError(
+                    self.scroll_id,
+                    'Scroll request has failed on {} shards out of {}.'.format(
+                        response['_shards']['failed'],
+                        response['_shards']['total']
+                    )
+                )
+
+        hits = response['hits']['hits']
+        self.hits.extend(hits)
+        self.scroll_id = response.get('_scroll_id')
+        if not hits or self.scroll_id is None:
+            self.done = True
+
+    def fetch(self):
+        """Fetch the next page, renewing the keepalive of the scroll"""
+        if self.done:
+            return
+        self._add(self.client.scroll(
+            scroll_id=self.scroll_id, scroll=self.scroll,
+            request_timeout=self.request_timeout
+        ))
+        self.fetched_at = time.time()
+
+    def keep_alive(self):
+        if time.time() - self.fetched_at >= self.keepalive / 2.0:
+            self.fetch()
+
+    def next_batch(self, size):
+        while len(self.hits) < size and not self.done:
+            self.fetch()
+        return [self.hits.popleft() for _ in range(min(size, len(self.hits)))]
+
+    def close(self):
+        if self.scroll_id:
+            self.client.clear_scroll(
+                body={'scroll_id': [self.scroll_id]}, ignore=(404,)
+            )
+
+
+def _put(queue, item, stopped, idle=None):
+    while not stopped.is_set():
+        try:
+            queue.put(item, timeout=_POLL_INTERVAL)
+            return
+        except Full:
+            if idle is not None:
+                idle()
+
+
+def _scan_slice(client, query, slice_id, slices, queue, stopped, batch_size,
+                kwargs):
+    body = copy.deepcopy(query) if query else {}
+    body['slice'] = {'id': slice_id, 'max': slices}
+    try:
+        scroll = _SliceScroll(client, body, **kwargs)
+        try:
+            while not stopped.is_set():
+                batch = scroll.next_batch(batch_size)
+                if not batch:
+                    break
+                _put(queue, batch, stopped, scroll.keep_alive)
+        finally:
+            # Clears the scroll when the consumer stopped early
+            scroll.close()
+    except Exception as e:
+        _put(queue, e, stopped)
+    else:
+        _put(queue, _DONE, stopped)
+
+
+def _drain(queue, producers):
+    while producers:
+        batch = queue.get()
+        if batch is _DONE:
+            producers -= 1
+        elif isinstance(batch, Exception):
+            raise batch
+        else:
+            for hit in batch:
+                yield hit
+
+
+def _parallel_scan(client, query, slices, ordered, max_batches, batch_size,
+                   kwargs):
+    if ordered:
+        queues = [Queue(max_batches) for _ in range(slices)]
+    else:
+        queues = [Queue(max_batches * slices)] * slices
+
+    stopped = threading.Event()
+    for slice_id in range(slices):
+        worker = threading.Thread(
+            target=_scan_slice,
+            args=(client, query, slice_id, slices, queues[slice_id],
+                  stopped, batch_size, kwargs)
+        )
+        worker.daemon = True
+        worker.start()
+
+    try:
+        if ordered:
+            for queue in queues:
+                for hit in _drain(queue, 1):
+                    yield hit
+        else:
+            for hit in _drain(queues[0], slices):
+                yield hit
+    finally:
+        # Let workers blocked on a full queue exit when the download ends
+        # early or a slice failed
+        stopped.set()
+
+
+def sliced_scan(client, query=None, slices=1, ordered=False, max_batches=4,
+                batch_size=1000, **kwargs):
+    """Iterate over all hits of a query like helpers.scan, scrolling
+    `slices` slices in parallel.
+
+    Hits are yielded as they arrive from any slice, or slice by slice when
+    `ordered` is set. Other keyword arguments are passed to helpers.scan,
+    or to the search and scroll calls of each slice.
+    """
+    if slices < 2:
+        return helpers.scan(client, query=query, **kwargs)
+
+    return _parallel_scan(
+        client, query, slices, ordered, max_batches, batch_size, kwargs
+    )
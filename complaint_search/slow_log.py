@@ -0,0 +1,85 @@
+import functools
+import json
+import logging
+import os
+from datetime import datetime
+
+from complaint_search import timing
+
+
+# -----------------------------------------------------------------------------
+# Slow query log
+#
+# Requests taking SLOW_QUERY_SECONDS or more (0 disables) are logged as one
+# JSON object per line to the complaint_search.slow_queries logger: the
+# es_interface call with its validated params, the Elasticsearch requests it
+# made and the timings. With SLOW_QUERY_RESPONSES, responses are copied
+# before processing and logged too, so replay_slow_queries can answer with
+# them instead of synthesizing responses.
+# -----------------------------------------------------------------------------
+
+_SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', '2'))
+_SLOW_QUERY_RESPONSES = \
+    os.environ.get('SLOW_QUERY_RESPONSES', '').lower() == 'true'
+
+log = logging.getLogger('complaint_search.slow_queries')
+
+
+def enabled():
+    return _SLOW_QUERY_SECONDS > 0
+
+
+def record_responses():
+    return enabled() and _SLOW_QUERY_RESPONSES
+
+
+def captured(function):
+    """Keep the call of an es_interface function in the timings of the
+    current request"""
+    @functools.wraps(function)
+    def wrap(*args, **kwargs):
+        timings = timing.current()
+        if timings is not None and timings.call is None:
+            timings.call = {
+                'function': function.__name__,
+                'args': list(args),
+                'kwargs': kwargs,
+            }
+        return function(*args, **kwargs)
+    return wrap
+
+
+def entry(endpoint, timings, total):
+    queries = []
+    for method, kwargs, response in timings.queries:
+        query = {'method': method, 'kwargs': kwargs}
+        if response is not None:
+            query['response'] = response
+        queries.append(query)
+
+    return {
+        'time': datetime.utcnow().isoformat(),
+        'endpoint': endpoint,
+        'total': total,
+        'phases': timings.phases,
+        'call': timings.call,
+        'queries': queries,
+    }
+
+
+def record(endpoint, timings, total):
+    """Log the request if it was slow"""
+    if not enabled() or total < _SLOW_QUERY_SECONDS or timings.call is None:
+        return
+
+    # Dates of the params are written as strings, which the builders accept
+    log.warning(json.dumps(entry(endpoint, timings, total), default=str))
+
+
+def read(lines):
+    """Parse the entries of a slow query log, skipping anything before the
+    JSON object of each line"""
+    for line in lines:
+        start = line.find('{')
+        if start != -1:
+            yield json.loads(line[start:])
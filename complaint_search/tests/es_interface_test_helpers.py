@@ -1,9 +1,17 @@
 import json
 import os.path
+import sys
+
+import django
 
 from deepdiff import DeepDiff
 
 
+# The async views need Python 3.7, for contextvars and asyncio.run, and
+# Django 3.1
+ASYNC_VIEWS = sys.version_info >= (3, 7) and django.VERSION >= (3, 1)
+
+
 # -------------------------------------------------------------------------
 # Helper Methods
 # -------------------------------------------------------------------------
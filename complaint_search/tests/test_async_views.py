@@ -0,0 +1,168 @@
+import asyncio
+import time
+from unittest import skipUnless
+from urllib.parse import urlencode
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+import mock
+from complaint_search import es_interface
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS
+from complaint_search.tests.es_interface_test_helpers import ASYNC_VIEWS
+from complaint_search.throttling import SearchAnonRateThrottle
+from elasticsearch import TransportError
+from rest_framework import status
+
+
+if ASYNC_VIEWS:
+    from django.test import AsyncClient
+
+    from complaint_search import async_views, es_async
+
+
+# mock.patch decorators don't await coroutines, so the async tests patch
+# in their body
+@skipUnless(ASYNC_VIEWS, 'Async views need Python 3.7 and Django 3.1')
+@override_settings(ROOT_URLCONF='ccdb5_api.asgi_urls')
+class AsyncViewsTests(TestCase):
+
+    def setUp(self):
+        self.client = AsyncClient()
+
+    # The query string is passed in the path, AsyncClient.get drops its
+    # data argument before Django 4.0
+    def get(self, url, params=None):
+        if params:
+            url = '{}?{}'.format(url, urlencode(params, doseq=True))
+        return self.client.get(url)
+
+    async def test_trends__valid(self):
+        url = reverse('complaint_search:trends')
+        with mock.patch.object(es_interface, 'trends') as mock_estrends:
+            mock_estrends.return_value = {'aggregations': {}}
+            response = await self.get(
+                url, {'lens': 'overview', 'trend_interval': 'month'}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({'aggregations': {}}, response.json())
+        args, kwargs = mock_estrends.call_args
+        self.assertEqual((AGG_EXCLUDE_FIELDS,), args)
+        self.assertEqual('overview', kwargs['lens'])
+        self.assertEqual('month', kwargs['trend_interval'])
+
+    async def test_trends_invalid_params__fails(self):
+        url = reverse('complaint_search:trends')
+        with mock.patch.object(es_interface, 'trends') as mock_estrends:
+            response = await self.get(url, {'lens': 'foo'})
+
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST
+        )
+        self.assertIn('lens', response.json())
+        self.assertIn('trend_interval', response.json())
+        mock_estrends.assert_not_called()
+
+    async def test_search__valid(self):
+        url = reverse('complaint_search:search')
+        with mock.patch.object(es_interface, 'search') as mock_essearch:
+            mock_essearch.return_value = {'hits': {'hits': []}}
+            response = await self.get(url, {'state': ['VA', 'CA']})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({'hits': {'hits': []}}, response.json())
+        args, kwargs = mock_essearch.call_args
+        self.assertEqual((AGG_EXCLUDE_FIELDS,), args)
+        self.assertEqual(['VA', 'CA'], kwargs['state'])
+        self.assertEqual('default', kwargs['format'])
+
+    async def test_search_export__refused(self):
+        url = reverse('complaint_search:search')
+        with mock.patch.object(es_interface, 'search') as mock_essearch:
+            response = await self.get(url, {'format': 'csv'})
+
+        self.assertEqual(
+            response.status_code, status.HTTP_406_NOT_ACCEPTABLE
+        )
+        mock_essearch.assert_not_called()
+
+    async def test_search_export__redirected(self):
+        url = reverse('complaint_search:search')
+        with mock.patch.object(
+            async_views, '_EXPORT_URL', 'https://wsgi.example.com/'
+        ), mock.patch.object(es_interface, 'search') as mock_essearch:
+            response = await self.get(
+                url, {'format': 'csv', 'state': ['VA', 'CA']}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(
+            'https://wsgi.example.com/?format=csv&state=VA&state=CA',
+            response['Location']
+        )
+        mock_essearch.assert_not_called()
+
+    async def test_search__throttled(self):
+        url = reverse('complaint_search:search')
+        with mock.patch.object(
+            SearchAnonRateThrottle, 'allow_request', return_value=False
+        ), mock.patch.object(
+            SearchAnonRateThrottle, 'wait', return_value=29.5
+        ), mock.patch.object(es_interface, 'search') as mock_essearch:
+            response = await self.get(url)
+
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual('30', response['Retry-After'])
+        mock_essearch.assert_not_called()
+
+    async def test_suggest_company(self):
+        url = reverse('complaint_search:suggest_company')
+        with mock.patch.object(
+            es_interface, 'filter_suggest'
+        ) as mock_essuggest:
+            mock_essuggest.return_value = ['BANK 1']
+            response = await self.get(
+                url, {'text': 'bank', 'company': 'Bank 2'}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(['BANK 1'], response.json())
+        args, kwargs = mock_essuggest.call_args
+        self.assertEqual(('company.suggest', 'company.raw'), args)
+        self.assertEqual('BANK', kwargs['text'])
+        self.assertNotIn('company', kwargs)
+
+    async def test_document__transport_error(self):
+        url = reverse('complaint_search:complaint', kwargs={'id': '123'})
+        with mock.patch.object(es_interface, 'document') as mock_esdocument:
+            mock_esdocument.side_effect = TransportError('N/A', "Error")
+            response = await self.get(url)
+
+        self.assertEqual(424, response.status_code)
+        self.assertEqual(
+            {"error": "There was an error calling Elasticsearch"},
+            response.json()
+        )
+
+
+@skipUnless(ASYNC_VIEWS, 'Async views need Python 3.7 and Django 3.1')
+class EsAsyncTests(TestCase):
+
+    async def test_calls_run_concurrently(self):
+        def slow_states(agg_exclude=None, **kwargs):
+            time.sleep(0.2)
+            return kwargs['state']
+
+        start = time.time()
+        with mock.patch.object(
+            es_interface, 'states_agg', side_effect=slow_states
+        ):
+            results = await asyncio.gather(*[
+                es_async.states_agg(state=i) for i in range(10)
+            ])
+
+        self.assertEqual(list(range(10)), results)
+        self.assertLess(time.time() - start, 1)
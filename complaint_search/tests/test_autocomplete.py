@@ -0,0 +1,200 @@
+import threading
+
+from django.test import TestCase
+
+import mock
+from complaint_search import es_interface
+from complaint_search.autocomplete import (
+    AutocompleteIndexes,
+    SuggestIndex,
+    answerable,
+)
+from complaint_search.defaults import PARAMS
+from elasticsearch import Elasticsearch, TransportError
+
+
+COMPANIES = ['BANK 1', 'Big Bank', 'Credit union', 'bank 4', 'Servicer']
+
+
+class SuggestIndexTest(TestCase):
+
+    def test_search_anywhere(self):
+        index = SuggestIndex(COMPANIES)
+        self.assertEqual(
+            ['BANK 1', 'Big Bank', 'bank 4'], index.search('BANK')
+        )
+        self.assertEqual(['BANK 1', 'Big Bank'], index.search('bank', 2))
+        self.assertEqual(['Credit union'], index.search('T U'))
+        self.assertEqual([], index.search('Mortgage'))
+
+    def test_search_prefix(self):
+        index = SuggestIndex(['207XX', '200XX', '22207', '20001'], True)
+        self.assertEqual(['207XX', '200XX', '20001'], index.search('20'))
+        self.assertEqual(['22207'], index.search('222'))
+        self.assertEqual([], index.search('07'))
+
+    def test_values_returned_once(self):
+        index = SuggestIndex(['AAAA', 'A'])
+        self.assertEqual(['AAAA', 'A'], index.search('A'))
+
+    def test_answerable(self):
+        params = dict(PARAMS, text='BANK')
+        self.assertTrue(answerable(params))
+        self.assertFalse(answerable(dict(params, state=['VA'])))
+        self.assertFalse(answerable(dict(params, search_term='loan')))
+        self.assertFalse(answerable(dict(params, text='BA*K')))
+        self.assertFalse(answerable(dict(params, text='')))
+
+
+class AutocompleteIndexesTest(TestCase):
+
+    def test_get(self):
+        indexes = AutocompleteIndexes()
+        load = mock.Mock(return_value=COMPANIES)
+
+        index = indexes.get('company', '1', load)
+        self.assertEqual(COMPANIES, index.values)
+        self.assertIs(index, indexes.get('company', '1', load))
+        self.assertEqual(1, load.call_count)
+
+    def test_first_load_fails(self):
+        indexes = AutocompleteIndexes()
+        load = mock.Mock(side_effect=[TransportError('N/A', 'Error'),
+                                      COMPANIES])
+
+        with self.assertLogs('complaint_search.autocomplete', 'ERROR'):
+            self.assertIsNone(indexes.get('company', '1', load))
+        # Loaded again by the next request
+        self.assertEqual(COMPANIES, indexes.get('company', '1', load).values)
+
+    def test_new_version_loaded_in_background(self):
+        indexes = AutocompleteIndexes()
+        indexes.get('company', '1', lambda: COMPANIES)
+
+        loading = threading.Event()
+        loaded = threading.Event()
+
+        def load():
+            loading.set()
+            loaded.wait(5)
+            return ['New bank']
+
+        self.assertIsNone(indexes.get('company', '2', load))
+        loading.wait(5)
+        # Still loading
+        self.assertIsNone(indexes.get('company', '2', load))
+
+        loaded.set()
+        for _ in range(100):
+            index = indexes.get('company', '2', load)
+            if index is not None:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(['New bank'], index.values)
+
+
+@mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+@mock.patch("complaint_search.es_interface._get_last_indexed")
+class FilterSuggestIndexTest(TestCase):
+
+    def setUp(self):
+        es_interface._AUTOCOMPLETE.clear()
+
+    def tearDown(self):
+        es_interface._AUTOCOMPLETE.clear()
+
+    def terms_response(self, field, keys):
+        return {'aggregations': {field: {
+            'buckets': [{'key': key, 'doc_count': 1} for key in keys]
+        }}}
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_company_from_index(self, mock_search, mock_last_indexed):
+        mock_last_indexed.return_value = '2020-06-01'
+        mock_search.return_value = self.terms_response(
+            'company.raw', COMPANIES
+        )
+        params = dict(PARAMS, field='_all')
+
+        self.assertEqual(
+            ['BANK 1', 'Big Bank', 'bank 4'],
+            es_interface.filter_suggest(
+                'company.suggest', 'company.raw', text='BANK', **params
+            )
+        )
+        self.assertEqual(
+            ['Servicer'],
+            es_interface.filter_suggest(
+                'company.suggest', 'company.raw', text='SERV', **params
+            )
+        )
+
+        self.assertEqual(1, mock_search.call_count)
+        body = mock_search.call_args[1]['body']
+        self.assertEqual(
+            {'company.raw': {'terms': {'field': 'company.raw', 'size': 0}}},
+            body['aggs']
+        )
+        self.assertEqual(['_all'], body['query']['query_string']['fields'])
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_zip_code_by_prefix(self, mock_search, mock_last_indexed):
+        mock_last_indexed.return_value = '2020-06-01'
+        mock_search.return_value = self.terms_response(
+            'zip_code', ['207XX', '22207']
+        )
+
+        self.assertEqual(
+            ['22207'],
+            es_interface.filter_suggest('zip_code', text='22', **PARAMS)
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_filtered_from_elasticsearch(self, mock_search, mock_last_indexed):
+        mock_last_indexed.return_value = '2020-06-01'
+        mock_search.return_value = {'aggregations': {'zip_code': {
+            'zip_code': {'buckets': [{'key': '207XX', 'doc_count': 1}]}
+        }}}
+
+        self.assertEqual(
+            ['207XX'],
+            es_interface.filter_suggest(
+                'zip_code', text='20', state=['MD'], **PARAMS
+            )
+        )
+        aggs = mock_search.call_args[1]['body']['aggs']
+        self.assertIn(
+            {'prefix': {'zip_code': '20'}},
+            aggs['zip_code']['filter']['bool']['must']
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_index_unavailable(self, mock_search, mock_last_indexed):
+        mock_last_indexed.return_value = '2020-06-01'
+        mock_search.side_effect = [
+            TransportError('N/A', 'Error'),
+            {'aggregations': {'zip_code': {
+                'zip_code': {'buckets': [{'key': '207XX', 'doc_count': 1}]}
+            }}}
+        ]
+
+        with self.assertLogs('complaint_search.autocomplete', 'ERROR'):
+            self.assertEqual(
+                ['207XX'],
+                es_interface.filter_suggest('zip_code', text='20', **PARAMS)
+            )
+        self.assertIn(
+            'prefix', str(mock_search.call_args[1]['body']['aggs'])
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_no_index_version(self, mock_search, mock_last_indexed):
+        mock_last_indexed.return_value = None
+        mock_search.return_value = {'aggregations': {'zip_code': {
+            'zip_code': {'buckets': []}
+        }}}
+
+        es_interface.filter_suggest('zip_code', text='20', **PARAMS)
+        self.assertIn(
+            'prefix', str(mock_search.call_args[1]['body']['aggs'])
+        )
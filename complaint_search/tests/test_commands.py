@@ -0,0 +1,138 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+import mock
+from complaint_search.tests.es_interface_test_helpers import ASYNC_VIEWS
+
+
+class BenchmarkTrendsTest(TestCase):
+
+    def test_benchmark_trends(self):
+        out = StringIO()
+        call_command(
+            'benchmark_trends', iterations=1, latency=0, terms_size=2,
+            stdout=out
+        )
+        lines = out.getvalue().splitlines()
+        self.assertIn('round trips', lines[0])
+        self.assertIn('overview day', out.getvalue())
+        self.assertTrue(all(line.endswith(' 1') for line in lines[1:]))
+
+
+class BenchmarkBuildersTest(TestCase):
+
+    def test_benchmark_builders(self):
+        out = StringIO()
+        call_command('benchmark_builders', iterations=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('cached us', lines[0])
+        self.assertIn('trends filtered', lines[-1])
+
+
+class BenchmarkTrendProcessingTest(TestCase):
+
+    def test_benchmark_trend_processing(self):
+        out = StringIO()
+        call_command(
+            'benchmark_trend_processing', iterations=1, days=30, terms=2,
+            sub_terms=2, stdout=out
+        )
+        lines = out.getvalue().splitlines()
+        self.assertIn('reversed ms', lines[0])
+        self.assertIn('product/sub-product', lines[2])
+        self.assertTrue(all(line.endswith(' yes') for line in lines[1:]))
+
+
+class BenchmarkThrottlesTest(TestCase):
+
+    def test_benchmark_throttles(self):
+        out = StringIO()
+        call_command('benchmark_throttles', iterations=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('combined us', lines[0])
+        self.assertTrue(lines[1].startswith('anon search'))
+        # UI searches are not limited
+        self.assertTrue(lines[3].endswith(' 0.0            0.0'))
+        self.assertEqual(6, len(lines))
+
+
+class BenchmarkExportTest(TestCase):
+
+    def test_benchmark_export(self):
+        out = StringIO()
+        call_command('benchmark_export', rows=100, stdout=out)
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertIn('csv batched', out.getvalue())
+        self.assertIn('json chunked', out.getvalue())
+
+
+@skipUnless(ASYNC_VIEWS, 'Async views need Python 3.7 and Django 3.1')
+class BenchmarkConcurrencyTest(TestCase):
+
+    def test_benchmark_concurrency(self):
+        out = StringIO()
+        call_command(
+            'benchmark_concurrency', requests=4, latency=0, threads=2,
+            stdout=out
+        )
+        lines = out.getvalue().splitlines()
+        self.assertIn('in flight', lines[0])
+        self.assertTrue(lines[1].startswith('wsgi'))
+        self.assertTrue(lines[2].startswith('asgi'))
+
+
+class BuildExportSnapshotsTest(TestCase):
+
+    @mock.patch('complaint_search.export_snapshot.build_snapshot')
+    def test_build_export_snapshots(self, mock_build):
+        mock_build.side_effect = [
+            ('/snapshots/complaints-1.csv', True),
+            ('/snapshots/complaints-1.json', False),
+        ]
+        out = StringIO()
+        call_command(
+            'build_export_snapshots', formats=['csv', 'json'],
+            directory='/snapshots', stdout=out
+        )
+        mock_build.assert_has_calls([
+            mock.call('csv', '/snapshots', force=False),
+            mock.call('json', '/snapshots', force=False),
+        ])
+        self.assertEqual([
+            'Built /snapshots/complaints-1.csv',
+            'Up to date /snapshots/complaints-1.json',
+        ], out.getvalue().splitlines())
+
+    def test_build_export_snapshots_without_directory(self):
+        with self.assertRaises(CommandError):
+            call_command('build_export_snapshots', directory='')
+
+
+class BuildRollupTest(TestCase):
+
+    @mock.patch('complaint_search.rollup.build_rollup')
+    @mock.patch('complaint_search.es_interface._get_meta')
+    @mock.patch('elasticsearch.helpers.scan')
+    def test_build_rollup(self, mock_scan, mock_meta, mock_build):
+        mock_scan.return_value = iter([{'_source': {'product': 'Mortgage'}}])
+        mock_meta.return_value = {'last_indexed': '2020-06-01'}
+        mock_build.return_value = ('/rollups/rollup-20200601.sqlite3', True)
+        out = StringIO()
+        call_command('build_rollup', directory='/rollups', stdout=out)
+
+        documents, last_indexed, directory = mock_build.call_args[0]
+        self.assertEqual([{'product': 'Mortgage'}], list(documents))
+        self.assertEqual(('2020-06-01', '/rollups'), (last_indexed, directory))
+        self.assertIn(
+            'date_received', mock_scan.call_args[1]['query']['_source']
+        )
+        self.assertEqual(
+            'Built /rollups/rollup-20200601.sqlite3', out.getvalue().strip()
+        )
+
+    def test_build_rollup_without_directory(self):
+        with self.assertRaises(CommandError):
+            call_command('build_rollup', directory='')
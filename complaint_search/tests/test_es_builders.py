@@ -0,0 +1,241 @@
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+import mock
+from complaint_search import es_interface
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS, PARAMS
+from complaint_search.es_builders import (
+    _BODY_CACHE,
+    AggregationBuilder,
+    PostFilterBuilder,
+    SearchBuilder,
+    SharedFilterAggregationBuilder,
+)
+from complaint_search.es_client import OPERATIONS
+from complaint_search.es_stand_in import StandInElasticsearch
+from complaint_search.tests.es_interface_test_helpers import load
+from nose_parameterized import parameterized
+
+
+FILTERS = {
+    'company': ['Bank 1', 'Bank 2'],
+    'product': [u'Mortgage•FHA mortgage', 'Debt collection'],
+    'not_state': ['VA', 'CA'],
+    'date_received_min': '2017-01-01',
+}
+
+
+def build(builder_class, exclude=None, **params):
+    builder = builder_class()
+    builder.add(**params)
+    if exclude:
+        builder.add_exclude(exclude)
+    return builder.build()
+
+
+class CachedBodyTest(TestCase):
+
+    def setUp(self):
+        self.max_entries = _BODY_CACHE.max_entries
+        _BODY_CACHE.max_entries = 16
+        _BODY_CACHE.clear()
+
+    def tearDown(self):
+        _BODY_CACHE.max_entries = self.max_entries
+        _BODY_CACHE.clear()
+
+    def test_cached_body_matches_built_body(self):
+        for builder_class, exclude in (
+            (SearchBuilder, None),
+            (PostFilterBuilder, None),
+            (AggregationBuilder, AGG_EXCLUDE_FIELDS),
+        ):
+            _BODY_CACHE.max_entries = 0
+            built = build(builder_class, exclude, **FILTERS)
+            _BODY_CACHE.max_entries = 16
+
+            first = build(builder_class, exclude, **FILTERS)
+            second = build(builder_class, exclude, **FILTERS)
+
+            self.assertEqual(built, first)
+            self.assertEqual(built, second)
+            name = builder_class.__name__
+            self.assertEqual(
+                {'hits': 1, 'misses': 1}, _BODY_CACHE.stats[name]
+            )
+
+    def test_top_level_keys_are_not_shared(self):
+        body = build(SearchBuilder, **FILTERS)
+        body['size'] = 1000
+        body['aggs'] = {}
+
+        body = build(SearchBuilder, **FILTERS)
+
+        self.assertEqual(10, body['size'])
+        self.assertNotIn('aggs', body)
+
+    def test_list_order_is_kept(self):
+        first = build(PostFilterBuilder, company=['Bank 1', 'Bank 2'])
+        second = build(PostFilterBuilder, company=['Bank 2', 'Bank 1'])
+
+        self.assertEqual(
+            {'terms': {'company.raw': ['Bank 2', 'Bank 1']}},
+            second['bool']['must'][0]
+        )
+        self.assertNotEqual(first, second)
+
+    def test_clauses_rebuilt_when_params_change(self):
+        builder = PostFilterBuilder()
+        builder.add(company=['Bank 1'])
+        self.assertEqual(1, len(builder.build()['bool']['must']))
+
+        builder.add(state=['VA'], date_received_min='2017-01-01')
+
+        self.assertEqual(3, len(builder.build()['bool']['must']))
+
+
+class SharedClausesTest(TestCase):
+
+    def test_aggregations_share_clauses(self):
+        builder = AggregationBuilder()
+        builder.add(**FILTERS)
+
+        aggs = builder.build_one('issue'), builder.build_one('state')
+
+        first, second = (agg['filter']['bool'] for agg in aggs)
+        self.assertEqual(first, second)
+        for clause, other in zip(first['must'], second['must']):
+            self.assertIs(clause, other)
+        self.assertIsNot(first['must'], second['must'])
+
+
+# Search fixtures and the params that build them
+AGGREGATION_FIXTURES = [
+    ['search_no_param__valid', ['company', 'zip_code'], {}],
+    ['search_with_date_received_min__valid', ['company', 'zip_code'],
+     {'date_received_min': '2014-04-14'}],
+    ['search_with_company_received_max__valid', ['company', 'zip_code'],
+     {'company_received_max': '2017-04-14'}],
+    ['search_with_company__valid', ['company', 'zip_code'],
+     {'company': ['Bank 1', 'Second Bank']}],
+    ['search_with_product__valid', ['zip_code', 'company'],
+     {'product': ['Payday loan', u'Mortgage\u2022FHA mortgage']}],
+    ['search_with_two_not__valid', ['company', 'zip_code'],
+     {'not_issue': ['Incorrect information on your report'],
+      'not_product': ['Credit reporting, credit repair services, or '
+                      'other personal consumer reports']}],
+    ['search_with_zip_code_agg_exclude__valid', ['zip_code'],
+     {'zip_code': ['12345', '23435', '03433']}],
+]
+
+
+def _sorted_clauses(clauses):
+    return sorted(json.dumps(clause, sort_keys=True) for clause in clauses)
+
+
+def _effective_filters(aggs):
+    """The clauses each field's terms are filtered by, and its terms"""
+    shared = aggs['shared_filter']
+    must = shared['filter']['bool']['must']
+    must_not = shared['filter']['bool']['must_not']
+
+    fields = {}
+    for name, agg in shared['aggs'].items():
+        clauses = must + agg['filter']['bool']['must']
+        for field_name, terms in agg['aggs'].items():
+            fields[field_name] = (
+                _sorted_clauses(clauses), must_not, {field_name: terms}
+            )
+    return fields
+
+
+class SharedFilterAggregationBuilderTest(TestCase):
+
+    @parameterized.expand(AGGREGATION_FIXTURES)
+    def test_filters_match_expected_results(self, fixture, exclude, params):
+        expected = load(fixture)['aggs']
+        builder = SharedFilterAggregationBuilder()
+        builder.add(**dict(PARAMS, **params))
+        builder.add_exclude(exclude)
+
+        actual = _effective_filters(builder.build())
+
+        self.assertEqual(sorted(expected), sorted(actual))
+        for field_name, agg in expected.items():
+            self.assertEqual((
+                _sorted_clauses(agg['filter']['bool']['must']),
+                agg['filter']['bool']['must_not'],
+                agg['aggs']
+            ), actual[field_name])
+
+    def test_one_nested_filter_per_filtered_field(self):
+        builder = SharedFilterAggregationBuilder()
+        builder.add(**FILTERS)
+
+        shared = builder.build()['shared_filter']
+
+        self.assertEqual(
+            ['company', 'other_fields', 'product'], sorted(shared['aggs'])
+        )
+        self.assertEqual(
+            [{'range': {'date_received': {'from': '2017-01-01'}}}],
+            shared['filter']['bool']['must']
+        )
+        self.assertEqual(
+            [{'terms': {'state': ['VA', 'CA']}}],
+            shared['filter']['bool']['must_not']
+        )
+
+    @parameterized.expand(AGGREGATION_FIXTURES)
+    def test_flattened_response_matches(self, fixture, exclude, params):
+        responses = {}
+        stand_in = StandInElasticsearch(terms_size=3)
+        with mock.patch.dict(
+            es_interface._ES_CLIENTS, dict.fromkeys(OPERATIONS, stand_in)
+        ):
+            for strategy in ('filter', 'shared'):
+                with mock.patch.object(
+                    es_interface, '_AGG_STRATEGY', strategy
+                ):
+                    res = es_interface.search(exclude, **params)
+                es_interface._clear_meta_cache()
+                responses[strategy] = res['aggregations']
+
+        self.assertEqual(
+            sorted(load(fixture)['aggs']), sorted(responses['filter'])
+        )
+        self.assertEqual(responses['filter'], responses['shared'])
+
+    def test_unknown_strategy(self):
+        self.assertEqual('shared', es_interface._get_agg_strategy('shared'))
+        with self.assertRaises(ImproperlyConfigured):
+            es_interface._get_agg_strategy('nested')
+
+
+class BucketSizesTest(TestCase):
+
+    def test_configured_sizes(self):
+        builder = AggregationBuilder()
+        builder.add(**PARAMS)
+
+        self.assertEqual(
+            {'field': 'company.raw', 'size': 100, 'shard_size': 160},
+            builder.build_terms('company')['company']['terms']
+        )
+        self.assertEqual(
+            {'field': 'product.raw', 'size': 0},
+            builder.build_terms('product')['product']['terms']
+        )
+
+    def test_requested_size(self):
+        builder = AggregationBuilder()
+        builder.add(**PARAMS)
+
+        agg = builder.build_one('company', size=30)
+
+        self.assertEqual(
+            {'field': 'company.raw', 'size': 30, 'shard_size': 55},
+            agg['aggs']['company']['terms']
+        )
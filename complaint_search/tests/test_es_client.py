@@ -0,0 +1,76 @@
+from django.test import TestCase
+
+import mock
+from complaint_search import es_interface
+from complaint_search.es_client import (
+    OPERATIONS,
+    CompressedConnection,
+    _parse_hosts,
+    create_client,
+)
+from elasticsearch import Urllib3HttpConnection
+
+
+class EsClientTest(TestCase):
+
+    def test_parse_hosts(self):
+        self.assertEqual(
+            ['es1:9200', 'es2:9201'], _parse_hosts(' es1:9200, es2:9201,')
+        )
+        self.assertEqual([], _parse_hosts(''))
+
+    @mock.patch('complaint_search.es_client._ES_HOSTS',
+                ['es1:9200', 'es2:9201'])
+    @mock.patch('complaint_search.es_client._POOL_SIZE', 25)
+    def test_create_client(self):
+        client = create_client('suggest')
+
+        connections = client.transport.connection_pool.connections
+        self.assertEqual(
+            ['http://es1:9200', 'http://es2:9201'],
+            sorted(connection.host for connection in connections)
+        )
+        for connection in connections:
+            self.assertIs(Urllib3HttpConnection, type(connection))
+            self.assertEqual(100, connection.timeout)
+            self.assertEqual(25, connection.pool.pool.maxsize)
+            self.assertNotIn('accept-encoding', connection.headers)
+
+    @mock.patch.dict('complaint_search.es_client._TIMEOUTS', suggest=5)
+    def test_operation_timeouts(self):
+        timeouts = [
+            create_client(operation).transport.connection_pool
+            .connections[0].timeout
+            for operation in OPERATIONS
+        ]
+
+        self.assertEqual([5, 100, 100, 3000], timeouts)
+
+    @mock.patch('complaint_search.es_client._HTTP_COMPRESS', True)
+    def test_http_compress(self):
+        connection = create_client('search').transport.connection_pool \
+            .connections[0]
+
+        self.assertIsInstance(connection, CompressedConnection)
+        self.assertEqual('gzip,deflate', connection.headers['accept-encoding'])
+        self.assertEqual('keep-alive', connection.headers['connection'])
+
+    @mock.patch('complaint_search.es_client._SNIFF', True)
+    @mock.patch('complaint_search.es_client.Elasticsearch')
+    def test_sniff(self, mock_es):
+        create_client('search')
+
+        kwargs = mock_es.call_args[1]
+        self.assertTrue(kwargs['sniff_on_start'])
+        self.assertTrue(kwargs['sniff_on_connection_fail'])
+        self.assertEqual(60, kwargs['sniffer_timeout'])
+
+    @mock.patch.dict(es_interface._ES_CLIENTS, clear=True)
+    def test_one_client_per_operation(self):
+        search_client = es_interface._get_es()
+
+        self.assertIs(search_client, es_interface._get_es('search'))
+        self.assertIsNot(search_client, es_interface._get_es('export'))
+        self.assertEqual(
+            ['export', 'search'], sorted(es_interface._ES_CLIENTS)
+        )
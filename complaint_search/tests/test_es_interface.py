@@ -1,4 +1,5 @@
 import copy
+import gzip
 from datetime import datetime
 
 from django.http import StreamingHttpResponse
@@ -8,8 +9,12 @@ import mock
 from complaint_search.es_builders import AggregationBuilder, SearchBuilder
 from complaint_search.es_interface import (
     _COMPLAINT_DOC_TYPE,
+    _META_CACHE,
+    _META_CACHE_TTL,
+    _clear_meta_cache,
     _get_meta,
     document,
+    facet_buckets,
     filter_suggest,
     search,
     suggest,
@@ -32,7 +37,12 @@ class EsInterfaceTest_Search(TestCase):
             "search": "OK",
             "_scroll_id": "This_is_a_scroll_id",
             "hits": {
-                "hits": [0, 1, 2, 3]
+                "hits": [
+                    {"_id": "0"},
+                    {"_id": "1"},
+                    {"_id": "2"},
+                    {"_id": "3"}
+                ]
             }
         },
         {
@@ -59,7 +69,12 @@ class EsInterfaceTest_Search(TestCase):
         'search': 'OK',
         "_scroll_id": "This_is_a_scroll_id",
         "hits": {
-            "hits": [0, 1, 2, 3]
+            "hits": [
+                {"_id": "0"},
+                {"_id": "1"},
+                {"_id": "2"},
+                {"_id": "3"}
+            ]
         },
         '_meta': {
             'total_record_count': 100,
@@ -75,18 +90,34 @@ class EsInterfaceTest_Search(TestCase):
     MOCK_SCROLL_SIDE_EFFECT = [
         {
             "hits": {
-                "hits": [4, 5, 6, 7]
+                "hits": [
+                    {"_id": "4"},
+                    {"_id": "5"},
+                    {"_id": "6"},
+                    {"_id": "7"}
+                ]
             }
         },
         {
             "hits": {
-                "hits": [8, 9, 10, 11]
+                "hits": [
+                    {"_id": "8"},
+                    {"_id": "9"},
+                    {"_id": "10"},
+                    {"_id": "11"}
+                ]
             }
         }
     ]
 
     DEFAULT_EXCLUDE = ['company', 'zip_code']
 
+    def setUp(self):
+        _clear_meta_cache()
+
+    def tearDown(self):
+        _clear_meta_cache()
+
     # -------------------------------------------------------------------------
     # Helper Methods
     # -------------------------------------------------------------------------
@@ -118,7 +149,8 @@ class EsInterfaceTest_Search(TestCase):
         self.assertEqual(1, len(mock_search.call_args_list))
         self.assertEqual(2, len(mock_search.call_args_list[0]))
         self.assertEqual(0, len(mock_search.call_args_list[0][0]))
-        self.assertEqual(4, len(mock_search.call_args_list[0][1]))
+        self.assertEqual(3, len(mock_search.call_args_list[0][1]))
+        self.assertNotIn('scroll', mock_search.call_args_list[0][1])
 
         assertBodyEqual(body, mock_search.call_args_list[0][1]['body'])
         self.assertEqual(mock_search.call_args_list[0][1]['index'], 'INDEX')
@@ -170,6 +202,77 @@ class EsInterfaceTest_Search(TestCase):
         exp_res['has_data_issue'] = True
         self.assertDictEqual(exp_res, res)
 
+    @mock.patch("complaint_search.es_interface._get_now")
+    @mock.patch.object(Elasticsearch, 'search')
+    @mock.patch.object(Elasticsearch, 'count')
+    def test_get_meta_cached(self, mock_count, mock_search, mock_now):
+        mock_search.return_value = self.MOCK_SEARCH_SIDE_EFFECT[1]
+        mock_count.return_value = self.MOCK_COUNT_RETURN_VALUE
+        mock_now.return_value = datetime(2017, 1, 3)
+
+        first = _get_meta()
+        first['search_after'] = 'mutated by the caller'
+        res = _get_meta()
+
+        self.assertDictEqual(self.MOCK_SEARCH_RESULT["_meta"], res)
+        self.assertEqual(1, mock_search.call_count)
+        self.assertEqual(1, mock_count.call_count)
+
+    @mock.patch("complaint_search.es_interface._get_now")
+    @mock.patch("complaint_search.es_interface.time")
+    @mock.patch("complaint_search.es_interface.threading.Thread")
+    @mock.patch.object(Elasticsearch, 'search')
+    @mock.patch.object(Elasticsearch, 'count')
+    def test_get_meta_expired_refreshes_in_background(
+        self, mock_count, mock_search, mock_thread, mock_time, mock_now
+    ):
+        updated = copy.deepcopy(self.MOCK_SEARCH_SIDE_EFFECT[1])
+        updated['aggregations']['max_date']['value_as_string'] = '2017-01-02'
+        mock_search.side_effect = [
+            self.MOCK_SEARCH_SIDE_EFFECT[1],
+            updated
+        ]
+        mock_count.return_value = self.MOCK_COUNT_RETURN_VALUE
+        mock_now.return_value = datetime(2017, 1, 3)
+        mock_time.time.return_value = 1000
+
+        _get_meta()
+        mock_time.time.return_value = 1000 + _META_CACHE_TTL
+
+        # The stale copy is served while the refresh is started
+        res = _get_meta()
+        self.assertEqual('2017-01-01', res['last_updated'])
+        self.assertEqual(1, mock_thread.call_count)
+
+        # Only one refresh runs at a time
+        _get_meta()
+        self.assertEqual(1, mock_thread.call_count)
+
+        mock_thread.call_args[1]['target']()
+        res = _get_meta()
+        self.assertEqual('2017-01-02', res['last_updated'])
+        self.assertEqual(2, mock_search.call_count)
+        # The index was not rebuilt so the count is reused
+        self.assertEqual(1, mock_count.call_count)
+
+    @mock.patch("complaint_search.es_interface._get_now")
+    @mock.patch("complaint_search.es_interface._META_CACHE_ALIAS", "default")
+    @mock.patch.object(Elasticsearch, 'search')
+    @mock.patch.object(Elasticsearch, 'count')
+    def test_get_meta_shared_cache(self, mock_count, mock_search, mock_now):
+        mock_search.return_value = self.MOCK_SEARCH_SIDE_EFFECT[1]
+        mock_count.return_value = self.MOCK_COUNT_RETURN_VALUE
+        mock_now.return_value = datetime(2017, 1, 3)
+
+        _get_meta()
+        # Another process only has the shared cache
+        _META_CACHE.clear()
+        res = _get_meta()
+
+        self.assertDictEqual(self.MOCK_SEARCH_RESULT["_meta"], res)
+        self.assertEqual(1, mock_search.call_count)
+        _clear_meta_cache()
+
     @mock.patch('requests.get', ok=True, content="RGET_OK")
     def test_search_no_param__valid(self, mock_rget):
         self.request_test("search_no_param__valid")
@@ -212,10 +315,32 @@ class EsInterfaceTest_Search(TestCase):
             self.assertEqual(1, mock_exporter_csv.call_count)
             self.assertEqual(0, mock_exporter_json.call_count)
         else:
-            self.assertEqual(1, mock_search.call_count)
+            mock_search.assert_not_called()
             self.assertEqual(1, mock_exporter_json.call_count)
             self.assertEqual(0, mock_exporter_csv.call_count)
 
+    @parameterized.expand([
+        ['csv.gz', b'Date received,'],
+        ['ndjson.gz', b'{"_source":'],
+    ])
+    @mock.patch('elasticsearch.helpers.scan')
+    def test_search_with_format__gzip(
+        self, export_type, expected, mock_es_helper
+    ):
+        mock_es_helper.return_value = iter([
+            {'_source': {'complaint_id': '1'}}
+        ])
+
+        res = search(format=export_type)
+
+        self.assertEqual('application/gzip', res['Content-Type'])
+        self.assertEqual(
+            'attachment; filename=file.{}'.format(export_type),
+            res['Content-Disposition']
+        )
+        content = gzip.decompress(b''.join(res.streaming_content))
+        self.assertTrue(content.startswith(expected))
+
     def test_search_with_field__valid(self):
         self.request_test("search_with_field__valid", field="test_field")
 
@@ -264,6 +389,104 @@ class EsInterfaceTest_Search(TestCase):
             'hits'] = self.MOCK_SCROLL_SIDE_EFFECT[1]['hits']['hits']
         self.assertDictEqual(search_result, res)
 
+    @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
+    @mock.patch("complaint_search.es_interface._get_now")
+    @mock.patch.object(Elasticsearch, 'msearch')
+    @mock.patch.object(Elasticsearch, 'search')
+    @mock.patch.object(Elasticsearch, 'count')
+    def test_search_with_meta_single_round_trip(
+        self, mock_count, mock_search, mock_msearch, mock_now
+    ):
+        meta_response = copy.deepcopy(self.MOCK_SEARCH_SIDE_EFFECT[1])
+        meta_response['hits'] = {'total': 100}
+        mock_msearch.return_value = {
+            'responses': [
+                copy.deepcopy(self.MOCK_SEARCH_SIDE_EFFECT[0]),
+                meta_response
+            ]
+        }
+        mock_search.return_value = copy.deepcopy(
+            self.MOCK_SEARCH_SIDE_EFFECT[0])
+        mock_now.return_value = datetime(2017, 1, 3)
+        body = load("search_no_param__valid")
+
+        res = search(self.DEFAULT_EXCLUDE)
+
+        self.assertEqual(1, mock_msearch.call_count)
+        request = mock_msearch.call_args[1]['body']
+        self.assertEqual(4, len(request))
+        assertBodyEqual(body, request[1])
+        self.assertIn('max_indexed_date', request[3]['aggs'])
+        mock_search.assert_not_called()
+        mock_count.assert_not_called()
+        self.assertDictEqual(self.MOCK_SEARCH_RESULT, res)
+
+        # The metadata is cached now, so only the search is needed
+        res = search(self.DEFAULT_EXCLUDE)
+        self.assertEqual(1, mock_msearch.call_count)
+        self.assertEqual(1, mock_search.call_count)
+        self.assertDictEqual(self.MOCK_SEARCH_RESULT, res)
+
+    @mock.patch("complaint_search.es_interface._SEARCH_AFTER", True)
+    @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
+    @mock.patch("complaint_search.es_interface._get_meta")
+    @mock.patch.object(Elasticsearch, 'search')
+    @mock.patch.object(Elasticsearch, 'scroll')
+    def test_search_with_search_after__valid(
+        self, mock_scroll, mock_search, mock_get_meta
+    ):
+        mock_search.return_value = {
+            "hits": {
+                "hits": [
+                    {"_id": "4", "sort": [1591628400000, "4"]},
+                    {"_id": "5", "sort": [1591542000000, "5"]}
+                ]
+            }
+        }
+        mock_get_meta.return_value = copy.deepcopy(
+            self.MOCK_SEARCH_RESULT["_meta"])
+        body = load("search_with_sort__valid")
+        body["sort"] = [
+            {"date_received": {"order": "desc"}},
+            {"complaint_id": {"order": "desc"}}
+        ]
+        body["search_after"] = [1591714800000, "3"]
+
+        res = search(self.DEFAULT_EXCLUDE,
+                     frm=20,
+                     sort="created_date_desc",
+                     search_after=[1591714800000, "3"])
+
+        mock_search.assert_called_once_with(
+            body=body,
+            index="INDEX",
+            doc_type=_COMPLAINT_DOC_TYPE
+        )
+        mock_scroll.assert_not_called()
+        self.assertEqual("1591542000000_5", res["_meta"]["search_after"])
+
+    @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
+    @mock.patch("complaint_search.es_interface._get_meta")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_search_with_search_after__disabled(
+        self, mock_search, mock_get_meta
+    ):
+        # Elasticsearch 2 has no search_after
+        mock_search.return_value = {
+            "hits": {
+                "hits": [{"_id": "4", "sort": [1591628400000, "4"]}]
+            }
+        }
+        mock_get_meta.return_value = copy.deepcopy(
+            self.MOCK_SEARCH_RESULT["_meta"])
+
+        res = search(self.DEFAULT_EXCLUDE,
+                     sort="created_date_desc",
+                     search_after=[1591714800000, "3"])
+
+        self.assertNotIn("search_after", mock_search.call_args[1]["body"])
+        self.assertNotIn("search_after", res["_meta"])
+
     @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
     @mock.patch("complaint_search.es_interface._get_meta")
     @mock.patch.object(Elasticsearch, 'search')
@@ -302,12 +525,14 @@ class EsInterfaceTest_Search(TestCase):
 
         for s in sort_fields:
             res = search(self.DEFAULT_EXCLUDE, sort=s[0])
-            body["sort"] = [{s[1]: {"order": s[2]}}]
+            body["sort"] = [
+                {s[1]: {"order": s[2]}},
+                {"complaint_id": {"order": s[2]}}
+            ]
             mock_search.assert_any_call(
                 body=body,
                 index="INDEX",
-                doc_type=_COMPLAINT_DOC_TYPE,
-                scroll="10m"
+                doc_type=_COMPLAINT_DOC_TYPE
             )
             self.assertEqual(self.MOCK_SEARCH_RESULT, res)
 
@@ -719,3 +944,44 @@ class EsInterfaceTest_Document(TestCase):
         self.assertEqual(mock_search.call_args[1]['doc_type'], 'DOC_TYPE')
         self.assertEqual(mock_search.call_args[1]['index'], 'INDEX')
         self.assertEqual('OK', res)
+
+
+class EsInterfaceTest_FacetBuckets(TestCase):
+
+    @mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+    @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_facet_buckets__valid(self, mock_search):
+        buckets = [
+            {'key': 'Bank {}'.format(i), 'doc_count': 100 - i}
+            for i in range(15)
+        ]
+        mock_search.return_value = {
+            'aggregations': {
+                'company': {
+                    'doc_count': 1000,
+                    'company': {
+                        'buckets': buckets,
+                        'sum_other_doc_count': 20
+                    }
+                }
+            }
+        }
+
+        res = facet_buckets('company', frm=10, size=5, state=['VA'])
+
+        self.assertEqual({
+            'facet': 'company',
+            'frm': 10,
+            'size': 5,
+            'buckets': buckets[10:],
+            'has_more': True,
+        }, res)
+        body = mock_search.call_args[1]['body']
+        self.assertEqual(0, body['size'])
+        self.assertEqual(0, body['from'])
+        self.assertEqual(['company'], list(body['aggs']))
+        self.assertEqual(
+            {'field': 'company.raw', 'size': 15, 'shard_size': 32},
+            body['aggs']['company']['aggs']['company']['terms']
+        )
@@ -1,9 +1,25 @@
 from django.test import TestCase
 
 import mock
-from complaint_search.es_interface import trends
+from complaint_search.es_interface import process_trend_aggregations, trends
+from complaint_search.management.commands.benchmark_trend_processing import (
+    generate_aggregations,
+    sorted_trend_aggregations,
+)
 from complaint_search.tests.es_interface_test_helpers import load
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, TransportError
+
+
+def trends_response(name):
+    """The Elasticsearch response of an expected result, with its date range
+    buckets in their global aggregation"""
+    body = load(name)
+    aggregations = body['aggregations']
+    aggregations['dateRangeBuckets'] = {
+        'doc_count': aggregations['dateRangeBuckets']['doc_count'],
+        'dateRangeBuckets': aggregations['dateRangeBuckets'],
+    }
+    return body
 
 
 class EsInterfaceTest_Trends(TestCase):
@@ -17,7 +33,7 @@ class EsInterfaceTest_Trends(TestCase):
             'lens': 'overview',
             'trend_interval': 'year'
         }
-        body = load("trends_default_params__valid")
+        body = trends_response("trends_default_params__valid")
         mock_search.return_value = body
 
         res = trends(**trends_params)
@@ -38,7 +54,7 @@ class EsInterfaceTest_Trends(TestCase):
             'trend_depth': 5,
             'sub_lens_depth': 5
         }
-        body = load("trends_sub_lens_product__valid")
+        body = trends_response("trends_sub_lens_product__valid")
         mock_search.return_value = body
 
         res = trends(**trends_params)
@@ -60,7 +76,7 @@ class EsInterfaceTest_Trends(TestCase):
             'company_received_min': '2019-01-01',
             'company_received_max': '2020-01-01',
         }
-        body = load("trends_exclude_and_date_filters__valid")
+        body = trends_response("trends_exclude_and_date_filters__valid")
         mock_search.return_value = body
 
         res = trends(agg_exclude=['zip_code'], **trends_params)
@@ -82,7 +98,7 @@ class EsInterfaceTest_Trends(TestCase):
             'sub_lens_depth': 5,
             'issue': 'Incorrect information on your report'
         }
-        body = load("trends_filter__valid")
+        body = trends_response("trends_filter__valid")
         mock_search.return_value = body
 
         res = trends(**trends_params)
@@ -102,7 +118,7 @@ class EsInterfaceTest_Trends(TestCase):
             'trend_depth': 5,
             'issue': 'Incorrect information on your report'
         }
-        body = load("trends_filter__valid")
+        body = trends_response("trends_filter__valid")
         mock_search.return_value = body
 
         res = trends(**trends_params)
@@ -124,7 +140,7 @@ class EsInterfaceTest_Trends(TestCase):
             'company': 'EQUIFAX, INC.'
         }
 
-        body = load("trends_company_filter__valid")
+        body = trends_response("trends_company_filter__valid")
         mock_search.return_value = body
 
         res = trends(default_exclude, **trends_params)
@@ -146,7 +162,7 @@ class EsInterfaceTest_Trends(TestCase):
             'focus': 'Incorrect information on your report'
         }
 
-        body = load("trends_issue_focus__valid")
+        body = trends_response("trends_issue_focus__valid")
         mock_search.return_value = body
 
         res = trends(default_exclude, **trends_params)
@@ -171,7 +187,7 @@ class EsInterfaceTest_Trends(TestCase):
             'company': 'EQUIFAX, INC.'
         }
 
-        body = load("trends_issue_focus_company_filter__valid")
+        body = trends_response("trends_issue_focus_company_filter__valid")
         mock_search.return_value = body
 
         res = trends(default_exclude, **trends_params)
@@ -181,3 +197,78 @@ class EsInterfaceTest_Trends(TestCase):
         self.assertTrue('company' in res['aggregations'])
         self.assertEqual(len(res['aggregations']['issue']['issue']['buckets']),
                          1)
+
+    @mock.patch("complaint_search.es_interface._COMPLAINT_ES_INDEX", "INDEX")
+    @mock.patch("complaint_search.es_interface._COMPLAINT_DOC_TYPE",
+                "DOC_TYPE")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends_single_search(self, mock_search):
+        trends_params = {
+            'lens': 'overview',
+            'trend_interval': 'year'
+        }
+        body = trends_response("trends_default_params__valid")
+        date_range_buckets = \
+            body['aggregations']['dateRangeBuckets']['dateRangeBuckets']
+        mock_search.return_value = body
+
+        res = trends(**trends_params)
+        self.assertEqual(1, mock_search.call_count)
+        request = mock_search.call_args[1]['body']
+        self.assertIn('dateRangeArea', request['aggs'])
+        self.assertEqual(
+            {}, request['aggs']['dateRangeBuckets']['global']
+        )
+        self.assertEqual(
+            date_range_buckets, res['aggregations']['dateRangeBuckets']
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends_search_error(self, mock_search):
+        trends_params = {
+            'lens': 'overview',
+            'trend_interval': 'year'
+        }
+        mock_search.side_effect = TransportError(
+            400, 'SearchPhaseExecutionException'
+        )
+
+        with self.assertRaises(TransportError):
+            trends(**trends_params)
+
+
+class ProcessTrendAggregationsTest(TestCase):
+
+    def test_most_recent_first(self):
+        aggregations = process_trend_aggregations(
+            generate_aggregations('product', 2, 0, 5)
+        )
+        for bucket in aggregations['product']['product']['buckets']:
+            keys = [
+                b['key_as_string'] for b in bucket['trend_period']['buckets']
+            ]
+            self.assertEqual(len(keys), 5)
+            self.assertEqual(keys, sorted(keys, reverse=True))
+
+    def test_sub_lens_keeps_previous_period(self):
+        aggregations = process_trend_aggregations(
+            generate_aggregations('product', 2, 3, 5)
+        )
+        bucket = aggregations['product']['product']['buckets'][0]
+        for sub_bucket in bucket['sub_product']['buckets']:
+            periods = sub_bucket['trend_period']['buckets']
+            self.assertEqual(len(periods), 1)
+            self.assertEqual(
+                periods[0]['key_as_string'], '2011-12-04T00:00:00.000Z'
+            )
+
+    def test_matches_sorting(self):
+        for days in (0, 1, 2, 40):
+            self.assertEqual(
+                process_trend_aggregations(
+                    generate_aggregations('product', 3, 2, days)
+                ),
+                sorted_trend_aggregations(
+                    generate_aggregations('product', 3, 2, days)
+                )
+            )
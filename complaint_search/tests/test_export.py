@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import gzip
 import io
+import json
 from collections import OrderedDict
 
 from django.http import StreamingHttpResponse
 from django.test import TestCase
 
-from complaint_search.export import ElasticSearchExporter
+from complaint_search.export import ElasticSearchExporter, gzip_stream
 from nose_parameterized import parameterized
 
 
@@ -57,6 +59,42 @@ class ExportTest(TestCase):
         downloaded_file = io.BytesIO(b"".join(res.streaming_content))
         self.assertFalse(downloaded_file is None)
 
+    def test_export_csv_chunks(self):
+        es_exporter = ElasticSearchExporter()
+        gen = es_generator(1000)
+
+        res = es_exporter.export_csv(gen, TEST_HEADERS, chunk_size=4096)
+
+        chunks = list(res.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 4096)
+        lines = b"".join(chunks).splitlines()
+        self.assertEqual(1001, len(lines))
+        self.assertEqual(
+            b'First Entry,Second Entry,Third Entry,Fourth Entry', lines[0]
+        )
+        self.assertEqual(b'Random 1,Random 2,Random 3,Random 4', lines[1])
+
+    def test_export_csv_missing_fields(self):
+        def results():
+            yield {'_source': {'second_entry': None, 'extra': 'Extra'}}
+            yield {'_source': {
+                'first_entry': 1,
+                'second_entry': None,
+                'third_entry': 'Random 3',
+                'fourth_entry': ['Older American', 'Servicemember'],
+            }}
+
+        es_exporter = ElasticSearchExporter()
+        res = es_exporter.export_csv(results(), TEST_HEADERS)
+
+        lines = b"".join(res.streaming_content).splitlines()
+        self.assertEqual([
+            b',None,,',
+            b'1,None,Random 3,"[\'Older American\', \'Servicemember\']"'
+        ], lines[1:])
+
     @parameterized.expand([
         [10],
         [5010],
@@ -68,7 +106,7 @@ class ExportTest(TestCase):
         gen = es_generator(length)
 
         # act
-        res = es_exporter.export_json(gen, length)
+        res = es_exporter.export_json(gen)
 
         # assert
         self.assertTrue(isinstance(res, StreamingHttpResponse))
@@ -78,8 +116,104 @@ class ExportTest(TestCase):
             res.get('Content-Disposition'), "attachment; filename=file.json"
         )
         self.assertTrue('map' in str(type(res.streaming_content)))
-        downloaded_file = io.BytesIO(b"".join(res.streaming_content))
-        self.assertFalse(downloaded_file is None)
+        downloaded = json.loads(b"".join(res.streaming_content))
+        self.assertEqual(length, len(downloaded))
+        self.assertEqual(
+            {'first_entry': 'Random 1', 'second_entry': 'Random 2',
+             'third_entry': 'Random 3', 'fourth_entry': 'Random 4'},
+            downloaded[0]['_source']
+        )
+
+    def test_export_json_empty(self):
+        es_exporter = ElasticSearchExporter()
+
+        res = es_exporter.export_json(iter([]))
+
+        self.assertEqual(b'[]', b"".join(res.streaming_content))
+
+    def test_export_json_chunks(self):
+        es_exporter = ElasticSearchExporter()
+        gen = es_generator(1000)
+
+        res = es_exporter.export_json(gen, chunk_size=4096)
+
+        chunks = list(res.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 4096)
+        self.assertEqual(1000, len(json.loads(b"".join(chunks))))
+
+    def test_export_ndjson(self):
+        es_exporter = ElasticSearchExporter()
+        gen = es_generator(1000)
+
+        res = es_exporter.export_ndjson(gen, chunk_size=4096)
+
+        self.assertEqual(
+            res.get('Content-Disposition'),
+            "attachment; filename=file.ndjson"
+        )
+        self.assertEqual('application/x-ndjson', res.get('Content-Type'))
+        chunks = list(res.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith(b'\n'))
+        lines = b"".join(chunks).splitlines()
+        self.assertEqual(1000, len(lines))
+        self.assertEqual(
+            'Random 4', json.loads(lines[-1])['_source']['fourth_entry']
+        )
+
+    def test_export_ndjson_empty(self):
+        es_exporter = ElasticSearchExporter()
+
+        res = es_exporter.export_ndjson(iter([]))
+
+        self.assertEqual(b'', b"".join(res.streaming_content))
+
+    def test_export_gzip(self):
+        es_exporter = ElasticSearchExporter()
+        gen = es_generator(1000)
+
+        res = es_exporter.export_gzip(
+            es_exporter.export_csv(gen, TEST_HEADERS)
+        )
+
+        self.assertEqual('application/gzip', res.get('Content-Type'))
+        self.assertEqual(
+            res.get('Content-Disposition'),
+            "attachment; filename=file.csv.gz"
+        )
+        lines = gzip.decompress(
+            b"".join(res.streaming_content)
+        ).splitlines()
+        self.assertEqual(1001, len(lines))
+        self.assertEqual(b'Random 1,Random 2,Random 3,Random 4', lines[-1])
+
+
+class GzipStreamTest(TestCase):
+    def test_gzip_stream(self):
+        chunks = ['{}\n'.format(i) * 1000 for i in range(100)]
+
+        compressed = list(gzip_stream(iter(chunks)))
+
+        self.assertGreater(len(compressed), 1)
+        self.assertEqual(
+            ''.join(chunks).encode('utf-8'),
+            gzip.decompress(b''.join(compressed))
+        )
+
+    def test_gzip_stream_bytes(self):
+        compressed = b''.join(gzip_stream([b'\xe2\x80\x99', u'\u2019']))
+
+        self.assertEqual(
+            b'\xe2\x80\x99\xe2\x80\x99', gzip.decompress(compressed)
+        )
+
+    def test_gzip_stream_empty(self):
+        compressed = b''.join(gzip_stream([]))
+
+        self.assertEqual(b'', gzip.decompress(compressed))
 
 
 class TestCSVExportWithUnicodeCharacters(TestCase):
@@ -0,0 +1,211 @@
+from django.test import TestCase
+
+import mock
+from complaint_search import export_admission
+from complaint_search.export_admission import EXPORTS, ExportAdmission
+from complaint_search.metrics import REGISTRY
+from complaint_search.rate_limit import FileStore, LocalStore
+from complaint_search.throttling import (
+    CCDBRateThrottle,
+    ExportAnonRateThrottle,
+)
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+
+class Clock(object):
+    """A clock only moving when slept on"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.on_sleep = None
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep()
+
+
+class ExportAdmissionTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.store = LocalStore()
+        self.clock = Clock()
+
+    def tearDown(self):
+        REGISTRY.clear()
+
+    def admission(self, **kwargs):
+        kwargs.setdefault('per_node', 2)
+        kwargs.setdefault('total', 0)
+        kwargs.setdefault('wait_seconds', 0)
+        kwargs.setdefault('node', 'node1')
+        return ExportAdmission(
+            self.store, timer=self.clock, sleep=self.clock.sleep, **kwargs
+        )
+
+    def test_per_node(self):
+        admission = self.admission()
+        first = admission.admit()
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(admission.admit())
+        self.assertIsNone(admission.admit())
+
+        # Other nodes have their own slots
+        self.assertIsNotNone(self.admission(node='node2').admit())
+
+        first.release()
+        first.release()
+        self.assertIsNotNone(admission.admit())
+
+        exposition = REGISTRY.exposition()
+        self.assertIn(
+            'ccdb_export_admissions_total{result="admitted"} 4', exposition
+        )
+        self.assertIn(
+            'ccdb_export_admissions_total{result="refused"} 1', exposition
+        )
+        self.assertIn('ccdb_exports_in_progress 3', exposition)
+
+    def test_total(self):
+        node1 = self.admission(total=1)
+        node2 = self.admission(total=1, node='node2')
+
+        lease = node1.admit()
+        self.assertIsNone(node2.admit())
+        # The node slot taken before the total one was full is released
+        self.assertEqual({}, self.store._slots['exports:node:node2'])
+
+        lease.release()
+        self.assertIsNotNone(node2.admit())
+
+    def test_wait_for_a_slot(self):
+        admission = self.admission(per_node=1, wait_seconds=1)
+        lease = admission.admit()
+
+        self.clock.on_sleep = lambda: self.assertIn(
+            'ccdb_export_queue_depth 1', REGISTRY.exposition()
+        )
+        self.assertIsNone(admission.admit())
+        self.assertEqual(1001.0, self.clock.now)
+
+        self.clock.on_sleep = lease.release
+        self.assertIsNotNone(admission.admit())
+        self.assertEqual(0, admission.waiting)
+
+        exposition = REGISTRY.exposition()
+        self.assertIn('ccdb_export_queue_depth 0', exposition)
+        self.assertIn(
+            'ccdb_export_admissions_total{result="waited"} 1', exposition
+        )
+
+    def test_queue_full(self):
+        admission = self.admission(per_node=1, wait_seconds=1,
+                                   max_waiting=0)
+        admission.admit()
+        self.assertIsNone(admission.admit())
+        self.assertEqual(1000.0, self.clock.now)
+
+    def test_leases_expire(self):
+        admission = self.admission(per_node=1, lease_seconds=60)
+        lease = admission.admit()
+        content = lease.stream(iter(['a', 'b']))
+
+        # Streaming refreshes the lease
+        self.clock.now += 30
+        self.assertEqual('a', next(content))
+        self.clock.now += 45
+        self.assertIsNone(admission.admit())
+
+        # Until the export stalls
+        self.clock.now += 31
+        self.assertIsNotNone(admission.admit())
+
+    def test_stream_releases(self):
+        admission = self.admission(per_node=1)
+
+        content = admission.admit().stream(iter(['a', 'b']))
+        self.assertEqual(['a', 'b'], list(content))
+
+        # Closed before being consumed, as when the client disconnects
+        content = mock.MagicMock()
+        admission.admit().stream(content).close()
+        content.close.assert_called_once_with()
+        self.assertEqual({}, self.store._slots['exports:node:node1'])
+
+    @mock.patch('complaint_search.export_admission._EXPORTS_TOTAL', 2)
+    def test_without_redis(self):
+        with self.assertLogs('complaint_search.export_admission', 'WARNING'):
+            admission = export_admission._get_admission()
+
+        # Node slots are shared by the workers of the host
+        self.assertIsInstance(admission.node_store, FileStore)
+        self.assertIsInstance(admission.store, LocalStore)
+
+
+class ExportAdmissionViewTest(APITestCase):
+
+    def setUp(self):
+        self.store = LocalStore()
+        self.patches = [
+            mock.patch.object(EXPORTS, 'store', self.store),
+            mock.patch.object(EXPORTS, 'node_store', self.store),
+            mock.patch.object(EXPORTS, 'per_node', 1),
+            mock.patch.object(EXPORTS, 'wait_seconds', 0),
+            # Setting rates to something really big so it doesn't affect
+            # testing
+            mock.patch.object(ExportAnonRateThrottle, 'rate', '2000/min'),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        CCDBRateThrottle.store.clear()
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_exports_refused_while_busy(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        mock_essearch.return_value = iter(['a,b\n'])
+
+        response = self.client.get(url, {'format': 'csv'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        refused = self.client.get(url, {'format': 'csv'})
+        self.assertEqual(
+            status.HTTP_429_TOO_MANY_REQUESTS, refused.status_code
+        )
+        self.assertEqual(str(EXPORTS.retry_after), refused['Retry-After'])
+        self.assertEqual(1, mock_essearch.call_count)
+
+        # Searches are not limited
+        mock_essearch.return_value = {'hits': {'hits': []}}
+        self.assertEqual(200, self.client.get(url).status_code)
+
+        # The slot is released once the export is sent
+        self.assertEqual(b'a,b\n', b''.join(response.streaming_content))
+        mock_essearch.return_value = iter([])
+        self.assertEqual(
+            status.HTTP_200_OK,
+            self.client.get(url, {'format': 'csv'}).status_code
+        )
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_slot_released_on_error(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        mock_essearch.side_effect = ValueError('Unavailable')
+
+        response = self.client.get(url, {'format': 'csv'})
+        self.assertEqual(500, response.status_code)
+        self.assertEqual({}, self.store._slots['exports:node:' + EXPORTS.node])
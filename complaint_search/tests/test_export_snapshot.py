@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+
+import mock
+from complaint_search.export_snapshot import build_snapshot, find_snapshot
+
+
+META = {'last_indexed': '2020-06-01T12:00:00.000Z'}
+NEW_META = {'last_indexed': '2020-06-02T12:00:00.000Z'}
+
+
+@mock.patch('complaint_search.es_interface._get_meta')
+class ExportSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_build_snapshot(self, mock_search, mock_meta):
+        mock_meta.return_value = META
+        mock_search.return_value = StreamingHttpResponse([b'a,b\n', b'1,2\n'])
+
+        path, built = build_snapshot('csv', self.directory)
+
+        self.assertTrue(built)
+        self.assertEqual(
+            os.path.join(self.directory,
+                         'complaints-20200601T120000000Z.csv'),
+            path
+        )
+        with open(path, 'rb') as snapshot:
+            self.assertEqual(b'a,b\n1,2\n', snapshot.read())
+        self.assertEqual('csv', mock_search.call_args[1]['format'])
+        self.assertEqual(
+            'complaint_what_happened', mock_search.call_args[1]['field']
+        )
+        self.assertEqual([os.path.basename(path)],
+                         os.listdir(self.directory))
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_build_snapshot_up_to_date(self, mock_search, mock_meta):
+        mock_meta.return_value = META
+        mock_search.return_value = StreamingHttpResponse([b'a'])
+        build_snapshot('csv', self.directory)
+
+        path, built = build_snapshot('csv', self.directory)
+
+        self.assertFalse(built)
+        self.assertEqual(1, mock_search.call_count)
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_build_snapshot_removes_previous(self, mock_search, mock_meta):
+        mock_meta.return_value = META
+        mock_search.side_effect = lambda **kwargs: \
+            StreamingHttpResponse([b'a'])
+        old_csv, _ = build_snapshot('csv', self.directory)
+        old_ndjson, _ = build_snapshot('ndjson', self.directory)
+        mock_meta.return_value = NEW_META
+
+        path, built = build_snapshot('csv', self.directory)
+
+        self.assertTrue(built)
+        self.assertEqual(
+            sorted([os.path.basename(path), os.path.basename(old_ndjson)]),
+            sorted(os.listdir(self.directory))
+        )
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_build_snapshot_failure(self, mock_search, mock_meta):
+        def fail():
+            yield b'a'
+            raise IOError('scroll failed')
+
+        mock_meta.return_value = META
+        mock_search.return_value = StreamingHttpResponse(fail())
+
+        with self.assertRaises(IOError):
+            build_snapshot('csv', self.directory)
+
+        self.assertEqual([], os.listdir(self.directory))
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_find_snapshot(self, mock_search, mock_meta):
+        mock_meta.return_value = META
+        mock_search.return_value = StreamingHttpResponse([b'a'])
+        path, _ = build_snapshot('json', self.directory)
+
+        self.assertEqual(path, find_snapshot('json', self.directory))
+        self.assertIsNone(find_snapshot('csv', self.directory))
+
+        mock_meta.return_value = NEW_META
+        self.assertIsNone(find_snapshot('json', self.directory))
+
+    def test_find_snapshot_without_directory(self, mock_meta):
+        self.assertIsNone(find_snapshot('csv'))
+        mock_meta.assert_not_called()
@@ -0,0 +1,74 @@
+from django.test import TestCase
+
+from complaint_search.metrics import Registry, stats_counter
+
+
+class RegistryTest(TestCase):
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter(
+            'requests_total', 'Requests', ('endpoint', 'status')
+        )
+        counter.inc('search', '200')
+        counter.inc('search', '200')
+        counter.inc('trends', '424', amount=3)
+
+        self.assertEqual(
+            '# HELP requests_total Requests\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{endpoint="search",status="200"} 2\n'
+            'requests_total{endpoint="trends",status="424"} 3\n',
+            registry.exposition()
+        )
+
+    def test_gauge(self):
+        registry = Registry()
+        gauge = registry.gauge('queue_depth', 'Queue depth')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertIn('queue_depth 1\n', registry.exposition())
+
+        gauge.set(5)
+        self.assertEqual(
+            '# HELP queue_depth Queue depth\n'
+            '# TYPE queue_depth gauge\n'
+            'queue_depth 5\n',
+            registry.exposition()
+        )
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram(
+            'latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1.0)
+        )
+        histogram.observe(0.05, 'search')
+        histogram.observe(0.1, 'search')
+        histogram.observe(2.0, 'search')
+
+        self.assertEqual(
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{endpoint="search",le="0.1"} 2\n'
+            'latency_seconds_bucket{endpoint="search",le="1.0"} 2\n'
+            'latency_seconds_bucket{endpoint="search",le="+Inf"} 3\n'
+            'latency_seconds_sum{endpoint="search"} 2.15\n'
+            'latency_seconds_count{endpoint="search"} 3\n',
+            registry.exposition()
+        )
+
+    def test_collector_and_escaping(self):
+        registry = Registry()
+
+        @registry.collector
+        def collect():
+            return [stats_counter(
+                'cache_total', 'Cache', 'endpoint',
+                {'a"b': {'hits': 1}}
+            )]
+
+        self.assertIn(
+            'cache_total{endpoint="a\\"b",result="hits"} 1\n',
+            registry.exposition()
+        )
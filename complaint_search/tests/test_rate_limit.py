@@ -0,0 +1,237 @@
+import shutil
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, TestCase
+
+import mock
+from complaint_search.rate_limit import (
+    FileStore,
+    LocalStore,
+    RedisStore,
+    _gcra,
+    get_store,
+)
+from complaint_search.throttling import (
+    _CCDB_UI_URL,
+    ExportAnonRateThrottle,
+    ExportUIRateThrottle,
+    SearchAnonRateThrottle,
+    SearchThrottle,
+)
+from rest_framework.request import Request
+
+
+ALLOWED = (True, None)
+
+
+class GcraTest(TestCase):
+
+    def test_burst_then_rate(self):
+        store = LocalStore()
+        # 3 requests per 60 seconds
+        for _ in range(3):
+            self.assertEqual(0, store.acquire('client', 20.0, 60, 1000.0))
+        self.assertEqual(20.0, store.acquire('client', 20.0, 60, 1000.0))
+
+        # A request is allowed again every 20 seconds
+        self.assertEqual(5.0, store.acquire('client', 20.0, 60, 1015.0))
+        self.assertEqual(0, store.acquire('client', 20.0, 60, 1020.0))
+        self.assertEqual(20.0, store.acquire('client', 20.0, 60, 1020.0))
+
+        # Other clients have their own limits
+        self.assertEqual(0, store.acquire('other', 20.0, 60, 1020.0))
+
+    def test_acquire_many(self):
+        store = LocalStore()
+        limits = [('search', 20.0, 60), ('export', 60.0, 60)]
+        self.assertEqual(0, store.acquire_many(limits, 1000.0))
+        self.assertEqual(
+            {'search': 1020.0, 'export': 1060.0}, store._tats
+        )
+
+        # Refused by one limit, the request is counted in none
+        self.assertEqual(60.0, store.acquire_many(limits, 1000.0))
+        self.assertEqual(
+            {'search': 1020.0, 'export': 1060.0}, store._tats
+        )
+
+    def test_refused_requests_are_not_counted(self):
+        tat, wait = _gcra(1060.0, 20.0, 60, 1000.0)
+        self.assertEqual((1060.0, 20.0), (tat, wait))
+
+    def test_sweep(self):
+        store = LocalStore()
+        store._sweep_at = 4
+        for client in range(3):
+            store.acquire(str(client), 1.0, 60, 1000.0)
+        store.acquire('late', 1.0, 60, 1005.0)
+
+        self.assertEqual({'late': 1006.0}, store._tats)
+        self.assertEqual(1024, store._sweep_at)
+
+    def test_clear(self):
+        store = LocalStore()
+        store.acquire('client', 60.0, 60, 1000.0)
+        store.clear()
+        self.assertEqual(0, store.acquire('client', 60.0, 60, 1000.0))
+
+
+class FileStoreTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_slots(self):
+        # Each worker of a host has a store of its own
+        store, other = FileStore(self.directory), FileStore(self.directory)
+
+        self.assertTrue(store.acquire_slot('exports:node:a', 'a', 2, 60, 0))
+        self.assertTrue(other.acquire_slot('exports:node:a', 'b', 2, 60, 0))
+        self.assertFalse(store.acquire_slot('exports:node:a', 'c', 2, 60, 0))
+
+        other.release_slot('exports:node:a', 'b')
+        self.assertTrue(store.acquire_slot('exports:node:a', 'c', 2, 60, 0))
+
+        # Leases expire unless refreshed
+        store.refresh_slot('exports:node:a', 'a', 60, 30)
+        self.assertTrue(other.acquire_slot('exports:node:a', 'd', 2, 60, 70))
+        self.assertFalse(other.acquire_slot('exports:node:a', 'e', 2, 60, 70))
+
+    def test_unavailable(self):
+        # The directory is a file
+        with tempfile.NamedTemporaryFile(dir=self.directory) as directory:
+            store = FileStore(directory.name)
+            self.assertTrue(store.acquire_slot('exports', 'a', 1, 60, 0))
+            store.refresh_slot('exports', 'a', 60, 0)
+            store.release_slot('exports', 'a')
+
+
+class RedisStoreTest(TestCase):
+
+    def test_acquire(self):
+        client = mock.Mock()
+        client.register_script.return_value.return_value = b'2.5'
+        store = RedisStore(client)
+
+        self.assertEqual(2.5, store.acquire('client', 20.0, 60, 1000.0))
+        client.register_script.return_value.assert_called_once_with(
+            keys=['ccdb:throttle:client'], args=[1000.0, 20.0, 60]
+        )
+
+    def test_unavailable(self):
+        client = mock.Mock()
+        client.register_script.return_value.side_effect = \
+            ConnectionError('Unavailable')
+        store = RedisStore(client)
+
+        self.assertEqual(0, store.acquire('client', 20.0, 60, 1000.0))
+
+    def test_slots(self):
+        client = mock.Mock()
+        acquire_slot = mock.Mock(return_value=0)
+        client.register_script.side_effect = [mock.Mock(), acquire_slot]
+        store = RedisStore(client)
+
+        self.assertFalse(store.acquire_slot('exports', 'a', 4, 600, 1000.0))
+        acquire_slot.assert_called_once_with(
+            keys=['ccdb:throttle:exports'], args=['a', 4, 600, 1000.0]
+        )
+
+        store.refresh_slot('exports', 'a', 600, 1100.0)
+        client.zadd.assert_called_once_with(
+            'ccdb:throttle:exports', {'a': 1700.0}, xx=True
+        )
+        store.release_slot('exports', 'a')
+        client.zrem.assert_called_once_with('ccdb:throttle:exports', 'a')
+
+        # Exports run when slots can't be counted
+        acquire_slot.side_effect = ConnectionError('Unavailable')
+        self.assertTrue(store.acquire_slot('exports', 'a', 4, 600, 1000.0))
+
+    def test_get_store(self):
+        self.assertIsInstance(get_store(''), LocalStore)
+        with mock.patch.dict('sys.modules', {'redis': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_store('redis://localhost:6379/0')
+
+
+class ThrottleTest(TestCase):
+
+    def setUp(self):
+        self.store = LocalStore()
+        self.factory = RequestFactory()
+
+    def request(self, data=None, **extra):
+        return Request(self.factory.get('/', data, **extra))
+
+    def throttle(self, throttle_class, data=None):
+        # A new throttle per request, as DRF does
+        with mock.patch.object(throttle_class, 'store', self.store):
+            throttle = throttle_class()
+            throttle.timer = lambda: 1000.0
+            allowed = throttle.allow_request(self.request(data), None)
+        return allowed, throttle.wait() if not allowed else None
+
+    def test_limit_shared_by_instances(self):
+        with mock.patch.object(SearchAnonRateThrottle, 'rate', '2/min'):
+            self.assertEqual(ALLOWED, self.throttle(SearchAnonRateThrottle))
+            self.assertEqual(ALLOWED, self.throttle(SearchAnonRateThrottle))
+            self.assertEqual(
+                (False, 30.0), self.throttle(SearchAnonRateThrottle)
+            )
+
+    def test_scopes_counted_apart(self):
+        export = {'format': 'csv'}
+        with mock.patch.object(ExportAnonRateThrottle, 'rate', '1/min'):
+            self.assertEqual(
+                ALLOWED, self.throttle(ExportAnonRateThrottle, export)
+            )
+            self.assertEqual(
+                (False, 60.0), self.throttle(ExportAnonRateThrottle, export)
+            )
+            self.assertEqual(ALLOWED, self.throttle(SearchAnonRateThrottle))
+
+    def test_ui_not_counted(self):
+        with mock.patch.object(SearchAnonRateThrottle, 'store', self.store):
+            throttle = SearchAnonRateThrottle()
+            request = self.request(HTTP_REFERER=_CCDB_UI_URL)
+            for _ in range(30):
+                self.assertTrue(throttle.allow_request(request, None))
+        self.assertEqual({}, self.store._tats)
+
+    def combined(self, data=None, **extra):
+        with mock.patch.object(SearchThrottle, 'store', self.store):
+            throttle = SearchThrottle()
+            throttle.timer = lambda: 1000.0
+            allowed = throttle.allow_request(
+                self.request(data, **extra), None
+            )
+        return allowed, throttle.wait() if not allowed else None
+
+    def test_combined_scopes(self):
+        export = {'format': 'csv'}
+        self.assertEqual(ALLOWED, self.combined())
+        self.assertEqual(ALLOWED, self.combined(export))
+        self.assertEqual(
+            ALLOWED, self.combined(export, HTTP_REFERER=_CCDB_UI_URL)
+        )
+        # UI searches are not limited
+        self.assertEqual(ALLOWED, self.combined(HTTP_REFERER=_CCDB_UI_URL))
+
+        self.assertEqual({
+            'throttle_ccdb_anon_search_127.0.0.1': 1003.0,
+            'throttle_ccdb_anon_export_127.0.0.1': 1030.0,
+            'throttle_ccdb_ui_export_127.0.0.1': 1010.0,
+        }, self.store._tats)
+
+    def test_combined_limits(self):
+        export = {'format': 'csv'}
+        referer = {'HTTP_REFERER': _CCDB_UI_URL}
+        with mock.patch.object(ExportUIRateThrottle, 'rate', '1/min'):
+            self.assertEqual(ALLOWED, self.combined(export, **referer))
+            self.assertEqual(
+                (False, 60.0), self.combined(export, **referer)
+            )
+            self.assertEqual(ALLOWED, self.combined(export))
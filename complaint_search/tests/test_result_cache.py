@@ -0,0 +1,152 @@
+from datetime import date
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import mock
+from complaint_search.es_interface import (
+    _INDEX_VERSION_BODY,
+    _RESULT_CACHE,
+    states_agg,
+    trends,
+)
+from complaint_search.result_cache import ResultCache, canonical_key
+from complaint_search.tests.es_interface_test_helpers import load
+from elasticsearch import Elasticsearch
+
+
+class CanonicalKeyTest(TestCase):
+
+    def test_list_order_is_ignored(self):
+        self.assertEqual(
+            canonical_key('trends', company=['Bank 1', 'Bank 2']),
+            canonical_key('trends', company=['Bank 2', 'Bank 1'])
+        )
+
+    def test_dates(self):
+        self.assertEqual(
+            canonical_key('trends', date_received_min=date(2017, 1, 1)),
+            canonical_key('trends', date_received_min='2017-01-01')
+        )
+
+    def test_different_params(self):
+        self.assertNotEqual(
+            canonical_key('trends', company=['Bank 1']),
+            canonical_key('states_agg', company=['Bank 1'])
+        )
+
+
+class ResultCacheTest(TestCase):
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_lru_eviction(self):
+        result_cache = ResultCache(max_entries=2)
+        result_cache.set('a', 1)
+        result_cache.set('b', 2)
+        self.assertEqual(1, result_cache.get('trends', 'a'))
+        result_cache.set('c', 3)
+
+        self.assertIsNone(result_cache.get('trends', 'b'))
+        self.assertEqual(1, result_cache.get('trends', 'a'))
+        self.assertEqual(3, result_cache.get('trends', 'c'))
+        self.assertEqual(
+            {'trends': {'hits': 3, 'misses': 1}}, result_cache.stats
+        )
+
+    @mock.patch('complaint_search.result_cache.time')
+    def test_ttl(self, mock_time):
+        result_cache = ResultCache(ttl=10)
+        mock_time.time.return_value = 100
+        result_cache.set('a', 1)
+        mock_time.time.return_value = 110
+        self.assertIsNone(result_cache.get('trends', 'a'))
+
+    def test_shared_cache(self):
+        ResultCache(alias='default').set('a', 1)
+
+        result_cache = ResultCache(alias='default')
+        self.assertEqual(1, result_cache.get('trends', 'a'))
+        self.assertEqual(1, result_cache.get('trends', 'a'))
+        self.assertEqual(
+            {'trends': {'hits': 1, 'shared_hits': 1}}, result_cache.stats
+        )
+
+
+class EsInterfaceResultCacheTest(TestCase):
+
+    def setUp(self):
+        _RESULT_CACHE.clear()
+
+    def tearDown(self):
+        _RESULT_CACHE.clear()
+
+    @mock.patch("complaint_search.es_interface._get_index_version")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends_cached_per_index_version(
+        self, mock_search, mock_last_indexed
+    ):
+        # trends processes the response in place
+        mock_search.side_effect = \
+            lambda **kwargs: load("trends_default_params__valid")
+        mock_last_indexed.return_value = '2017-01-02'
+
+        res = trends(agg_exclude=['company', 'zip_code'], lens='overview',
+                     trend_interval='year')
+        cached = trends(agg_exclude=['zip_code', 'company'], lens='overview',
+                        trend_interval='year', size=10)
+        self.assertIs(res, cached)
+        self.assertEqual(1, mock_search.call_count)
+
+        mock_last_indexed.return_value = '2017-01-03'
+        trends(agg_exclude=['company', 'zip_code'], lens='overview',
+               trend_interval='year')
+        self.assertEqual(2, mock_search.call_count)
+        self.assertEqual(
+            {'trends': {'hits': 1, 'misses': 2}}, _RESULT_CACHE.stats
+        )
+
+    @mock.patch("complaint_search.es_interface._get_index_version")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_not_cached_without_index_version(
+        self, mock_search, mock_last_indexed
+    ):
+        mock_search.return_value = 'OK'
+        mock_last_indexed.return_value = None
+
+        states_agg()
+        states_agg()
+        self.assertEqual(2, mock_search.call_count)
+        self.assertEqual({}, _RESULT_CACHE.stats)
+
+    @mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+    @mock.patch("complaint_search.es_interface._get_index_version")
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_disabled(self, mock_search, mock_last_indexed):
+        mock_search.return_value = 'OK'
+
+        states_agg()
+        states_agg()
+        self.assertEqual(2, mock_search.call_count)
+        mock_last_indexed.assert_not_called()
+
+    @mock.patch("complaint_search.es_interface._META_CACHE_TTL", 0)
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_version_checked_without_meta_cache(self, mock_search):
+        version = {
+            'aggregations': {
+                'max_indexed_date': {'value_as_string': '2017-01-02'}
+            }
+        }
+        mock_search.side_effect = lambda **kwargs: (
+            version if kwargs['body'] is _INDEX_VERSION_BODY else 'OK'
+        )
+
+        self.assertEqual('OK', states_agg())
+        self.assertEqual('OK', states_agg())
+        # Two version checks and a single states query
+        self.assertEqual(3, mock_search.call_count)
+        self.assertEqual(
+            {'states_agg': {'hits': 1, 'misses': 1}}, _RESULT_CACHE.stats
+        )
@@ -0,0 +1,322 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+import mock
+from complaint_search import es_interface, rollup
+from complaint_search.defaults import AGG_EXCLUDE_FIELDS
+from complaint_search.metrics import REGISTRY
+from complaint_search.rollup import answer, build_rollup, find_rollup
+from complaint_search.serializer import TrendsInputSerializer
+from elasticsearch import Elasticsearch
+
+
+LAST_INDEXED = '2020-06-01T12:00:00.000Z'
+
+
+def complaint(date_received, product='Mortgage', sub_product=None,
+              issue='Trouble', company='Bank', state='VA', tags=None,
+              has_narrative=False):
+    return {
+        'date_received': date_received,
+        'product': product,
+        'sub_product': sub_product,
+        'issue': issue,
+        'sub_issue': None,
+        'company': company,
+        'state': state,
+        'tags': tags,
+        'has_narrative': has_narrative,
+    }
+
+
+COMPLAINTS = [
+    complaint('2020-01-06T12:00:00', sub_product='FHA', has_narrative=True),
+    complaint('2020-01-20T12:00:00', sub_product='FHA',
+              tags=['Older American', 'Servicemember']),
+    complaint('2020-03-02T12:00:00', sub_product='VA mortgage',
+              tags='Servicemember', has_narrative=True),
+    complaint('2020-03-03T12:00:00', product='Debt collection',
+              company='Collector', state='CA'),
+    complaint('2020-03-04T12:00:00', product='Debt collection',
+              company='Collector', state=None, has_narrative=True),
+]
+
+
+def date_histogram(interval):
+    return {'date_histogram': {'field': 'date_received', 'interval': interval}}
+
+
+class RollupTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.directory = tempfile.mkdtemp()
+        build_rollup(COMPLAINTS, LAST_INDEXED, self.directory)
+
+    def tearDown(self):
+        REGISTRY.clear()
+        shutil.rmtree(self.directory)
+
+    def answer(self, body):
+        return answer('trends', body, LAST_INDEXED, self.directory)
+
+    def test_build_rollup(self):
+        path = find_rollup(LAST_INDEXED, self.directory)
+        self.assertEqual(
+            os.path.join(self.directory, 'rollup-20200601T120000000Z.sqlite3'),
+            path
+        )
+
+        self.assertEqual(
+            (path, False),
+            build_rollup([], LAST_INDEXED, self.directory)
+        )
+
+        new_path, built = build_rollup([], '2020-06-02', self.directory)
+        self.assertTrue(built)
+        self.assertEqual(
+            [os.path.basename(new_path)], os.listdir(self.directory)
+        )
+        self.assertIsNone(find_rollup(LAST_INDEXED, self.directory))
+
+    def test_date_histogram(self):
+        aggs = {'months': dict(date_histogram('month'), aggs={
+            'diff': {'serial_diff': {'buckets_path': '_count'}}
+        })}
+        res = self.answer({'size': 0, 'aggs': aggs})
+
+        self.assertEqual(5, res['hits']['total'])
+        buckets = res['aggregations']['months']['buckets']
+        self.assertEqual([
+            ('2020-01-01T00:00:00.000Z', 2, None),
+            ('2020-02-01T00:00:00.000Z', 0, -2.0),
+            ('2020-03-01T00:00:00.000Z', 3, 3.0),
+        ], [
+            (b['key_as_string'], b['doc_count'],
+             b.get('diff', {}).get('value'))
+            for b in buckets
+        ])
+        self.assertEqual(1577836800000, buckets[0]['key'])
+
+    def test_week_buckets_start_on_monday(self):
+        res = self.answer({
+            'size': 0, 'aggs': {'weeks': date_histogram('week')}
+        })
+        buckets = res['aggregations']['weeks']['buckets']
+        self.assertEqual(
+            '2020-01-06T00:00:00.000Z', buckets[0]['key_as_string']
+        )
+        self.assertEqual(
+            '2020-03-02T00:00:00.000Z', buckets[-1]['key_as_string']
+        )
+        self.assertEqual(9, len(buckets))
+
+    def test_terms(self):
+        res = self.answer({'size': 0, 'aggs': {
+            'product': {
+                'terms': {'field': 'product.raw', 'size': 1},
+                'aggs': {'sub-product': {
+                    'terms': {'field': 'sub_product.raw', 'size': 0}
+                }}
+            },
+            'tags': {'terms': {'field': 'tags', 'size': 0}},
+            'state': {'terms': {'field': 'state', 'size': 0}},
+        }})
+
+        product = res['aggregations']['product']
+        self.assertEqual(2, product['sum_other_doc_count'])
+        self.assertEqual('Mortgage', product['buckets'][0]['key'])
+        self.assertEqual(3, product['buckets'][0]['doc_count'])
+        self.assertEqual(
+            [('FHA', 2), ('VA mortgage', 1)],
+            [(b['key'], b['doc_count'])
+             for b in product['buckets'][0]['sub-product']['buckets']]
+        )
+        self.assertEqual(
+            [('Servicemember', 2), ('Older American', 1)],
+            [(b['key'], b['doc_count'])
+             for b in res['aggregations']['tags']['buckets']]
+        )
+        # Complaints without a state have no bucket
+        self.assertEqual(
+            [('VA', 3), ('CA', 1)],
+            [(b['key'], b['doc_count'])
+             for b in res['aggregations']['state']['buckets']]
+        )
+
+    def test_filters(self):
+        res = self.answer({
+            'size': 0,
+            'query': {'query_string': {
+                'query': '*', 'fields': ['complaint_what_happened'],
+                'default_operator': 'AND'
+            }},
+            'aggs': {
+                'filtered': {
+                    'filter': {'bool': {
+                        'must': [{'range': {'date_received': {
+                            'from': '2020-01-10', 'to': '2020-03-03'
+                        }}}],
+                        'must_not': [{'terms': {'tags': ['Older American']}}]
+                    }},
+                    'aggs': {'min_date': {'min': {
+                        'field': 'date_received',
+                        'format': "yyyy-MM-dd'T'12:00:00-05:00"
+                    }}}
+                },
+                'all': {
+                    'global': {},
+                    'aggs': {'mortgages': {
+                        'filter': {'bool': {'should': [
+                            {'term': {'product.raw': 'Mortgage'}},
+                            {'term': {'company.raw': 'Nobody'}},
+                        ]}}
+                    }}
+                },
+            }
+        })
+
+        aggregations = res['aggregations']
+        # The query only matches complaints with a narrative
+        self.assertEqual(3, res['hits']['total'])
+        self.assertEqual(1, aggregations['filtered']['doc_count'])
+        self.assertEqual(
+            '2020-03-02T12:00:00-05:00',
+            aggregations['filtered']['min_date']['value_as_string']
+        )
+        self.assertEqual(5, aggregations['all']['doc_count'])
+        self.assertEqual(3, aggregations['all']['mortgages']['doc_count'])
+
+    def test_smallest_table(self):
+        by_product = rollup.plan({'size': 0, 'aggs': {
+            'product': {'terms': {'field': 'product.raw'}}
+        }})
+        self.assertEqual('complaints_by_product', by_product.table)
+
+        by_state = rollup.plan({'size': 0, 'aggs': {
+            'state': {'terms': {'field': 'state'}}
+        }})
+        self.assertEqual('complaints_by_state', by_state.table)
+
+        by_company = rollup.plan({'size': 0, 'aggs': {
+            'company': {
+                'filter': {'terms': {'company.raw': ['Bank']}},
+                'aggs': {'state': {'terms': {'field': 'state'}}}
+            }
+        }})
+        self.assertEqual('complaints_by_product', by_company.table)
+        self.assertEqual('complaints', by_company.scopes['company'].table)
+
+    def test_inexpressible(self):
+        for body in (
+            {'size': 10},
+            {'size': 0, 'query': {'match': {'complaint_what_happened': 'x'}}},
+            {'size': 0, 'aggs': {'zip': {'terms': {'field': 'zip_code'}}}},
+            {'size': 0, 'aggs': {'sent': {'filter': {'range': {
+                'date_sent_to_company': {'from': '2020-01-01'}
+            }}}}},
+            {'size': 0, 'aggs': {'months': date_histogram('5')}},
+        ):
+            self.assertIsNone(self.answer(body))
+
+        self.assertIn(
+            'ccdb_rollup_requests_total{function="trends",'
+            'result="inexpressible"} 5',
+            REGISTRY.exposition()
+        )
+
+    def test_missing_rollup(self):
+        self.assertIsNone(
+            answer('trends', {'size': 0}, '2020-06-02', self.directory)
+        )
+
+
+@mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+@mock.patch("complaint_search.es_interface._get_meta")
+class EsInterfaceRollupTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        build_rollup(COMPLAINTS, LAST_INDEXED, self.directory)
+        self.patch_directory = mock.patch.object(
+            rollup, '_ROLLUP_DIR', self.directory
+        )
+        self.patch_directory.start()
+
+    def tearDown(self):
+        self.patch_directory.stop()
+        shutil.rmtree(self.directory)
+
+    def trends(self, **data):
+        serializer = TrendsInputSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return es_interface.trends(
+            AGG_EXCLUDE_FIELDS, **serializer.validated_data
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends_from_rollup(self, mock_search, mock_meta):
+        mock_meta.return_value = {'last_indexed': LAST_INDEXED}
+
+        res = self.trends(
+            lens='product', sub_lens='sub_product', trend_interval='month',
+            field='all', not_tags=['Older American']
+        )
+
+        mock_search.assert_not_called()
+        aggregations = res['aggregations']
+        self.assertEqual(4, aggregations['dateRangeArea']['doc_count'])
+        # Ties are ordered by key
+        self.assertEqual(
+            [('Debt collection', 2), ('Mortgage', 2)],
+            [(b['key'], b['doc_count'])
+             for b in aggregations['product']['product']['buckets']]
+        )
+        mortgage = aggregations['product']['product']['buckets'][1]
+        # Most recent first
+        self.assertEqual(
+            ['2020-03-01T00:00:00.000Z', '2020-02-01T00:00:00.000Z',
+             '2020-01-01T00:00:00.000Z'],
+            [b['key_as_string'] for b in mortgage['trend_period']['buckets']]
+        )
+        # Sub lenses only keep the period before their latest
+        self.assertEqual(
+            [('FHA', []), ('VA mortgage', [])],
+            [(b['key'], b['trend_period']['buckets'])
+             for b in mortgage['product']['buckets']]
+        )
+        self.assertEqual(
+            5, aggregations['dateRangeBuckets']['doc_count']
+        )
+        self.assertEqual(
+            '2020-01-06T12:00:00-05:00', res['_meta']['date_min']
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends_from_index(self, mock_search, mock_meta):
+        mock_meta.return_value = {'last_indexed': LAST_INDEXED}
+        mock_search.return_value = {'aggregations': {}}
+
+        self.trends(lens='overview', trend_interval='year', search_term='x')
+
+        self.assertEqual(1, mock_search.call_count)
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_states_from_rollup(self, mock_search, mock_meta):
+        mock_meta.return_value = {'last_indexed': LAST_INDEXED}
+
+        res = es_interface.states_agg(
+            AGG_EXCLUDE_FIELDS, field='_all', state=['VA']
+        )
+
+        mock_search.assert_not_called()
+        state = res['aggregations']['state']
+        # The state filter doesn't apply to the state aggregation
+        self.assertEqual(5, state['doc_count'])
+        self.assertEqual(
+            ['VA', 'CA'], [b['key'] for b in state['state']['buckets']]
+        )
+        self.assertEqual(3, res['aggregations']['product']['doc_count'])
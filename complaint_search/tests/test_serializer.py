@@ -64,6 +64,21 @@ class SearchInputSerializerTests(TestCase):
             '"issue\u2022subissue"'
         ])
 
+    def test_is_valid__valid_search_after(self):
+        self.data['search_after'] = "12.5_3687283"
+        serializer = SearchInputSerializer(data=self.data)
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['search_after'],
+                         [12.5, "3687283"])
+
+    def test_is_valid__invalid_search_after(self):
+        self.data['search_after'] = "recent_3687283"
+        serializer = SearchInputSerializer(data=self.data)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors.get('search_after'), [
+            'search_after sort value needs to be a number'
+        ])
+
 
 class TrendsInputSerializerTests(TestCase):
 
@@ -0,0 +1,191 @@
+import threading
+
+from django.test import TestCase
+
+import mock
+from complaint_search import es_interface
+from complaint_search.metrics import REGISTRY
+from complaint_search.single_flight import SingleFlight, body_key
+from elasticsearch import Elasticsearch
+
+
+def run_together(count, target):
+    """Run target in count threads, returning their results in order"""
+    results = [None] * count
+
+    def run(position):
+        try:
+            results[position] = target()
+        except Exception as e:
+            results[position] = e
+
+    threads = [
+        threading.Thread(target=run, args=(position,))
+        for position in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_until(predicate):
+    for _ in range(500):
+        if predicate():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def followers(flights):
+    with flights._lock:
+        return sum(flight.followers for flight in flights._flights.values())
+
+
+class BlockingCall(object):
+    """A call blocking until released, counting how often it runs"""
+
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.released.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+
+    def tearDown(self):
+        REGISTRY.clear()
+
+    def test_body_key(self):
+        self.assertEqual(
+            body_key({'size': 0, 'from': 0}), body_key({'from': 0, 'size': 0})
+        )
+        self.assertNotEqual(
+            body_key({'sort': [{'_score': 'desc'}, {'date': 'desc'}]}),
+            body_key({'sort': [{'date': 'desc'}, {'_score': 'desc'}]})
+        )
+
+    def test_concurrent_calls_share_a_response(self):
+        flights = SingleFlight()
+        call = BlockingCall({'hits': {'hits': [{'_id': '1'}]}})
+
+        leader, results = run_together(
+            1, lambda: flights.do('search', 'key', call)
+        )
+        call.started.wait(5)
+        others, other_results = run_together(
+            3, lambda: flights.do('search', 'key', call)
+        )
+        self.assertTrue(wait_until(lambda: followers(flights) == 3))
+        call.released.set()
+        for thread in leader + others:
+            thread.join(5)
+
+        self.assertEqual(1, call.calls)
+        results += other_results
+        for res in results:
+            self.assertEqual(call.response, res)
+        # Every caller has its own copy
+        self.assertEqual(4, len(set(id(res) for res in results)))
+        self.assertIn(
+            'ccdb_coalesced_requests_total{function="search"} 3',
+            REGISTRY.exposition()
+        )
+
+        # Later calls run again
+        self.assertEqual(call.response, flights.do('search', 'key', call))
+        self.assertEqual(2, call.calls)
+
+    def test_errors_are_shared(self):
+        flights = SingleFlight()
+        call = BlockingCall(error=ValueError('Unavailable'))
+
+        leader, results = run_together(
+            1, lambda: flights.do('trends', 'key', call)
+        )
+        call.started.wait(5)
+        others, other_results = run_together(
+            1, lambda: flights.do('trends', 'key', call)
+        )
+        self.assertTrue(wait_until(lambda: followers(flights) == 1))
+        call.released.set()
+        for thread in leader + others:
+            thread.join(5)
+
+        self.assertEqual(1, call.calls)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIs(results[0], other_results[0])
+        self.assertEqual({}, flights._flights)
+
+    def test_disabled(self):
+        flights = SingleFlight(enabled=False)
+        response = {'hits': {}}
+        self.assertIs(response, flights.do('search', 'key', lambda: response))
+        self.assertEqual({}, flights._flights)
+
+
+@mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+class EsInterfaceSingleFlightTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+
+    def tearDown(self):
+        REGISTRY.clear()
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_states_agg_coalesced(self, mock_search):
+        call = BlockingCall({'aggregations': {}})
+        mock_search.side_effect = lambda **kwargs: call()
+
+        leader, results = run_together(
+            1, lambda: es_interface.states_agg(field='_all')
+        )
+        call.started.wait(5)
+        others, other_results = run_together(
+            2, lambda: es_interface.states_agg(field='_all')
+        )
+        self.assertTrue(
+            wait_until(lambda: followers(es_interface._IN_FLIGHT) == 2)
+        )
+        call.released.set()
+        for thread in leader + others:
+            thread.join(5)
+
+        self.assertEqual(1, mock_search.call_count)
+        self.assertEqual([{'aggregations': {}}] * 3, results + other_results)
+        self.assertIn(
+            'ccdb_coalesced_requests_total{function="states_agg"} 2',
+            REGISTRY.exposition()
+        )
+
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_different_bodies_not_coalesced(self, mock_search):
+        call = BlockingCall({'aggregations': {}})
+        mock_search.side_effect = lambda **kwargs: call()
+
+        leader, _ = run_together(
+            1, lambda: es_interface.states_agg(field='_all')
+        )
+        call.started.wait(5)
+        other, _ = run_together(
+            1, lambda: es_interface.states_agg(field='_all', state=['VA'])
+        )
+        self.assertTrue(wait_until(lambda: mock_search.call_count == 2))
+        call.released.set()
+        for thread in leader + other:
+            thread.join(5)
+
+        self.assertEqual(2, mock_search.call_count)
@@ -0,0 +1,169 @@
+import threading
+import time
+
+from django.test import TestCase
+
+import mock
+from complaint_search.sliced_scan import _seconds, sliced_scan
+from elasticsearch import TransportError
+
+
+class SliceClient(object):
+    """Scrolls `count` hits per slice in pages of `size`"""
+
+    def __init__(self, count, fail_slice=None):
+        self.count = count
+        self.fail_slice = fail_slice
+        self.lock = threading.Lock()
+        self.searches = []
+        self.scrolls = []
+        self.cleared = []
+        self.offsets = {}
+        self.sizes = {}
+
+    def page(self, slice_id):
+        if slice_id == self.fail_slice:
+            raise TransportError(500, 'search_phase_execution')
+        offset = self.offsets[slice_id]
+        end = min(offset + self.sizes[slice_id], self.count)
+        self.offsets[slice_id] = end
+        return {
+            '_scroll_id': str(slice_id),
+            '_shards': {'total': 1, 'failed': 0},
+            'hits': {'hits': [
+                {'_id': '{}-{}'.format(slice_id, i)}
+                for i in range(offset, end)
+            ]},
+        }
+
+    def search(self, body, scroll, size, **kwargs):
+        slice_id = body['slice']['id']
+        with self.lock:
+            self.searches.append(dict(kwargs, body=body, scroll=scroll))
+            self.offsets[slice_id] = 0
+            self.sizes[slice_id] = size
+        return self.page(slice_id)
+
+    def scroll(self, scroll_id, scroll, **kwargs):
+        with self.lock:
+            self.scrolls.append((scroll_id, scroll))
+        return self.page(int(scroll_id))
+
+    def clear_scroll(self, body, **kwargs):
+        with self.lock:
+            self.cleared.extend(body['scroll_id'])
+
+
+class SlicedScanTest(TestCase):
+
+    @mock.patch('elasticsearch.helpers.scan')
+    def test_single_slice_uses_scan(self, mock_scan):
+        mock_scan.return_value = iter([{'_id': '1'}])
+
+        hits = list(sliced_scan('client', {'query': {}}, size=7000))
+
+        self.assertEqual([{'_id': '1'}], hits)
+        mock_scan.assert_called_once_with(
+            'client', query={'query': {}}, size=7000
+        )
+
+    def test_unordered(self):
+        client = SliceClient(250)
+        query = {
+            'query': {'match_all': {}},
+            'sort': [{'_score': {'order': 'desc'}},
+                     {'complaint_id': {'order': 'desc'}}],
+        }
+
+        hits = list(sliced_scan(
+            client, query, slices=4, batch_size=10, scroll='10m', size=100,
+            index='INDEX'
+        ))
+
+        self.assertEqual(1000, len(hits))
+        self.assertEqual(1000, len(set(hit['_id'] for hit in hits)))
+        self.assertEqual(['_score', 'complaint_id'],
+                         [list(sort)[0] for sort in query['sort']])
+        self.assertEqual(4, len(client.searches))
+        slices = sorted(
+            search['body']['slice']['id'] for search in client.searches
+        )
+        self.assertEqual([0, 1, 2, 3], slices)
+        for search in client.searches:
+            self.assertEqual('10m', search['scroll'])
+            self.assertEqual('INDEX', search['index'])
+            self.assertEqual(4, search['body']['slice']['max'])
+            self.assertEqual({'match_all': {}}, search['body']['query'])
+            self.assertEqual(['_doc'], search['body']['sort'])
+        self.assertEqual(['0', '1', '2', '3'], sorted(client.cleared))
+
+    def test_ordered(self):
+        hits = list(sliced_scan(
+            SliceClient(250), {}, slices=4, ordered=True, batch_size=7,
+            size=30
+        ))
+
+        self.assertEqual([
+            '{}-{}'.format(slice_id, i)
+            for slice_id in range(4) for i in range(250)
+        ], [hit['_id'] for hit in hits])
+
+    def test_slice_error(self):
+        client = SliceClient(250, fail_slice=1)
+
+        with self.assertRaises(TransportError):
+            list(sliced_scan(client, {}, slices=2, ordered=True))
+
+    def test_bounded_and_stopped_early(self):
+        client = SliceClient(10000)
+
+        hits = sliced_scan(
+            client, {}, slices=2, ordered=True, max_batches=2,
+            batch_size=10, size=10
+        )
+        next(hits)
+        time.sleep(0.2)
+
+        # The queued batches, the batch being put and the one being read
+        for offset in client.offsets.values():
+            self.assertLessEqual(offset, 4 * 10)
+
+        hits.close()
+        for _ in range(20):
+            if len(client.cleared) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(['0', '1'], sorted(client.cleared))
+
+    @mock.patch('complaint_search.sliced_scan.time')
+    def test_blocked_slices_keep_their_scroll_alive(self, mock_time):
+        mock_time.time.return_value = 1000.0
+        client = SliceClient(10000)
+
+        hits = sliced_scan(
+            client, {}, slices=2, ordered=True, max_batches=1,
+            batch_size=10, size=10, scroll='10m'
+        )
+        next(hits)
+        time.sleep(0.2)
+        scrolls = len(client.scrolls)
+
+        # Half a keepalive later, the blocked slices fetch a page ahead
+        mock_time.time.return_value = 1300.0
+        time.sleep(0.2)
+        self.assertEqual(scrolls + 2, len(client.scrolls))
+        # A page past the batch read, queued and being put for slice 0, and
+        # past the batch queued and being put for slice 1
+        self.assertEqual({0: 40, 1: 30}, client.offsets)
+
+        # The pages fetched ahead are not lost
+        hits = [hit['_id'] for hit in hits]
+        self.assertEqual(19999, len(hits))
+        self.assertEqual('1-9999', hits[-1])
+
+    def test_seconds(self):
+        self.assertEqual(600, _seconds('10m'))
+        self.assertEqual(30, _seconds('30s'))
+        self.assertEqual(7200, _seconds('2h'))
+        with self.assertRaises(ValueError):
+            _seconds('ten minutes')
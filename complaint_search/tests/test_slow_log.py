@@ -0,0 +1,150 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+import mock
+from complaint_search import es_builders, es_interface, slow_log
+from elasticsearch import Elasticsearch
+from rest_framework import status
+
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+
+TRENDS_RESPONSE = {
+    'took': 20,
+    'aggregations': {
+        'dateRangeBuckets': {
+            'doc_count': 0, 'dateRangeBuckets': {'buckets': []}
+        },
+    },
+}
+
+
+@mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+class SlowQueryLogTest(TestCase):
+
+    def get_trends(self):
+        url = reverse('complaint_search:trends')
+        with mock.patch.object(Elasticsearch, 'search') as mock_search:
+            mock_search.return_value = copy.deepcopy(TRENDS_RESPONSE)
+            response = self.client.get(url, {
+                'lens': 'overview',
+                'trend_interval': 'month',
+                'date_received_min': '2019-01-01',
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @mock.patch('complaint_search.slow_log._SLOW_QUERY_RESPONSES', True)
+    @mock.patch('complaint_search.slow_log._SLOW_QUERY_SECONDS', 1e-9)
+    def test_slow_request_logged(self):
+        with self.assertLogs('complaint_search.slow_queries') as logs:
+            self.get_trends()
+
+        entries = list(slow_log.read(logs.output))
+        self.assertEqual(1, len(entries))
+        entry = entries[0]
+        self.assertEqual('trends', entry['endpoint'])
+        self.assertEqual('trends', entry['call']['function'])
+        self.assertEqual('overview', entry['call']['kwargs']['lens'])
+        self.assertEqual(
+            '2019-01-01', entry['call']['kwargs']['date_received_min']
+        )
+        self.assertIn('build', entry['phases'])
+        self.assertEqual(['search'], [q['method'] for q in entry['queries']])
+        self.assertIn(
+            'dateRangeBuckets', entry['queries'][0]['kwargs']['body']['aggs']
+        )
+        # Recorded before trends processed it
+        self.assertEqual(
+            TRENDS_RESPONSE, entry['queries'][0]['response']
+        )
+
+    @mock.patch('complaint_search.slow_log._SLOW_QUERY_SECONDS', 10)
+    def test_fast_request_not_logged(self):
+        with mock.patch.object(slow_log.log, 'warning') as mock_warning:
+            self.get_trends()
+        mock_warning.assert_not_called()
+
+    @mock.patch('complaint_search.slow_log._SLOW_QUERY_SECONDS', 1e-9)
+    def test_responses_not_recorded(self):
+        with self.assertLogs('complaint_search.slow_queries') as logs:
+            self.get_trends()
+
+        entry = next(slow_log.read(logs.output))
+        self.assertNotIn('response', entry['queries'][0])
+
+
+class ReplaySlowQueriesTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, entries):
+        path = os.path.join(self.directory, 'slow.log')
+        with open(path, 'w') as log:
+            for entry in entries:
+                log.write('WARNING slow ' + json.dumps(entry) + '\n')
+        return path
+
+    def test_replay(self):
+        body = {'size': 0, 'query': {'match_all': {}}}
+        path = self.write_log([{
+            'endpoint': 'trends',
+            'total': 2.5,
+            'phases': {},
+            'call': {
+                'function': 'trends',
+                'args': [],
+                'kwargs': {'lens': 'overview', 'trend_interval': 'year'},
+            },
+            'queries': [{
+                'method': 'search',
+                'kwargs': {'body': body},
+                'response': TRENDS_RESPONSE,
+            }],
+        }, {
+            'endpoint': 'suggest',
+            'total': 3.0,
+            'phases': {},
+            'call': {
+                'function': 'suggest', 'args': ['bank'], 'kwargs': {}
+            },
+            'queries': [{'method': 'suggest', 'kwargs': {}}],
+        }])
+
+        out = StringIO()
+        with mock.patch.object(
+            es_builders._BODY_CACHE, 'get'
+        ) as mock_body_get, mock.patch.object(
+            es_interface, '_clear_meta_cache',
+            wraps=es_interface._clear_meta_cache
+        ) as mock_clear_meta:
+            call_command(
+                'replay_slow_queries', path, iterations=2, stdout=out
+            )
+
+        # Nothing is served from the caches of a previous iteration
+        mock_body_get.assert_not_called()
+        self.assertGreaterEqual(mock_clear_meta.call_count, 4)
+        self.assertTrue(es_builders._BODY_CACHE.enabled)
+
+        lines = out.getvalue().splitlines()
+        self.assertIn('recorded ms', lines[0])
+        self.assertTrue(lines[1].startswith('trends'))
+        self.assertIn(' 2500.0 ', lines[1])
+        self.assertTrue(lines[1].endswith(' 1/1'))
+        self.assertTrue(lines[2].startswith('suggest'))
+        self.assertTrue(lines[2].endswith(' 0/1'))
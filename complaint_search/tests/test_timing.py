@@ -0,0 +1,171 @@
+import asyncio
+from unittest import skipUnless
+
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+
+import mock
+from complaint_search import timing
+from complaint_search.metrics import REGISTRY
+from complaint_search.middleware import TimingMiddleware
+from complaint_search.tests.es_interface_test_helpers import ASYNC_VIEWS
+from elasticsearch import Elasticsearch
+from rest_framework import status
+
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+
+class TimingsTest(TestCase):
+
+    def test_phases_outside_requests(self):
+        with timing.phase('build'):
+            pass
+        self.assertIsNone(timing.current())
+
+    def test_thread_local_var(self):
+        var = timing._ThreadLocalVar()
+        token = var.set({'es': 1.0})
+        self.assertEqual(var.get(), {'es': 1.0})
+        var.reset(token)
+        self.assertIsNone(var.get())
+
+    def test_timed_client(self):
+        client = mock.Mock()
+        client.search.return_value = {'took': 12}
+        client.msearch.return_value = {
+            'responses': [{'took': 5}, {'took': 30}, {'error': 'N/A'}]
+        }
+        timed = timing.TimedClient(client)
+
+        timings, token = timing.start()
+        try:
+            timed.search(body={})
+            timed.msearch(body=[])
+            timed.clear_scroll(scroll_id='1')
+            with timing.phase('process'):
+                pass
+        finally:
+            timing.finish(token)
+
+        self.assertEqual(
+            ['search', 'msearch'],
+            [method for method, seconds, took in timings.es_requests]
+        )
+        self.assertEqual(
+            [0.012, 0.03],
+            [took for method, seconds, took in timings.es_requests]
+        )
+        self.assertAlmostEqual(0.042, timings.phases['es_took'])
+        self.assertEqual(
+            ['es', 'es_took', 'process'], list(timings.phases)
+        )
+        client.clear_scroll.assert_called_once_with(scroll_id='1')
+
+    def test_server_timing(self):
+        timings = timing.Timings()
+        timings.add('build', 0.0012)
+        timings.add_es_request('search', 0.05, 0.04)
+
+        self.assertEqual(
+            'build;dur=1.2, es;desc="1 requests";dur=50.0, '
+            'es_took;dur=40.0, total;dur=60.0',
+            timings.server_timing(0.06)
+        )
+
+
+class TimingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+
+    def tearDown(self):
+        REGISTRY.clear()
+
+    @mock.patch("complaint_search.es_interface._RESULT_CACHE.max_entries", 0)
+    @mock.patch.object(Elasticsearch, 'search')
+    def test_trends(self, mock_search):
+        mock_search.return_value = {
+            'took': 20,
+            'aggregations': {'dateRangeBuckets': {'dateRangeBuckets': {}}},
+        }
+        url = reverse('complaint_search:trends')
+
+        response = self.client.get(
+            url, {'lens': 'overview', 'trend_interval': 'month'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        phases = [
+            entry.split(';')[0]
+            for entry in response['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(
+            ['build', 'es', 'es_took', 'process', 'serialize', 'total'],
+            phases
+        )
+        self.assertIn('es;desc="1 requests"', response['Server-Timing'])
+
+        with mock.patch('complaint_search.views._METRICS_TOKEN', 'secret'):
+            metrics = self.client.get(
+                reverse('complaint_search:metrics'),
+                HTTP_AUTHORIZATION='Bearer secret'
+            )
+        content = metrics.content.decode('utf-8')
+        self.assertIn(
+            'ccdb_requests_total{endpoint="trends",status="200"} 1', content
+        )
+        self.assertIn(
+            'ccdb_phase_seconds_count{endpoint="trends",phase="process"} 1',
+            content
+        )
+        self.assertIn(
+            'ccdb_es_took_seconds_sum{endpoint="trends",method="search"} '
+            '0.02', content
+        )
+
+    def test_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertFalse(asyncio.iscoroutinefunction(
+            TimingMiddleware(lambda request: HttpResponse())
+        ))
+        self.assertTrue(asyncio.iscoroutinefunction(
+            TimingMiddleware(get_response)
+        ))
+
+    @skipUnless(ASYNC_VIEWS, 'Async views need Python 3.7 and Django 3.1')
+    @override_settings(ROOT_URLCONF='ccdb5_api.asgi_urls')
+    async def test_async_views(self):
+        from django.test import AsyncClient
+
+        with mock.patch(
+            "complaint_search.es_interface._RESULT_CACHE.max_entries", 0
+        ), mock.patch.object(Elasticsearch, 'search') as mock_search:
+            mock_search.return_value = {'took': 20, 'aggregations': {}}
+            response = await AsyncClient().get(
+                reverse('complaint_search:states')
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('es;desc="1 requests"', response['Server-Timing'])
+        self.assertIn(
+            'ccdb_requests_total{endpoint="states",status="200"} 1',
+            REGISTRY.exposition()
+        )
+
+    def test_metrics_without_token(self):
+        response = self.client.get(reverse('complaint_search:metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @mock.patch('complaint_search.views._METRICS_TOKEN', 'secret')
+    def test_metrics_wrong_token(self):
+        response = self.client.get(
+            reverse('complaint_search:metrics'),
+            HTTP_AUTHORIZATION='Bearer guess'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,7 +1,11 @@
 from django.core.cache import cache
 
 import mock
-from complaint_search.throttling import _CCDB_UI_URL, DocumentAnonRateThrottle
+from complaint_search.throttling import (
+    _CCDB_UI_URL,
+    CCDBRateThrottle,
+    DocumentAnonRateThrottle,
+)
 from elasticsearch import TransportError
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -22,6 +26,7 @@ class DocumentTests(APITestCase):
 
     def tearDown(self):
         cache.clear()
+        CCDBRateThrottle.store.clear()
         DocumentAnonRateThrottle.rate = self.orig_document_anon_rate
 
     @mock.patch('complaint_search.es_interface.document')
@@ -0,0 +1,71 @@
+import mock
+from elasticsearch import TransportError
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+
+class FacetBucketsTests(APITestCase):
+
+    @mock.patch('complaint_search.es_interface.facet_buckets')
+    def test_facet_buckets_no_param(self, mock_esbuckets):
+        url = reverse('complaint_search:facet_buckets')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_esbuckets.assert_not_called()
+        self.assertDictEqual(
+            {'facet': [u'This field is required.']},
+            response.data)
+
+    @mock.patch('complaint_search.es_interface.facet_buckets')
+    def test_facet_buckets__valid(self, mock_esbuckets):
+        url = reverse('complaint_search:facet_buckets')
+        param = {
+            "facet": "company", "frm": 100, "size": 50, "state": ["VA"]
+        }
+        mock_esbuckets.return_value = 'OK'
+        response = self.client.get(url, param)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_esbuckets.assert_called_once_with(
+            facet='company',
+            field='complaint_what_happened',
+            format='default',
+            frm=100,
+            no_aggs=False,
+            no_highlight=False,
+            size=50,
+            sort='relevance_desc',
+            state=['VA']
+        )
+        self.assertEqual('OK', response.data)
+
+    @mock.patch('complaint_search.es_interface.facet_buckets')
+    def test_facet_buckets__invalid(self, mock_esbuckets):
+        url = reverse('complaint_search:facet_buckets')
+        for param, error in (
+            ({"facet": "sub_product"}, 'facet'),
+            ({"facet": "company", "size": 0}, 'size'),
+            ({"facet": "company", "size": 1001}, 'size'),
+            ({"facet": "company", "frm": 10001}, 'frm'),
+        ):
+            response = self.client.get(url, param)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            self.assertIn(error, response.data)
+        mock_esbuckets.assert_not_called()
+
+    @mock.patch('complaint_search.es_interface.facet_buckets')
+    def test_facet_buckets__transport_error(self, mock_esbuckets):
+        mock_esbuckets.side_effect = TransportError('N/A', "Error")
+        url = reverse('complaint_search:facet_buckets')
+        response = self.client.get(url, {"facet": "company"})
+        self.assertEqual(response.status_code, 424)
+        self.assertDictEqual(
+            {"error": "There was an error calling Elasticsearch"},
+            response.data)
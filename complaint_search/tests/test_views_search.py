@@ -1,4 +1,8 @@
 import copy
+import gzip
+import os
+import shutil
+import tempfile
 from datetime import date, datetime
 
 from django.conf import settings
@@ -11,9 +15,12 @@ from complaint_search.defaults import (
     FORMAT_CONTENT_TYPE_MAP,
     PARAMS,
 )
+from complaint_search.es_interface import MultiSearchError
+from complaint_search.export_admission import EXPORTS
 from complaint_search.serializer import SearchInputSerializer
 from complaint_search.throttling import (
     _CCDB_UI_URL,
+    CCDBRateThrottle,
     ExportAnonRateThrottle,
     ExportUIRateThrottle,
     SearchAnonRateThrottle,
@@ -40,12 +47,17 @@ class SearchTests(APITestCase):
         SearchAnonRateThrottle.rate = '2000/min'
         ExportUIRateThrottle.rate = '2000/min'
         ExportAnonRateThrottle.rate = '2000/min'
+        # Exports are not consumed, so their slots are never released
+        self.orig_exports_per_node = EXPORTS.per_node
+        EXPORTS.per_node = 2000
 
     def tearDown(self):
         cache.clear()
+        CCDBRateThrottle.store.clear()
         SearchAnonRateThrottle.rate = self.orig_search_anon_rate
         ExportUIRateThrottle.rate = self.orig_export_ui_rate
         ExportAnonRateThrottle.rate = self.orig_export_anon_rate
+        EXPORTS.per_node = self.orig_exports_per_node
 
     def buildDefaultParams(self, overrides):
         params = copy.deepcopy(PARAMS)
@@ -77,6 +89,160 @@ class SearchTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(response.has_header('Access-Control-Allow-Origin'))
 
+    def _build_snapshot(self, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'complaints-1.csv')
+        with open(path, 'wb') as snapshot:
+            snapshot.write(content)
+        return path
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__snapshot(self, mock_essearch, mock_find):
+        mock_find.return_value = self._build_snapshot(b'a,b\r\n1,2\r\n')
+        url = reverse('complaint_search:search')
+        response = self.client.get(url, {"format": "csv", "size": 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_essearch.assert_not_called()
+        mock_find.assert_called_once_with('csv')
+        self.assertEqual('bytes', response.get('Accept-Ranges'))
+        self.assertIn('text/csv', response.get('Content-Type'))
+        self.assertTrue(response.has_header('Access-Control-Allow-Origin'))
+        self.assertTrue(
+            response.get('Content-Disposition').startswith(
+                'attachment; filename="complaints-')
+        )
+        self.assertEqual(
+            b'a,b\r\n1,2\r\n', b''.join(response.streaming_content)
+        )
+        response.close()
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__snapshot_range(
+        self, mock_essearch, mock_find
+    ):
+        mock_find.return_value = self._build_snapshot(b'0123456789')
+        url = reverse('complaint_search:search')
+        for header, content, content_range in (
+            ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=-3', b'789', 'bytes 7-9/10'),
+            ('bytes=8-20', b'89', 'bytes 8-9/10'),
+        ):
+            response = self.client.get(
+                url, {"format": "csv"}, HTTP_RANGE=header
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_206_PARTIAL_CONTENT
+            )
+            self.assertEqual(content_range, response.get('Content-Range'))
+            self.assertEqual(str(len(content)),
+                             response.get('Content-Length'))
+            self.assertEqual(content, b''.join(response.streaming_content))
+
+        for header in ('bytes=10-', 'bytes=5-2', 'lines=1-2'):
+            response = self.client.get(
+                url, {"format": "csv"}, HTTP_RANGE=header
+            )
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+            )
+            self.assertEqual('bytes */10', response.get('Content-Range'))
+        mock_essearch.assert_not_called()
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__snapshot_accept_gzip(
+        self, mock_essearch, mock_find
+    ):
+        mock_find.return_value = self._build_snapshot(b'a,b\r\n1,2\r\n')
+        url = reverse('complaint_search:search')
+        response = self.client.get(
+            url, {"format": "csv"}, HTTP_ACCEPT_ENCODING='gzip, deflate',
+            HTTP_RANGE='bytes=2-5'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual('gzip', response.get('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response.get('Vary'))
+        self.assertFalse(response.has_header('Accept-Ranges'))
+        self.assertEqual(
+            b'a,b\r\n1,2\r\n',
+            gzip.decompress(b''.join(response.streaming_content))
+        )
+        mock_essearch.assert_not_called()
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__filtered_skips_snapshot(
+        self, mock_essearch, mock_find
+    ):
+        mock_essearch.return_value = iter([b'a,b\r\n'])
+        url = reverse('complaint_search:search')
+        response = self.client.get(
+            url, {"format": "csv", "product": "Mortgage"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_find.assert_not_called()
+        self.assertEqual(1, mock_essearch.call_count)
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__other_field_skips_snapshot(
+        self, mock_essearch, mock_find
+    ):
+        # Snapshots only hold the complaints with a narrative, in the
+        # default order
+        mock_essearch.return_value = iter([b'a,b\r\n'])
+        url = reverse('complaint_search:search')
+        for params in ({"field": "all"}, {"sort": "created_date_asc"}):
+            response = self.client.get(url, dict(params, format="csv"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_find.assert_not_called()
+        self.assertEqual(2, mock_essearch.call_count)
+        self.assertEqual('_all', mock_essearch.call_args_list[0][1]['field'])
+
+    @mock.patch('complaint_search.export_snapshot.find_snapshot')
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__no_snapshot(self, mock_essearch, mock_find):
+        mock_find.return_value = None
+        mock_essearch.return_value = iter([b'a,b\r\n'])
+        url = reverse('complaint_search:search')
+        response = self.client.get(url, {"format": "json"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_find.assert_called_once_with('json')
+        self.assertEqual(1, mock_essearch.call_count)
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__accept_gzip(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        mock_essearch.return_value = iter([b'a,b\r\n', b'1,2\r\n'])
+        response = self.client.get(
+            url, {"format": "csv"}, HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual('gzip', response.get('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response.get('Vary'))
+        self.assertIn('text/csv', response.get('Content-Type'))
+        self.assertEqual(
+            b'a,b\r\n1,2\r\n',
+            gzip.decompress(b''.join(response.streaming_content))
+        )
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_format__gz_not_encoded(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        mock_essearch.return_value = iter([b'gzipped'])
+        response = self.client.get(
+            url, {"format": "csv.gz"}, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('application/gzip', response.get('Content-Type'))
+        self.assertEqual(b'gzipped', b''.join(response.streaming_content))
+
     @mock.patch('complaint_search.views.datetime')
     @mock.patch('complaint_search.es_interface.search')
     def test_search_with_format(self, mock_essearch, mock_dt):
@@ -221,6 +387,36 @@ class SearchTests(APITestCase):
         )
         self.assertEqual('OK', response.data)
 
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_search_after__valid(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        params = {"search_after": "1591628400000_3687283"}
+        mock_essearch.return_value = 'OK'
+        response = self.client.get(url, params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        mock_essearch.assert_called_once_with(
+            agg_exclude=AGG_EXCLUDE_FIELDS,
+            **self.buildDefaultParams({
+                "search_after": [1591628400000, "3687283"]
+            })
+        )
+        self.assertEqual('OK', response.data)
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search_with_search_after__invalid_format(self, mock_essearch):
+        url = reverse('complaint_search:search')
+        params = {"search_after": "3687283"}
+        mock_essearch.return_value = 'OK'
+        response = self.client.get(url, params)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        mock_essearch.assert_not_called()
+        self.assertDictEqual(
+            {"search_after": [
+                'search_after is malformed, it needs to be '
+                '"sortvalue_complaintid"'
+            ]},
+            response.data)
+
     @mock.patch('complaint_search.es_interface.search')
     def test_search_with_frm__invalid_type(self, mock_essearch):
         url = reverse('complaint_search:search')
@@ -853,6 +1049,33 @@ class SearchTests(APITestCase):
             response.data
         )
 
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search__msearch_bad_request(self, mock_essearch):
+        mock_essearch.side_effect = MultiSearchError([
+            (0, 400, "SearchParseException"),
+        ])
+        url = reverse('complaint_search:search')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertDictEqual(
+            {"error": "Elasticsearch could not run your search"},
+            response.data
+        )
+
+    @mock.patch('complaint_search.es_interface.search')
+    def test_search__msearch_error(self, mock_essearch):
+        mock_essearch.side_effect = MultiSearchError([
+            (0, 400, "SearchParseException"),
+            (1, 503, "NoShardAvailableActionException"),
+        ])
+        url = reverse('complaint_search:search')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 424)
+        self.assertDictEqual(
+            {"error": "There was an error calling Elasticsearch"},
+            response.data
+        )
+
     @mock.patch('complaint_search.es_interface.search')
     def test_search__big_error(self, mock_essearch):
         mock_essearch.side_effect = MemoryError("Out of memory")
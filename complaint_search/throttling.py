@@ -1,7 +1,9 @@
 import os
+import time
 
+from complaint_search import rate_limit
 from complaint_search.defaults import EXPORT_FORMATS
-from rest_framework.throttling import AnonRateThrottle
+from rest_framework.throttling import AnonRateThrottle, BaseThrottle
 
 
 _CCDB_UI_URL = os.environ.get(
@@ -9,86 +11,120 @@ _CCDB_UI_URL = os.environ.get(
     'http://localhost:8000/data-research/consumer-complaints/search'
 )
 
+# Requests are counted in Redis when THROTTLE_REDIS_URL is set, so that
+# limits hold across workers, else per process
+_RATE_LIMITS = rate_limit.get_store(os.environ.get('THROTTLE_REDIS_URL', ''))
+
+
+def is_referred_from_ui(request):
+    referer = request.META.get('HTTP_REFERER')
+    return bool(referer) and _CCDB_UI_URL in referer
+
+
+def is_export(request):  # otherwise it is a search
+    return request.query_params.get("format") in EXPORT_FORMATS
+
 
 class CCDBRateThrottle(AnonRateThrottle):
     scope = 'ccdb'
+    store = _RATE_LIMITS
+
+    @classmethod
+    def applies(cls, ui, export):
+        """Whether the throttle limits requests from the UI or not, and
+        exports or searches"""
+        return True
+
+    def limit(self, ident):
+        """The key, emission interval and period of the limit of a client,
+        or None without a rate"""
+        if self.rate is None:
+            return None
+        key = self.cache_format % {'scope': self.scope, 'ident': ident}
+        return key, float(self.duration) / self.num_requests, self.duration
+
+    # Unlike the history of request times DRF keeps in the cache, the GCRA
+    # state of a client is a single number, updated atomically
+    def allow_request(self, request, view):
+        self.retry_after = 0
+        if not self.applies(self.is_referred_from_ui(request, view),
+                            self.is_export(request)):
+            return True
+
+        # Like AnonRateThrottle
+        if request.user and request.user.is_authenticated:
+            return True
+        limit = self.limit(self.get_ident(request))
+        if limit is None:
+            return True
+
+        self.retry_after = self.store.acquire(*limit, now=self.timer())
+        return self.retry_after == 0
+
+    def wait(self):
+        return self.retry_after
 
     def is_referred_from_ui(self, request, view):
-        return request.META.get('HTTP_REFERER') and \
-            request.META.get('HTTP_REFERER').find(_CCDB_UI_URL) != -1
+        return is_referred_from_ui(request)
 
-    def is_export(self, request):  # otherwise it is a search
-        return request.query_params.get("format") and \
-            request.query_params.get("format") in EXPORT_FORMATS
+    def is_export(self, request):
+        return is_export(request)
 
 
 class CCDBAnonRateThrottle(CCDBRateThrottle):
     scope = 'ccdb_anon'
 
-    def allow_request(self, request, view):
-        if not self.is_referred_from_ui(request, view):
-            return super(CCDBAnonRateThrottle, self).allow_request(
-                request, view
-            )
-        else:
-            return True
+    @classmethod
+    def applies(cls, ui, export):
+        return not ui and super(CCDBAnonRateThrottle, cls).applies(
+            ui, export)
 
 
 class CCDBUIRateThrottle(CCDBRateThrottle):
     scope = 'ccdb_ui'
 
-    def allow_request(self, request, view):
-        if self.is_referred_from_ui(request, view):
-            return super(CCDBUIRateThrottle, self).allow_request(request, view)
-        else:
-            return True
+    @classmethod
+    def applies(cls, ui, export):
+        return ui and super(CCDBUIRateThrottle, cls).applies(ui, export)
 
 # class SearchUIRateThrottle(CCDBUIRateThrottle):
 #     scope = 'ccdb_ui_search'
 #     # rate needs to be set if use
 
-#     def allow_request(self, request, view):
-#         if not self.is_export(request):
-#             return super(SearchUIRateThrottle, self).allow_request(
-#                     request, view)
-#         else:
-#             return True
+#     @classmethod
+#     def applies(cls, ui, export):
+#         return not export and super(SearchUIRateThrottle, cls).applies(
+#             ui, export)
 
 
 class SearchAnonRateThrottle(CCDBAnonRateThrottle):
     scope = 'ccdb_anon_search'
     rate = '20/min'
 
-    def allow_request(self, request, view):
-        if not self.is_export(request):
-            return super(SearchAnonRateThrottle, self).allow_request(
-                request, view)
-        else:
-            return True
+    @classmethod
+    def applies(cls, ui, export):
+        return not export and super(SearchAnonRateThrottle, cls).applies(
+            ui, export)
 
 
 class ExportUIRateThrottle(CCDBUIRateThrottle):
     scope = 'ccdb_ui_export'
     rate = '6/min'
 
-    def allow_request(self, request, view):
-        if self.is_export(request):
-            return super(ExportUIRateThrottle, self).allow_request(
-                request, view)
-        else:
-            return True
+    @classmethod
+    def applies(cls, ui, export):
+        return export and super(ExportUIRateThrottle, cls).applies(
+            ui, export)
 
 
 class ExportAnonRateThrottle(CCDBAnonRateThrottle):
     scope = 'ccdb_anon_export'
     rate = '2/min'
 
-    def allow_request(self, request, view):
-        if self.is_export(request):
-            return super(ExportAnonRateThrottle, self).allow_request(
-                request, view)
-        else:
-            return True
+    @classmethod
+    def applies(cls, ui, export):
+        return export and super(ExportAnonRateThrottle, cls).applies(
+            ui, export)
 
 
 # class DocumentUIRateThrottle(CCDBUIRateThrottle):
@@ -99,3 +135,52 @@ class ExportAnonRateThrottle(CCDBAnonRateThrottle):
 class DocumentAnonRateThrottle(CCDBAnonRateThrottle):
     scope = 'ccdb_anon_document'
     rate = '5/min'
+
+
+class CCDBThrottle(BaseThrottle):
+    """The throttle_classes of a view as a single throttle: the request is
+    classified once, and counted in every scope applying to it with a
+    single update of the store, only when all of them allow it."""
+
+    throttle_classes = ()
+    store = _RATE_LIMITS
+    timer = time.time
+
+    def allow_request(self, request, view):
+        self.retry_after = 0
+        # Like AnonRateThrottle
+        if request.user and request.user.is_authenticated:
+            return True
+
+        ui = is_referred_from_ui(request)
+        export = is_export(request)
+        throttles = [
+            throttle_class() for throttle_class in self.throttle_classes
+            if throttle_class.applies(ui, export)
+        ]
+        if not throttles:
+            return True
+
+        ident = self.get_ident(request)
+        limits = [throttle.limit(ident) for throttle in throttles]
+        limits = [limit for limit in limits if limit is not None]
+        if not limits:
+            return True
+
+        self.retry_after = self.store.acquire_many(limits, self.timer())
+        return self.retry_after == 0
+
+    def wait(self):
+        return self.retry_after
+
+
+class SearchThrottle(CCDBThrottle):
+    throttle_classes = (
+        SearchAnonRateThrottle,
+        ExportUIRateThrottle,
+        ExportAnonRateThrottle,
+    )
+
+
+class DocumentThrottle(CCDBThrottle):
+    throttle_classes = (DocumentAnonRateThrottle,)
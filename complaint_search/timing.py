@@ -0,0 +1,195 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from complaint_search.metrics import REGISTRY
+
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    # Python 3.6, which only serves the synchronous views
+    contextvars = None
+
+
+# -----------------------------------------------------------------------------
+# Request timings
+#
+# Where the time of a request goes: building query bodies ('build'), the
+# round trips to Elasticsearch ('es') and the time Elasticsearch reports
+# spending on them ('es_took'), processing responses ('process') and
+# rendering them ('serialize'). TimingMiddleware collects the timings of each
+# request, returns them in a Server-Timing header and adds them to the
+# metrics.
+# -----------------------------------------------------------------------------
+
+REQUESTS = REGISTRY.counter(
+    'ccdb_requests_total', 'Requests per endpoint and status code',
+    ('endpoint', 'status')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'ccdb_request_seconds', 'Time to respond to requests', ('endpoint',)
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    'ccdb_phase_seconds', 'Time spent in each phase of requests',
+    ('endpoint', 'phase')
+)
+ES_REQUEST_SECONDS = REGISTRY.histogram(
+    'ccdb_es_request_seconds', 'Round trip of Elasticsearch requests',
+    ('endpoint', 'method')
+)
+ES_TOOK_SECONDS = REGISTRY.histogram(
+    'ccdb_es_took_seconds', 'Time Elasticsearch spent on requests',
+    ('endpoint', 'method')
+)
+
+
+class _ThreadLocalVar(threading.local):
+    """The get, set and reset of a ContextVar, per thread"""
+
+    value = None
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        token = self.value
+        self.value = value
+        return token
+
+    def reset(self, token):
+        self.value = token
+
+
+# The timings of a request follow it into the threads of es_async when
+# contextvars is available
+if contextvars is not None:
+    _CURRENT = contextvars.ContextVar(
+        'complaint_search_timings', default=None
+    )
+else:  # pragma: no cover
+    _CURRENT = _ThreadLocalVar()
+
+
+def _took(method, response):
+    if not isinstance(response, dict):
+        return None
+    if method == 'msearch':
+        # The searches of an msearch run concurrently
+        took = [r['took'] for r in response.get('responses', ())
+                if 'took' in r]
+        return max(took) / 1000.0 if took else None
+    if 'took' in response:
+        return response['took'] / 1000.0
+    return None
+
+
+class Timings(object):
+
+    def __init__(self, record_responses=False):
+        self.start = time.time()
+        # Seconds spent in each phase
+        self.phases = OrderedDict()
+        # The method, round trip and took of each Elasticsearch request
+        self.es_requests = []
+        # The es_interface call answering the request, and the arguments
+        # of each Elasticsearch request for the slow query log, with a copy
+        # of its response before processing when recording responses
+        self.call = None
+        self.queries = []
+        self.record_responses = record_responses
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_es_request(self, method, seconds, took=None):
+        self.es_requests.append((method, seconds, took))
+        self.add('es', seconds)
+        if took is not None:
+            self.add('es_took', took)
+
+    def server_timing(self, total):
+        """The Server-Timing header value, in milliseconds"""
+        entries = []
+        for phase, seconds in self.phases.items():
+            if phase == 'es':
+                entries.append('es;desc="{} requests";dur={:.1f}'.format(
+                    len(self.es_requests), seconds * 1000))
+            else:
+                entries.append('{};dur={:.1f}'.format(phase, seconds * 1000))
+        entries.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(entries)
+
+    def observe(self, endpoint, status_code, total):
+        REQUESTS.inc(endpoint, str(status_code))
+        REQUEST_SECONDS.observe(total, endpoint)
+        for phase, seconds in self.phases.items():
+            PHASE_SECONDS.observe(seconds, endpoint, phase)
+        for method, seconds, took in self.es_requests:
+            ES_REQUEST_SECONDS.observe(seconds, endpoint, method)
+            if took is not None:
+                ES_TOOK_SECONDS.observe(took, endpoint, method)
+
+
+def current():
+    """The timings of the current request, or None outside of requests"""
+    return _CURRENT.get()
+
+
+def start(record_responses=False):
+    """Collect timings until finish is called with the returned token"""
+    timings = Timings(record_responses)
+    return timings, _CURRENT.set(timings)
+
+
+def finish(token):
+    _CURRENT.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to a phase of the current request"""
+    timings = _CURRENT.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.add(name, time.time() - start)
+
+
+class TimedClient(object):
+    """An Elasticsearch client recording its requests in the timings of the
+    current request"""
+
+    _TIMED_METHODS = ('count', 'msearch', 'scroll', 'search', 'suggest')
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in self._TIMED_METHODS:
+            return attr
+
+        def timed(*args, **kwargs):
+            timings = _CURRENT.get()
+            if timings is None:
+                return attr(*args, **kwargs)
+
+            start = time.time()
+            response = attr(*args, **kwargs)
+            timings.add_es_request(
+                name, time.time() - start, _took(name, response)
+            )
+            timings.queries.append((
+                name, kwargs,
+                copy.deepcopy(response) if timings.record_responses else None
+            ))
+            return response
+        return timed
@@ -25,6 +25,14 @@ urlpatterns = [
         name="suggest_zip"
     ),
     re_path(r'^_suggest', complaint_search.views.suggest, name="suggest"),
+    re_path(
+        r'^_buckets',
+        complaint_search.views.facet_buckets,
+        name="facet_buckets"
+    ),
+    re_path(
+        r'^metrics$', complaint_search.views.metrics, name="metrics"
+    ),
     re_path(
         r'^(?P<id>[0-9]+)$', complaint_search.views.document, name="complaint"
     ),
@@ -1,35 +1,50 @@
+import hmac
+import os
+import re
 from datetime import datetime
 
 from django.conf import settings
-from django.http import StreamingHttpResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_vary_headers
 
-from complaint_search import es_interface
+from complaint_search import es_interface, export_admission, export_snapshot
 from complaint_search.decorators import catch_es_error
 from complaint_search.defaults import (
     AGG_EXCLUDE_FIELDS,
     EXCLUDE_PREFIX,
     EXPORT_FORMATS,
     FORMAT_CONTENT_TYPE_MAP,
+    PARAMS,
+)
+from complaint_search.export import gzip_stream
+from complaint_search.metrics import REGISTRY
+from complaint_search.renderers import (
+    CSVGzipRenderer,
+    CSVRenderer,
+    DefaultRenderer,
+    NDJSONGzipRenderer,
+    NDJSONRenderer,
 )
-from complaint_search.renderers import CSVRenderer, DefaultRenderer
 from complaint_search.serializer import (
+    FacetBucketsInputSerializer,
     SearchInputSerializer,
     SuggestFilterInputSerializer,
     SuggestInputSerializer,
     TrendsInputSerializer,
 )
-from complaint_search.throttling import (
-    DocumentAnonRateThrottle,
-    ExportAnonRateThrottle,
-    ExportUIRateThrottle,
-    SearchAnonRateThrottle,
-)
+from complaint_search.throttling import DocumentThrottle, SearchThrottle
 from rest_framework import status
 from rest_framework.decorators import (
     api_view,
     renderer_classes,
     throttle_classes,
 )
+from rest_framework.exceptions import Throttled
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
@@ -51,6 +66,7 @@ QPARAMS_VARS = (
     'lens',
     'no_aggs',
     'no_highlight',
+    'search_after',
     'search_term',
     'size',
     'sort',
@@ -79,6 +95,10 @@ QPARAMS_LISTS = (
 
 QPARAMS_NOT_LISTS = [EXCLUDE_PREFIX + x for x in QPARAMS_LISTS]
 
+# Bearer token the metrics scraper sends, the metrics are not served without
+# one: behind a reverse proxy every client has the address of the proxy
+_METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 
 def _parse_query_params(query_params, validVars=None):
     if not validVars:
@@ -100,6 +120,9 @@ def _parse_query_params(query_params, validVars=None):
 # -----------------------------------------------------------------------------
 # Header methods
 
+_ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
 def _buildHeaders():
     # API Documentation hosted on Github pages needs GET access
     headers = {
@@ -116,6 +139,111 @@ def _buildHeaders():
     return headers
 
 
+def _accepts_gzip(request):
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return bool(_ACCEPTS_GZIP_RE.search(accept_encoding))
+
+
+def _export_filename(format):
+    return 'complaints-{}.{}'.format(
+        datetime.now().strftime('%Y-%m-%d_%H_%M'), format
+    )
+
+
+# -----------------------------------------------------------------------------
+# Export snapshots
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Bytes read from a snapshot at a time when serving a range
+_SNAPSHOT_BLOCK_SIZE = 64 * 1024
+
+
+def _is_unfiltered(validated_data):
+    # Parameters without defaults are filters, unless they're empty, and
+    # the field and sort have to be those of the snapshots
+    for key, value in validated_data.items():
+        if key in export_snapshot.SNAPSHOT_PARAMS:
+            if value != export_snapshot.SNAPSHOT_PARAMS[key]:
+                return False
+        elif key not in PARAMS and value:
+            return False
+    return True
+
+
+def _parse_range(header, size):
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # bytes=-500 is the last 500 bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as snapshot:
+        snapshot.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = snapshot.read(min(_SNAPSHOT_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _snapshot_response(request, path, format):
+    size = os.path.getsize(path)
+    range_header = request.META.get('HTTP_RANGE')
+    compressed = not format.endswith('.gz') and _accepts_gzip(request)
+
+    if compressed:
+        # Compressed as it is sent, so ranges of the file don't apply
+        response = StreamingHttpResponse(
+            gzip_stream(_read_range(path, 0, size - 1)),
+            content_type=FORMAT_CONTENT_TYPE_MAP[format]
+        )
+        response['Content-Encoding'] = 'gzip'
+    elif range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(path, start, end),
+            status=206,
+            content_type=FORMAT_CONTENT_TYPE_MAP[format]
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    else:
+        # Served with the server's file wrapper, e.g. sendfile
+        response = FileResponse(
+            open(path, 'rb'),
+            content_type=FORMAT_CONTENT_TYPE_MAP[format]
+        )
+
+    if not compressed:
+        response['Accept-Ranges'] = 'bytes'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        _export_filename(format)
+    )
+    return response
+
+
 # -----------------------------------------------------------------------------
 # Request Handlers: Complaints
 
@@ -124,12 +252,11 @@ def _buildHeaders():
     DefaultRenderer,
     JSONRenderer,
     CSVRenderer,
+    NDJSONRenderer,
+    CSVGzipRenderer,
+    NDJSONGzipRenderer,
 ))
-@throttle_classes([
-    SearchAnonRateThrottle,
-    ExportUIRateThrottle,
-    ExportAnonRateThrottle,
-])
+@throttle_classes([SearchThrottle])
 @catch_es_error
 def search(request):
 
@@ -149,13 +276,47 @@ def search(request):
             serializer.errors, status=status.HTTP_400_BAD_REQUEST
         )
 
-    results = es_interface.search(
-        agg_exclude=AGG_EXCLUDE_FIELDS, **serializer.validated_data)
     headers = _buildHeaders()
 
+    # Unfiltered exports are served from the snapshot of the index if built
+    if format in EXPORT_FORMATS and \
+            _is_unfiltered(serializer.validated_data):
+        path = export_snapshot.find_snapshot(format)
+        if path:
+            response = _snapshot_response(request, path, format)
+            for header in headers:
+                response[header] = headers[header]
+            return response
+
     if format not in EXPORT_FORMATS:
+        results = es_interface.search(
+            agg_exclude=AGG_EXCLUDE_FIELDS, **serializer.validated_data)
         return Response(results, headers=headers)
 
+    # Only a few exports stream at once, the others wait for their turn or
+    # are refused
+    lease = export_admission.EXPORTS.admit()
+    if lease is None:
+        exc = Throttled(export_admission.EXPORTS.retry_after)
+        return Response(
+            {'detail': exc.detail},
+            status=exc.status_code,
+            headers={'Retry-After': '%d' % exc.wait}
+        )
+
+    try:
+        results = es_interface.search(
+            agg_exclude=AGG_EXCLUDE_FIELDS, **serializer.validated_data)
+    except Exception:
+        lease.release()
+        raise
+
+    # Compress uncompressed exports when the client accepts it
+    compressed = not format.endswith('.gz') and _accepts_gzip(request)
+    if compressed:
+        results = gzip_stream(results)
+    results = lease.stream(results)
+
     # If format is in export formats, update its attachment response
     # with a filename
 
@@ -163,11 +324,13 @@ def search(request):
         streaming_content=results,
         content_type=FORMAT_CONTENT_TYPE_MAP[format]
     )
-    filename = 'complaints-{}.{}'.format(
-        datetime.now().strftime('%Y-%m-%d_%H_%M'), format
-    )
+    if compressed:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
     headerTemplate = 'attachment; filename="{}"'
-    response['Content-Disposition'] = headerTemplate.format(filename)
+    response['Content-Disposition'] = headerTemplate.format(
+        _export_filename(format)
+    )
     for header in headers:
         response[header] = headers[header]
 
@@ -235,7 +398,25 @@ def suggest_company(request):
 
 
 @api_view(['GET'])
-@throttle_classes([DocumentAnonRateThrottle, ])
+@catch_es_error
+def facet_buckets(request):
+    validVars = list(QPARAMS_VARS)
+    validVars.append('facet')
+
+    data = _parse_query_params(request.query_params, validVars)
+    serializer = FacetBucketsInputSerializer(data=data)
+
+    if not serializer.is_valid():
+        return Response(
+            serializer.errors, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = es_interface.facet_buckets(**serializer.validated_data)
+    return Response(results, headers=_buildHeaders())
+
+
+@api_view(['GET'])
+@throttle_classes([DocumentThrottle])
 @catch_es_error
 def document(request, id):
     results = es_interface.document(id)
@@ -282,3 +463,21 @@ def trends(request):
     headers = _buildHeaders()
 
     return Response(results, headers=headers)
+
+
+# -----------------------------------------------------------------------------
+# Request Handlers: Metrics
+
+def metrics(request):
+    # Only exposed to the scraper holding the token
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not _METRICS_TOKEN or not hmac.compare_digest(
+        authorization.encode('utf-8'),
+        ('Bearer ' + _METRICS_TOKEN).encode('utf-8')
+    ):
+        raise Http404
+
+    return HttpResponse(
+        REGISTRY.exposition(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )